@@ -0,0 +1,193 @@
+"""
+События использования: открытия материалов и видео, поисковые запросы, OTP.
+
+emit() не блокирует хендлер: событие кладётся в ограниченную очередь
+(переполнена — событие отбрасывается и попадает в счётчик dropped).
+Фоновый поток забирает очередь пачками, дописывает пачку в events.jsonl
+одним write и тут же прибавляет её к агрегатам в памяти — счётчикам по
+(вид, язык, ключ). Агрегаты периодически сохраняются в rollup-файл
+(tmp + os.replace) вместе со смещением в журнале, до которого они
+посчитаны; при старте читается rollup и доигрывается только хвост журнала.
+
+Запросы админа (top) идут по агрегатам, сырой журнал не читается.
+"""
+import heapq
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+QUERY_MAX = 64       # поисковые запросы длиннее обрезаем — агрегат не раздувается
+
+
+def rollup_keys(ev: dict):
+    """(вид, язык, ключ) агрегатов, к которым относится событие."""
+    e, lang = ev.get("e"), ev.get("l") or "*"
+    if e == "open":
+        yield "open", lang, ev["k"]
+    elif e == "search":
+        yield "search", lang, ev["q"]
+        if not ev.get("n"):
+            yield "miss", lang, ev["q"]
+    elif e == "otp":
+        yield "otp", "*", f"{ev['k']}:{ev['r']}"
+
+
+class EventLog:
+    def __init__(self, path: str = "events.jsonl", queue_size: int = 10000,
+                 flush_every: float = 1.0, rollup_every: float = 60.0, batch: int = 1000):
+        self.path = path
+        self.rollup_path = path + ".rollup.json"
+        self.flush_every = flush_every
+        self.rollup_every = rollup_every
+        self.batch = batch
+
+        self._q = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()          # агрегаты
+        self._agg = defaultdict(dict)          # вид -> {(язык, ключ): n}
+        self._offset = 0                       # байт журнала, учтённых в агрегатах
+        self.counters = {"written": 0, "dropped": 0, "rollups": 0}
+        self._stop = threading.Event()
+
+        self._load()
+        self._file = open(self.path, "ab")
+        self._thread = threading.Thread(target=self._run, name="events-writer", daemon=True)
+        self._thread.start()
+
+    # ─────────────── приём ───────────────
+    def emit(self, event: str, uid: int = None, lang: str = None, **fields):
+        ev = {"e": event, "t": int(time.time())}
+        if uid is not None:
+            ev["u"] = uid
+        if lang:
+            ev["l"] = lang
+        ev.update(fields)
+        if "q" in ev:
+            ev["q"] = " ".join(str(ev["q"]).lower().split())[:QUERY_MAX]
+        try:
+            self._q.put_nowait(ev)
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    # ─────────────── фоновая запись ───────────────
+    def _run(self):
+        last_rollup = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self._drain(block=True)
+                if time.monotonic() - last_rollup >= self.rollup_every:
+                    self.save_rollup()
+                    last_rollup = time.monotonic()
+            except Exception as e:
+                logging.error(f"events writer error: {e}")
+                self._stop.wait(1)
+
+    def _drain(self, block: bool) -> int:
+        events = []
+        try:
+            if block:
+                events.append(self._q.get(timeout=self.flush_every))
+            while len(events) < self.batch:
+                events.append(self._q.get_nowait())
+        except queue.Empty:
+            pass
+        if not events:
+            return 0
+        chunk = "".join(json.dumps(ev, ensure_ascii=False) + "\n" for ev in events).encode("utf-8")
+        self._file.write(chunk)
+        self._file.flush()
+        with self._lock:
+            for ev in events:
+                self._add(ev)
+            self._offset += len(chunk)
+        self.counters["written"] += len(events)
+        return len(events)
+
+    def _add(self, ev: dict):
+        for kind, lang, key in rollup_keys(ev):
+            agg = self._agg[kind]
+            agg[(lang, key)] = agg.get((lang, key), 0) + 1
+
+    # ─────────────── rollup ───────────────
+    def save_rollup(self):
+        with self._lock:
+            data = {"offset": self._offset,
+                    "counts": {kind: [[lang, key, n] for (lang, key), n in agg.items()]
+                               for kind, agg in self._agg.items()}}
+        tmp = self.rollup_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.rollup_path)
+        self.counters["rollups"] += 1
+
+    def _load(self):
+        try:
+            with open(self.rollup_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for kind, rows in data["counts"].items():
+                self._agg[kind] = {(lang, key): n for lang, key, n in rows}
+            self._offset = int(data["offset"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"events rollup unreadable, rebuilding from log: {e}")
+            self._agg.clear()
+            self._offset = 0
+
+        # доиграть хвост журнала после rollup
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size < self._offset:           # журнал заменили — считаем заново
+            self._agg.clear()
+            self._offset = 0
+        replayed = 0
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break                 # недописанная строка после падения
+                try:
+                    self._add(json.loads(line))
+                    replayed += 1
+                except (ValueError, KeyError):
+                    pass
+                self._offset += len(line)
+        if self._offset < size:
+            with open(self.path, "r+b") as f:
+                f.truncate(self._offset)
+        if replayed:
+            logging.info(f"events: replayed {replayed} log entries")
+
+    # ─────────────── запросы ───────────────
+    def top(self, kind: str, lang: str = None, n: int = 10) -> list:
+        """[(ключ, число)] по убыванию; lang=None — по всем языкам."""
+        with self._lock:
+            items = list(self._agg.get(kind, {}).items())
+        if lang is None:
+            total = defaultdict(int)
+            for (_, key), c in items:
+                total[key] += c
+            pairs = total.items()
+        else:
+            pairs = [(key, c) for (lg, key), c in items if lg == lang]
+        return heapq.nlargest(n, pairs, key=lambda kv: kv[1])
+
+    def stats(self) -> dict:
+        return {"queued": self._q.qsize(), **self.counters, "log_bytes": self._offset,
+                "keys": sum(len(a) for a in self._agg.values())}
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        try:
+            while self._drain(block=False):
+                pass
+            self.save_rollup()
+        except Exception as e:
+            logging.error(f"events close error: {e}")
+        self._file.close()
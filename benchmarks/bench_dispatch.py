@@ -0,0 +1,100 @@
+"""
+Цена выбора хендлера: цепочка фильтров telebot против таблиц Router.
+
+Регистрирует N шагов диалога, N команд и N префиксов callback и замеряет
+один апдейт, который попадает в последний из них (худший случай для
+перебора). Хендлеры пустые — считается только маршрутизация.
+Отдельно — решение о доступе из кэша и без него.
+
+    BOT_TOKEN=0:bench python benchmarks/bench_dispatch.py [--sizes 5,50,500] [--n 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import telebot  # noqa: E402
+from telebot import types  # noqa: E402
+
+from router import Router  # noqa: E402
+
+UID = 42
+
+
+def updates(n: int):
+    user = {"id": UID, "is_bot": False, "first_name": "u"}
+    msg = {"message_id": 1, "date": int(time.time()), "chat": {"id": UID, "type": "private"}, "from": user}
+    cmd = f"/cmd{n - 1}"
+    return {
+        "state": types.Update.de_json({"update_id": 1, "message": dict(msg, text="hello")}),
+        "command": types.Update.de_json({"update_id": 2, "message": dict(
+            msg, text=cmd, entities=[{"type": "bot_command", "offset": 0, "length": len(cmd)}])}),
+        "callback": types.Update.de_json({"update_id": 3, "callback_query": {
+            "id": "1", "from": user, "chat_instance": "1", "data": f"p{n - 1}_x", "message": dict(msg, text="m")}}),
+    }
+
+
+def build_telebot(n: int, state_of):
+    bot = telebot.TeleBot("0:bench", threaded=False)
+    noop = lambda _: None
+    for i in range(n):
+        bot.message_handler(commands=[f"cmd{i}"])(noop)
+    for i in range(n):
+        bot.message_handler(func=lambda m, s=f"s{i}": state_of(m.from_user.id) == s)(noop)
+    for i in range(n):
+        bot.callback_query_handler(func=lambda c, p=f"p{i}_": c.data.startswith(p))(noop)
+    return lambda u: bot.process_new_updates([u])
+
+
+def build_router(n: int, state_of):
+    router = Router(state_of=state_of)
+    noop = lambda _: None
+    for i in range(n):
+        router.command(f"cmd{i}")(noop)
+        router.state(f"s{i}")(noop)
+        router.callback(prefix=f"p{i}")(noop)
+    return router.dispatch
+
+
+def bench_routing(sizes, n: int):
+    print(f"{'routes':>6} {'update':>9} {'telebot us':>11} {'router us':>10}")
+    for size in sizes:
+        state = f"s{size - 1}"
+        state_of = lambda uid: state
+        tb, rt = build_telebot(size, state_of), build_router(size, state_of)
+        for kind, update in updates(size).items():
+            t_tb = timeit.timeit(lambda: tb(update), number=max(1, n // size))
+            t_rt = timeit.timeit(lambda: rt(update), number=n)
+            print(f"{size:>6} {kind:>9} {t_tb / max(1, n // size) * 1e6:>11.2f} {t_rt / n * 1e6:>10.2f}")
+
+
+def bench_access(n: int):
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ["PHONES_WATCH_SECS"] = "0"
+    os.chdir(tempfile.mkdtemp(prefix="bench_dispatch_"))
+    import bot
+
+    bot.users.update(UID, phone_ok=True, verified=True)
+    bot.access_reply(UID, "private")
+    cached = timeit.timeit(lambda: bot.access_reply(UID, "private"), number=n)
+    fresh = timeit.timeit(lambda: bot._access_decision(UID, "private"), number=n)
+    print(f"\naccess: cached {cached / n * 1e6:.2f} us, without cache {fresh / n * 1e6:.2f} us "
+          f"(USER_STORE={bot.USER_STORE})")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="5,50,500")
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+    bench_routing([int(x) for x in args.sizes.split(",")], args.n)
+    bench_access(args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Пропускная способность ShardedExecutor в зависимости от числа воркеров.
+
+Хендлер имитирует вызов Bot API (sleep), апдейты идут от CHATS чатов
+вперемешку. Заодно проверяется, что внутри одного чата порядок не нарушен.
+
+    python benchmarks/bench_executor.py [--updates 2000] [--chats 300] [--latency-ms 20]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dispatch import ShardedExecutor  # noqa: E402
+
+
+def run(workers: int, updates: int, chats: int, latency: float):
+    seen = defaultdict(list)
+    lock = threading.Lock()
+
+    def handler(item):
+        chat, seq = item
+        time.sleep(latency)
+        with lock:
+            seen[chat].append(seq)
+
+    ex = ShardedExecutor(handler, key=lambda item: item[0], workers=workers,
+                         maxsize=updates, name="bench").start()
+    t0 = time.perf_counter()
+    for i in range(updates):
+        ex.submit((i % chats, i), wait=True)
+    ex.join()
+    elapsed = time.perf_counter() - t0
+    ex.shutdown()
+
+    ordered = all(s == sorted(s) for s in seen.values())
+    return updates / elapsed, ordered
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--chats", type=int, default=300)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--workers", default="1,2,4,8,16,32")
+    args = ap.parse_args()
+
+    print(f"{'workers':>8} {'updates/s':>10} {'speedup':>8}  ordered")
+    base = None
+    for w in (int(x) for x in args.workers.split(",")):
+        rate, ordered = run(w, args.updates, args.chats, args.latency_ms / 1000)
+        base = base or rate
+        print(f"{w:>8} {rate:>10.1f} {rate / base:>7.1f}x  {ordered}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Сколько CPU экономит кэш клавиатур на одном нажатии.
+
+Сравнивает сборку InlineKeyboardMarkup + to_json() (как было на каждый callback)
+с готовым JSON из снимка каталога (menu_markup()).
+
+    BOT_TOKEN=0:bench python benchmarks/bench_keyboards.py [--n 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.chdir(tempfile.mkdtemp(prefix="bench_kb_"))   # users.json бенчмарка — во временной папке
+
+import bot  # noqa: E402
+
+MENUS = ["main", "materials", "videoguides", "contact", "back:materials"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+
+    print(f"{'menu':>16} {'build us':>9} {'cached us':>10} {'speedup':>8}")
+    for menu in MENUS:
+        build = timeit.timeit(lambda: bot.catalog.current.build_menu(menu, "ru").to_json(), number=args.n)
+        bot.menu_markup(menu, "ru")
+        cached = timeit.timeit(lambda: bot.menu_markup(menu, "ru"), number=args.n)
+        print(f"{menu:>16} {build / args.n * 1e6:>9.2f} {cached / args.n * 1e6:>10.2f} "
+              f"{build / cached:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
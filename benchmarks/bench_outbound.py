@@ -0,0 +1,78 @@
+"""
+SendScheduler против локальной заглушки Bot API с честным лимитом 30/с.
+
+Несколько потоков одновременно шлют сообщения в разные чаты: фоновая
+рассылка (bulk) и интерактивные ответы. Печатает фактический темп,
+число 429 и задержку интерактивных ответов.
+
+    python benchmarks/bench_outbound.py [--bulk 300] [--interactive 60]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import outbound  # noqa: E402
+from fake_botapi import FakeBotAPI  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bulk", type=int, default=300)
+    ap.add_argument("--interactive", type=int, default=60)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--limit", type=float, default=30.0, help="лимит заглушки, сообщений/с")
+    ap.add_argument("--rate", type=float, default=28.0, help="global_rate планировщика")
+    args = ap.parse_args()
+
+    api = FakeBotAPI(global_limit=args.limit, latency_ms=5).start()
+    session = requests.Session()
+    sched = outbound.SendScheduler(session.request, global_rate=args.rate)
+    url = api.url + "/bot0:bench/sendMessage"
+
+    bulk_jobs = list(range(args.bulk))
+    lock = threading.Lock()
+    latencies = []
+
+    def bulk_worker():
+        with outbound.bulk():
+            while True:
+                with lock:
+                    if not bulk_jobs:
+                        return
+                    i = bulk_jobs.pop()
+                sched("post", url, params={"chat_id": 10_000 + i, "text": "news"})
+
+    def interactive_worker(n):
+        for i in range(n):
+            t0 = time.perf_counter()
+            sched("post", url, params={"chat_id": 500 + i, "text": "reply"})
+            latencies.append(time.perf_counter() - t0)
+            time.sleep(0.1)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=bulk_worker) for _ in range(args.threads)]
+    threads.append(threading.Thread(target=interactive_worker, args=(args.interactive,)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    api.stop()
+
+    total = args.bulk + args.interactive
+    print(f"sent {total} in {elapsed:.1f}s -> {total / elapsed:.1f} msg/s (limit {args.limit}/s)")
+    print(f"429 from server: {api.errors_429}")
+    print(f"interactive latency p50={statistics.median(latencies) * 1000:.0f}ms "
+          f"max={max(latencies) * 1000:.0f}ms")
+    print("scheduler:", sched.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Задержка ответа при многих одновременных пользователях: потоки (bot.py) против asyncio (bot_async.py).
+
+Каждый пользователь проходит один и тот же путь: /start → язык → имя → разделы
+меню, и следующий шаг делает только после ответа на предыдущий. Bot API —
+локальная заглушка с задержкой, так что время уходит на ожидание сети.
+
+    python benchmarks/bench_runtime.py [--users 200] [--latency-ms 50] [--workers 8]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+from fake_botapi import FakeBotAPI  # noqa: E402
+
+STEPS = [("message", "/start"), ("callback", "lang_ru"), ("message", "Bench"),
+         ("callback", "materials"), ("callback", "main_menu"), ("callback", "videoguides"),
+         ("callback", "contact"), ("callback", "main_menu")]
+
+
+def make_update(update_id: int, uid: int, kind: str, value: str):
+    from telebot import types
+
+    user = {"id": uid, "is_bot": False, "first_name": "u"}
+    msg = {"message_id": update_id, "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+           "from": user, "text": value}
+    if kind == "message":
+        if value.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(value)}]
+        return types.Update.de_json({"update_id": update_id, "message": msg})
+    return types.Update.de_json({"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user, "chat_instance": "1", "data": value, "message": msg}})
+
+
+def report(name: str, latencies: list, elapsed: float):
+    lat = sorted(latencies)
+    p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+    print(f"{name:>6}: {len(lat)} steps in {elapsed:.1f}s -> {len(lat) / elapsed:.0f} upd/s, "
+          f"p50={p(0.5):.0f}ms p99={p(0.99):.0f}ms mean={statistics.mean(lat) * 1000:.0f}ms")
+
+
+def run_sync(core, users: list):
+    done = {}
+    lock = threading.Lock()
+    handler = core.update_executor.handler
+
+    def tracked(update):
+        try:
+            handler(update)
+        finally:
+            with lock:
+                ev = done.pop(update.update_id, None)
+            if ev:
+                ev.set()
+
+    core.update_executor.handler = tracked
+    core.update_executor.start()
+    latencies = []
+
+    def journey(uid):
+        for i, (kind, value) in enumerate(STEPS):
+            uid_ = uid * 100 + i
+            ev = threading.Event()
+            with lock:
+                done[uid_] = ev
+            t0 = time.perf_counter()
+            core.update_executor.submit(make_update(uid_, uid, kind, value), wait=True)
+            ev.wait()
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=journey, args=(u,)) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report("sync", latencies, time.perf_counter() - t0)
+
+
+def run_async(users: list):
+    import bot_async
+
+    latencies = []
+
+    async def journey(uid):
+        for i, (kind, value) in enumerate(STEPS):
+            t0 = time.perf_counter()
+            await bot_async._process(make_update(uid * 100 + i, uid, kind, value))
+            latencies.append(time.perf_counter() - t0)
+
+    async def main():
+        t0 = time.perf_counter()
+        await asyncio.gather(*(journey(u) for u in users))
+        report("async", latencies, time.perf_counter() - t0)
+
+    asyncio.run(main())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--workers", type=int, default=8)
+    args = ap.parse_args()
+
+    api = FakeBotAPI(latency_ms=args.latency_ms).start()
+    os.environ.update({
+        "BOT_TOKEN": "0:bench", "TELEGRAM_API_URL": api.url, "UPDATE_WORKERS": str(args.workers),
+        "TG_GLOBAL_RATE": "100000", "TG_CHAT_RATE": "1000", "TG_CHAT_BURST": "1000",
+        "REQUIRE_PHONE": "0", "REQUIRE_CODE": "0",
+    })
+    os.chdir(tempfile.mkdtemp(prefix="bench_rt_"))
+    import bot as core
+
+    print(f"{args.users} users x {len(STEPS)} steps, Bot API latency {args.latency_ms:.0f}ms, "
+          f"sync workers {args.workers}")
+    run_sync(core, [10_000 + u for u in range(args.users)])
+    run_async([20_000 + u for u in range(args.users)])
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Сколько стоит старт JsonUserStore на 10k / 100k / 1M пользователей.
+
+Для каждого размера готовит два каталога: старый users.json (как его писал
+прежний compact) и компактный users.json.snap. Каждый замер — отдельный
+процесс: время конструктора JsonUserStore, первого get() и пиковый RSS (Linux).
+
+    python benchmarks/bench_startup.py [--sizes 10000,100000,1000000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from storage import write_snapshot  # noqa: E402
+
+PROBE = r"""
+import sys, time
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+from storage import JsonUserStore
+t1 = time.perf_counter()
+store = JsonUserStore(sys.argv[2], flush_interval=3600)
+t2 = time.perf_counter()
+rec = store.get(sys.argv[3])
+t3 = time.perf_counter()
+assert rec is not None
+# VmHWM, а не ru_maxrss: тот наследует пик родителя через exec
+hwm = next(int(l.split()[1]) for l in open("/proc/self/status") if l.startswith("VmHWM:"))
+print(t2 - t1, t3 - t2, hwm / 1024, store.count("verified"))
+store._stop.set()       # без сворачивания при выходе — замеряем только старт
+"""
+
+
+def record(i: int) -> dict:
+    return {"name": f"user{i}", "verified": i % 3 == 0, "phone": f"+99450{i:07d}",
+            "phone_ok": i % 2 == 0, "active": True}
+
+
+def prepare(n: int, base: str):
+    legacy = os.path.join(base, f"legacy_{n}")
+    snap = os.path.join(base, f"snap_{n}")
+    os.makedirs(legacy)
+    os.makedirs(snap)
+    uid0 = 100_000_000
+    with open(os.path.join(legacy, "users.json"), "w", encoding="utf-8") as f:
+        json.dump({str(uid0 + i): record(i) for i in range(n)}, f, ensure_ascii=False, indent=2)
+    write_snapshot(os.path.join(snap, "users.json.snap"), ((str(uid0 + i), record(i)) for i in range(n)))
+    return [("users.json", os.path.join(legacy, "users.json")), ("snapshot", os.path.join(snap, "users.json"))], \
+        str(uid0 + n // 2)
+
+
+def probe(path: str, uid: str):
+    out = subprocess.check_output([sys.executable, "-c", PROBE, ROOT, path, uid], text=True,
+                                  stderr=subprocess.DEVNULL)
+    start, first_get, rss, _ = out.split()
+    return float(start), float(first_get), float(rss)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000")
+    args = ap.parse_args()
+
+    base = tempfile.mkdtemp(prefix="bench_startup_")
+    print(f"{'users':>8} {'format':>10} {'file MB':>8} {'start ms':>9} {'1st get us':>10} {'RSS MB':>7}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        t0 = time.perf_counter()
+        variants, uid = prepare(n, base)
+        print(f"# {n}: prepared in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+        for name, path in variants:
+            file = path if name == "users.json" else path + ".snap"
+            start, first_get, rss = probe(path, uid)
+            print(f"{n:>8} {name:>10} {os.path.getsize(file) / 2**20:>8.1f} {start * 1000:>9.1f} "
+                  f"{first_get * 1e6:>10.1f} {rss:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Цена приёма одного запроса вебхука до постановки в очередь.
+
+Тела разных видов: обычное сообщение, сообщение из группы (ALLOW_GROUPS=0),
+неподдерживаемый тип апдейта и запрос с чужим секретом. «old» — прежний
+путь: decode + Update.de_json каждого тела; «new» — проверка секрета,
+json_loads и accept_raw_update. Статус — ответ настоящего эндпоинта
+(тестовый клиент Flask, очередь подменена заглушкой).
+
+    python benchmarks/bench_webhook.py [--n 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def bodies() -> dict:
+    user = {"id": 42, "is_bot": False, "first_name": "u", "language_code": "ru"}
+    msg = {"message_id": 1, "date": int(time.time()), "from": user, "text": "привет " * 20,
+           "chat": {"id": 42, "type": "private", "first_name": "u"}}
+    group = dict(msg, chat={"id": -100123, "type": "supergroup", "title": "g"})
+    member = {"chat": group["chat"], "from": user, "date": msg["date"],
+              "old_chat_member": {"status": "member", "user": user},
+              "new_chat_member": {"status": "left", "user": user}}
+    return {
+        "private": {"update_id": 1, "message": msg},
+        "group": {"update_id": 2, "message": group},
+        "chat_member": {"update_id": 3, "chat_member": member},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ.update({"PHONES_WATCH_SECS": "0", "ALLOW_GROUPS": "0"})
+    os.chdir(tempfile.mkdtemp(prefix="bench_webhook_"))
+    import bot
+    from telebot import types
+
+    bot.update_executor.submit = lambda update, wait=False: True
+    client = bot.app.test_client()
+
+    def old(raw: bytes):
+        update = types.Update.de_json(raw.decode("utf-8"))
+        bot.count_update(update)
+        return update
+
+    def new(raw: bytes, secret: str):
+        if bot.webhook_allowed(secret, len(raw)):
+            return None
+        return bot.accept_raw_update(bot.json_loads(raw))
+
+    print(f"json: {bot.json_loads.__module__}")
+    print(f"{'body':>12} {'old us':>8} {'new us':>8} {'status':>6}")
+    cases = list(bodies().items()) + [("bad secret", bodies()["private"])]
+    for name, body in cases:
+        raw = json.dumps(body, ensure_ascii=False).encode()
+        secret = "x" * 64 if name == "bad secret" else bot.WEBHOOK_SECRET
+        t_old = timeit.timeit(lambda: old(raw), number=args.n) / args.n
+        t_new = timeit.timeit(lambda: new(raw, secret), number=args.n) / args.n
+        status = client.post(bot.WEBHOOK_PATH, data=raw, content_type="application/json",
+                             headers={"X-Telegram-Bot-Api-Secret-Token": secret}).status_code
+        print(f"{name:>12} {t_old * 1e6:>8.1f} {t_new * 1e6:>8.1f} {status:>6}")
+
+
+if __name__ == "__main__":
+    main()
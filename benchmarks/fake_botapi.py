@@ -0,0 +1,185 @@
+"""
+Локальная заглушка Telegram Bot API.
+
+Отвечает на /bot<token>/<method> так, как ответил бы Telegram (в объёме,
+который нужен боту), с настраиваемой задержкой и инъекцией 429.
+Бот направляется сюда переменной TELEGRAM_API_URL=http://127.0.0.1:<port>.
+
+    python benchmarks/fake_botapi.py --port 8081 --latency-ms 30 --rate-429 0.05
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 rate_429: float = 0.0, retry_after: int = 1, global_limit: float = 0.0):
+        """
+        rate_429     — доля запросов, на которые случайно отвечаем 429;
+        global_limit — если > 0, честный лимит сообщений/с: всё сверх него получает 429.
+        """
+        self.latency = latency_ms / 1000.0
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.global_limit = global_limit
+
+        self.calls = Counter()
+        self.errors_429 = 0
+        self.sent = []                 # (время, method, chat_id)
+        self._msg_ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._window = []
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _params(self):
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                n = int(self.headers.get("Content-Length") or 0)
+                if n:
+                    body = self.rfile.read(n).decode("utf-8", "replace")
+                    ctype = self.headers.get("Content-Type", "")
+                    if "json" in ctype:
+                        params.update(json.loads(body or "{}"))
+                    else:
+                        params.update(dict(parse_qsl(body)))
+                return url.path, params
+
+            def _reply(self, code: int, payload: dict):
+                data = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                path, params = self._params()
+                method = path.rsplit("/", 1)[-1]
+                code, payload = api.handle(method, params)
+                self._reply(code, payload)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    # ─────────────── логика ответов ───────────────
+    def _too_many(self, now: float) -> bool:
+        if self.rate_429 and random.random() < self.rate_429:
+            return True
+        if self.global_limit:
+            with self._lock:
+                self._window = [t for t in self._window if now - t < 1.0]
+                if len(self._window) >= self.global_limit:
+                    return True
+                self._window.append(now)
+        return False
+
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        msg = {
+            "message_id": next(self._msg_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+        }
+        msg.update(extra)
+        return msg
+
+    def handle(self, method: str, params: dict):
+        if self.latency:
+            time.sleep(self.latency)
+        now = time.monotonic()
+        with self._lock:
+            self.calls[method] += 1
+
+        if method not in ("getUpdates", "getMe", "setWebhook", "deleteWebhook") and self._too_many(now):
+            with self._lock:
+                self.errors_429 += 1
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+
+        with self._lock:
+            self.sent.append((now, method, params.get("chat_id")))
+
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self.get_updates(params)}
+        if method == "sendMessage":
+            return 200, {"ok": True, "result": self._message(params, text=params.get("text", ""))}
+        if method == "sendVideo":
+            return 200, {"ok": True, "result": self._message(
+                params, video={"file_id": params.get("video", ""), "file_unique_id": "v",
+                               "width": 1, "height": 1, "duration": 1})}
+        if method == "copyMessage":
+            return 200, {"ok": True, "result": {"message_id": next(self._msg_ids)}}
+        if method.startswith("edit"):
+            return 200, {"ok": True, "result": self._message(params, text=params.get("text", ""))}
+        if method == "getFile":
+            fid = params.get("file_id", "")
+            if fid.startswith("invalid"):     # для проверки валидации каталога
+                return 400, {"ok": False, "error_code": 400,
+                             "description": "Bad Request: wrong file identifier/HTTP URL specified"}
+            return 200, {"ok": True, "result": {"file_id": fid, "file_unique_id": fid[-8:]}}
+        return 200, {"ok": True, "result": True}
+
+    def get_updates(self, params: dict) -> list:
+        """Переопределяется генератором нагрузки; по умолчанию апдейтов нет."""
+        return []
+
+    # ─────────────── запуск ───────────────
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "http_429": self.errors_429, "sent": len(self.sent)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=int, default=1)
+    ap.add_argument("--global-limit", type=float, default=0.0)
+    args = ap.parse_args()
+    api = FakeBotAPI(args.host, args.port, args.latency_ms, args.rate_429,
+                     args.retry_after, args.global_limit)
+    print(f"fake Bot API on {api.url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
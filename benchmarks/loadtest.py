@@ -0,0 +1,327 @@
+"""
+Нагрузочный прогон бота целиком против локальной заглушки Bot API.
+
+Каждый синтетический пользователь проходит путь
+  /start → язык → имя → разделы меню и видео → поиск → номер телефона → OTP через WebApp
+и делает следующий шаг только после того, как бот обработал предыдущий.
+Апдейты доставляются так же, как в проде: POST на вебхук Flask-приложения
+или через getUpdates заглушки (long polling).
+
+Печатает upd/s, p50/p99 задержки апдейта (приём → обработан), время
+хендлеров по гистограммам /metrics, вызовы Bot API на апдейт, 429 и рост
+RSS. Каждый прогон дописывается в benchmarks/results/loadtest.jsonl.
+
+    python benchmarks/loadtest.py [--mode both] [--users 50] [--latency-ms 20] [--rate-429 0]
+    python benchmarks/loadtest.py --compare 10
+"""
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from fake_botapi import FakeBotAPI  # noqa: E402
+
+RESULTS = os.path.join(HERE, "results", "loadtest.jsonl")
+TOKEN = "0:loadtest"
+_ids = itertools.count(1)
+
+
+# ─────────────── заглушка с очередью апдейтов для polling ───────────────
+class PollingBotAPI(FakeBotAPI):
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self._updates = []
+        self._cv = threading.Condition()
+        self._update_ids = itertools.count(10**9)
+
+    def push(self, update: dict):
+        """В очередь getUpdates; update_id выдаётся здесь, чтобы он рос в порядке очереди."""
+        with self._cv:
+            update["update_id"] = next(self._update_ids)
+            self._updates.append(update)
+            self._cv.notify_all()
+
+    def get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + min(float(params.get("timeout") or 0), 5.0)
+        with self._cv:
+            # всё, что меньше offset, бот подтвердил
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cv.wait(left)
+            return self._updates[:limit]
+
+
+# ─────────────── синтетические апдейты ───────────────
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+
+def message(uid: int, text: str = None, **extra) -> dict:
+    msg = {"message_id": next(_ids), "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+           "from": _user(uid), **extra}
+    if text is not None:
+        msg["text"] = text
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_ids), "message": msg}
+
+
+def callback(uid: int, data: str) -> dict:
+    msg = {"message_id": next(_ids), "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+           "from": {"id": 1, "is_bot": True, "first_name": "bot"}, "text": "menu"}
+    return {"update_id": next(_ids), "callback_query": {
+        "id": str(next(_ids)), "from": _user(uid), "chat_instance": "1", "data": data, "message": msg}}
+
+
+def phone_of(uid: int) -> str:
+    return f"+99450{uid % 10**7:07d}"
+
+
+def init_data(uid: int) -> str:
+    """initData, подписанный так же, как его проверяет bot._verify_webapp_init_data."""
+    data = {"auth_date": str(int(time.time())), "query_id": f"q{uid}", "user": json.dumps({"id": uid})}
+    check = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
+    data["hash"] = hmac.new(hashlib.sha256(TOKEN.encode()).digest(), check.encode(), hashlib.sha256).hexdigest()
+    return urlencode(data)
+
+
+def journey(uid: int, gated: bool):
+    """Шаги пользователя: ("update", dict) или ("otp", None)."""
+    steps = [("update", message(uid, "/start")), ("update", callback(uid, "lang_ru")),
+             ("update", message(uid, f"Tester{uid}")),
+             ("update", callback(uid, "materials")), ("update", callback(uid, "main_menu")),
+             ("update", callback(uid, "videoguides")), ("update", callback(uid, "file_direct")),
+             ("update", callback(uid, "main_menu")),
+             ("update", callback(uid, "search")), ("update", message(uid, "перезагрузка")),
+             ("update", callback(uid, "contact"))]
+    phone = [("update", message(uid, contact={"phone_number": phone_of(uid), "first_name": "u", "user_id": uid})),
+             ("otp", None)]
+    # с включённым доступом по номеру/коду без них дальше /start не пустят
+    return phone + steps if gated else steps + phone
+
+
+# ─────────────── прогон ───────────────
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Harness:
+    def __init__(self, bot, api: PollingBotAPI, web_url: str):
+        self.bot = bot
+        self.api = api
+        self.web_url = web_url
+        self.http = requests.Session()
+        self._done = {}
+        self._lock = threading.Lock()
+        handler = bot.update_executor.handler
+
+        def tracked(update):
+            try:
+                handler(update)
+            finally:
+                with self._lock:
+                    ev = self._done.pop(update.update_id, None)
+                if ev:
+                    ev.set()
+
+        bot.update_executor.handler = tracked
+
+    def _deliver(self, mode: str, update: dict):
+        ev = threading.Event()
+        if mode == "polling":
+            with self._lock:      # tracked() не снимет отметку раньше, чем мы её поставим
+                self.api.push(update)
+                self._done[update["update_id"]] = ev
+        else:
+            with self._lock:
+                self._done[update["update_id"]] = ev
+            r = self.http.post(self.web_url + self.bot.WEBHOOK_PATH, json=update, timeout=30,
+                               headers={"X-Telegram-Bot-Api-Secret-Token": self.bot.WEBHOOK_SECRET})
+            if r.status_code != 200:
+                raise RuntimeError(f"webhook {r.status_code}")
+        if not ev.wait(60):
+            raise RuntimeError(f"update {update['update_id']} not handled in 60s")
+
+    def _otp(self, uid: int):
+        hdr = {"X-Init-Data": init_data(uid)}
+        code = self.http.post(self.web_url + "/api/otp/issue", headers=hdr, timeout=30).json().get("code")
+        r = self.http.post(self.web_url + "/api/otp/verify", headers=hdr, json={"code": code}, timeout=30).json()
+        if not r.get("ok"):
+            raise RuntimeError(f"otp failed: {r}")
+
+    def run(self, mode: str, uids: list, gated: bool) -> dict:
+        latencies, errors = [], []
+        calls_before = sum(v for k, v in self.api.stats()["calls"].items() if k != "getUpdates")
+        err429_before = self.api.errors_429
+        rss_before = rss_mb()
+
+        def user(uid):
+            for kind, update in journey(uid, gated):
+                t0 = time.perf_counter()
+                try:
+                    if kind == "otp":
+                        self._otp(uid)
+                    else:
+                        self._deliver(mode, update)
+                except Exception as e:
+                    errors.append(str(e))
+                    return
+                latencies.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=user, args=(u,)) for u in uids]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+
+        calls = sum(v for k, v in self.api.stats()["calls"].items() if k != "getUpdates") - calls_before
+        lat = sorted(latencies) or [0.0]
+        pct = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 1)
+        return {
+            "mode": mode, "users": len(uids), "steps": len(latencies), "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "elapsed_s": round(elapsed, 2), "upd_per_s": round(len(latencies) / elapsed, 1),
+            "p50_ms": pct(0.5), "p99_ms": pct(0.99), "mean_ms": round(statistics.mean(lat) * 1000, 1),
+            "api_calls_per_update": round(calls / max(1, len(latencies)), 2),
+            "http_429": self.api.errors_429 - err429_before,
+            "rss_growth_mb": round(rss_mb() - rss_before, 1),
+        }
+
+
+def handler_summary(bot) -> dict:
+    out = {}
+    for labels in bot.HANDLER_SECONDS.series():
+        s = bot.HANDLER_SECONDS.summary(labels)
+        out[labels[0]] = {"count": s["count"], "mean_ms": round(s["sum"] / max(1, s["count"]) * 1000, 2),
+                          "p50_le_ms": s["p50"] * 1000, "p99_le_ms": s["p99"] * 1000}
+    return out
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "?"
+
+
+def compare(n: int):
+    try:
+        with open(RESULTS, encoding="utf-8") as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        raise SystemExit(f"нет результатов в {RESULTS}")
+    print(f"{'when':>16} {'rev':>8} {'mode':>8} {'users':>5} {'upd/s':>7} {'p50':>7} {'p99':>7} "
+          f"{'api/upd':>7} {'429':>4} {'rss+MB':>7}")
+    for run in runs[-n:]:
+        for r in run["results"]:
+            print(f"{run['when']:>16} {run['rev']:>8} {r['mode']:>8} {r['users']:>5} {r['upd_per_s']:>7} "
+                  f"{r['p50_ms']:>7} {r['p99_ms']:>7} {r['api_calls_per_update']:>7} {r['http_429']:>4} "
+                  f"{r['rss_growth_mb']:>7}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=("webhook", "polling", "both"), default="both")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--latency-ms", type=float, default=20.0, help="задержка заглушки Bot API")
+    ap.add_argument("--rate-429", type=float, default=0.0, help="доля случайных 429 от заглушки")
+    ap.add_argument("--workers", type=int, default=8, help="UPDATE_WORKERS")
+    ap.add_argument("--gated", action="store_true", help="REQUIRE_PHONE=1 и REQUIRE_CODE=1")
+    ap.add_argument("--telegram-limits", action="store_true",
+                    help="оставить лимиты планировщика как для Telegram (иначе они не мешают замеру)")
+    ap.add_argument("--note", default="", help="пометка к прогону в результатах")
+    ap.add_argument("--compare", type=int, metavar="N", help="показать последние N прогонов и выйти")
+    args = ap.parse_args()
+    if args.compare:
+        return compare(args.compare)
+
+    api = PollingBotAPI(latency_ms=args.latency_ms, rate_429=args.rate_429).start()
+    uids = [10_000 + i for i in range(args.users * 2)]
+    env = {
+        "BOT_TOKEN": TOKEN, "TELEGRAM_API_URL": api.url, "UPDATE_WORKERS": str(args.workers),
+        "REQUIRE_PHONE": "1" if args.gated else "0", "REQUIRE_CODE": "1" if args.gated else "0",
+        "WEBAPP_URL": "https://example.invalid/webapp",
+        "ALLOWED_PHONES": ",".join(phone_of(u) for u in uids),
+        "OTP_USER_MAX": "100", "OTP_GLOBAL_RATE": "100000", "OTP_GLOBAL_BURST": "100000",
+        "PHONES_WATCH_SECS": "0",
+    }
+    if not args.telegram_limits:
+        env.update({"TG_GLOBAL_RATE": "100000", "TG_CHAT_RATE": "1000", "TG_CHAT_BURST": "1000"})
+    os.environ.update(env)
+    os.chdir(tempfile.mkdtemp(prefix="loadtest_"))   # users.json, state.db — во временной папке
+
+    rss_start = rss_mb()
+    import bot
+    from werkzeug.serving import make_server
+
+    web = make_server("127.0.0.1", 0, bot.app, threaded=True)
+    threading.Thread(target=web.serve_forever, daemon=True).start()
+    bot.update_executor.start()
+    harness = Harness(bot, api, f"http://127.0.0.1:{web.server_port}")
+
+    modes = ["webhook", "polling"] if args.mode == "both" else [args.mode]
+    results = []
+    for i, mode in enumerate(modes):
+        if mode == "polling":
+            threading.Thread(target=bot.poll_updates, kwargs={"timeout": 5},
+                             daemon=True).start()
+        res = harness.run(mode, uids[i * args.users:(i + 1) * args.users], args.gated)
+        results.append(res)
+        print(f"{mode:>8}: {res['steps']} steps in {res['elapsed_s']}s -> {res['upd_per_s']} upd/s, "
+              f"p50={res['p50_ms']}ms p99={res['p99_ms']}ms, {res['api_calls_per_update']} API calls/update, "
+              f"429={res['http_429']}, RSS +{res['rss_growth_mb']} MB, errors={res['errors']}")
+        if res["first_error"]:
+            print(f"          first error: {res['first_error']}")
+
+    handlers = handler_summary(bot)
+    print(f"\n{'handler':>18} {'count':>6} {'mean ms':>8} {'p50<=':>7} {'p99<=':>7}")
+    for name, h in sorted(handlers.items()):
+        print(f"{name:>18} {h['count']:>6} {h['mean_ms']:>8} {h['p50_le_ms']:>7g} {h['p99_le_ms']:>7g}")
+    print(f"\nRSS: {rss_start:.0f} MB at start, {rss_mb():.0f} MB at end")
+
+    os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+    with open(RESULTS, "a", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "when": time.strftime("%Y-%m-%d %H:%M"), "rev": git_rev(), "note": args.note,
+            "args": {k: v for k, v in vars(args).items() if k != "compare"},
+            "results": results, "handlers": handlers,
+            "rss_start_mb": round(rss_start, 1), "rss_end_mb": round(rss_mb(), 1),
+        }, ensure_ascii=False) + "\n")
+    api.stop()
+    web.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,747 +1,1422 @@
-from flask import Flask, request, jsonify
-import hmac, hashlib
-import threading
-import os
-import json
-import logging
-from functools import wraps
-import secrets
-import string
-import time
-
-import telebot
-from telebot import types
-from telebot.types import CallbackQuery as TGCallbackQuery
-from telebot.apihelper import ApiTelegramException
-from dotenv import load_dotenv
-from urllib.parse import parse_qsl
-
-# ─────────────────── ЛОГИ ───────────────────
-logging.basicConfig(filename='bot_errors.log', level=logging.ERROR)
-
-# ─────────────────── USERS ───────────────────
-users: dict = {}
-users_file = "users.json"
-
-def _save_users():
-    with open(users_file, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
-
-def ensure_user_record(user_id: int):
-    uid = str(user_id)
-    if uid not in users:
-        users[uid] = {"name": "", "verified": False, "phone": "", "phone_ok": False}
-        _save_users()
-    else:
-        rec = users[uid]
-        if "name" not in rec:      rec["name"] = ""
-        if "verified" not in rec:  rec["verified"] = False
-        if "phone" not in rec:     rec["phone"] = ""
-        if "phone_ok" not in rec:  rec["phone_ok"] = False
-
-try:
-    with open(users_file, "r", encoding="utf-8") as f:
-        loaded = json.load(f)
-        if isinstance(loaded, dict):
-            users = loaded
-            # миграция старого формата
-            for k, v in list(users.items()):
-                if isinstance(v, str):
-                    users[k] = {"name": v, "verified": False, "phone": "", "phone_ok": False}
-                else:
-                    if "name" not in v:     users[k]["name"] = ""
-                    if "verified" not in v: users[k]["verified"] = False
-                    if "phone" not in v:    users[k]["phone"] = ""
-                    if "phone_ok" not in v: users[k]["phone_ok"] = False
-            _save_users()
-        else:
-            users = {}
-except FileNotFoundError:
-    users = {}
-
-# ─────────────────── ENV ───────────────────
-load_dotenv(override=True)
-
-def _parse_int_set(env_name: str):
-    raw = (os.getenv(env_name) or "").strip()
-    if not raw:
-        return set()
-    return set(int(x) for x in raw.replace(" ", "").split(",") if x)
-
-# whitelist телефонов
-def normalize_phone(p: str) -> str:
-    if not p:
-        return ""
-    digits = "".join(ch for ch in str(p) if ch.isdigit())
-    return f"+{digits}" if digits else ""
-
-def _parse_phone_set_from_env(env_name: str) -> set[str]:
-    raw = (os.getenv(env_name) or "").strip()
-    if not raw:
-        return set()
-    parts = [x for x in raw.replace(" ", "").split(",") if x]
-    return {normalize_phone(x) for x in parts}
-
-def _parse_phone_set_from_file(path: str) -> set[str]:
-    s = set()
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                s.add(normalize_phone(line))
-    except FileNotFoundError:
-        pass
-    return s
-
-REQUIRE_PHONE       = os.getenv("REQUIRE_PHONE", "0") == "1"
-ALLOWED_PHONES_FILE = (os.getenv("ALLOWED_PHONES_FILE") or "").strip()
-
-def load_allowed_phones() -> set[str]:
-    s = _parse_phone_set_from_env("ALLOWED_PHONES")
-    if ALLOWED_PHONES_FILE:
-        s |= _parse_phone_set_from_file(ALLOWED_PHONES_FILE)
-    return {p for p in s if p and p != "+"}
-
-ALLOWED_SET = load_allowed_phones()
-
-TOKEN = (os.getenv("BOT_TOKEN") or "").strip()
-if not TOKEN:
-    raise ValueError("BOT_TOKEN не найден в переменных окружения")
-
-ADMIN_IDS   = _parse_int_set("ADMIN_IDS")
-ALLOW_GROUPS = os.getenv("ALLOW_GROUPS", "0") == "1"
-
-# WebApp/OTP/Webhook
-REQUIRE_CODE  = os.getenv("REQUIRE_CODE", "0") == "1"
-OTP_TTL_SECS  = int(os.getenv("OTP_TTL_SECS", "600"))
-OTP_LENGTH    = int(os.getenv("OTP_LENGTH", "6"))
-OTP_ATTEMPTS  = int(os.getenv("OTP_ATTEMPTS", "3"))
-USE_WEBHOOK   = os.getenv("USE_WEBHOOK", "0") == "1"
-PUBLIC_URL    = (os.getenv("PUBLIC_URL") or "").rstrip("/")
-WEBAPP_URL    = (os.getenv("WEBAPP_URL") or "").strip()
-
-# ──────────────── BOT ────────────────
-bot = telebot.TeleBot(TOKEN, parse_mode=None)
-
-# ──────────────── OTP ────────────────
-otp_store = {}  # uid -> {'code': '123456', 'exp': ts, 'attempts': 3}
-
-def _gen_otp(n: int) -> str:
-    return "".join(secrets.choice(string.digits) for _ in range(n))
-
-def issue_otp(uid: int) -> str:
-    code = _gen_otp(OTP_LENGTH)
-    otp_store[uid] = {"code": code, "exp": time.time() + OTP_TTL_SECS, "attempts": OTP_ATTEMPTS}
-    return code
-
-def check_otp(uid: int, code: str):
-    rec = otp_store.get(uid)
-    if not rec:
-        return False, "Код не запрошен."
-    if time.time() > rec["exp"]:
-        otp_store.pop(uid, None)
-        return False, "Код истёк. Запросите новый."
-    if code != rec["code"]:
-        rec["attempts"] -= 1
-        if rec["attempts"] <= 0:
-            otp_store.pop(uid, None)
-            return False, "Код заблокирован. Запросите новый."
-        return False, f"Неверный код. Осталось попыток: {rec['attempts']}"
-    otp_store.pop(uid, None)
-    return True, ""
-
-# ──────────────── КОНТЕНТ ────────────────
-file_paths = {
-    "product": "https://clck.ru/3NB2zY",
-    "sales": "https://clck.ru/3NB2wX",
-    "sticks": "https://clck.ru/3NB2ur",
-    "accessories": "https://clck.ru/3NB3aW",
-}
-VIDEO_FILE_IDS = {
-    "direct": "BAACAgIAAxkBAAIBZ2h457B6jJvSCJY7qYfqOZ_oSQjtAAIJeQACe2XJS73hNlvfZvP4NgQ",
-    "reboot": "BAACAgIAAxkBAAICcGh56dNWrQEKhRKT1SWdBNPsqbCSAAIpdAACw5XRSzq54nCgfjqQNgQ",
-    "intro": "BAACAgIAAxkBAAICqWh58qS32y4lcAABwTpXlzsrGMIELwACLXMAAntl0UsQKxQvBG_fLDYE",
-    "replacement": "CgACAgIAAxkBAAICzGh5-xBcF1InTNdiFGGthnxeLnQWAAL_cwACe2XRS2BVCLRNVS-fNgQ",
-    "return": "CgACAgIAAxkBAAICzmh5-3hrMswogfi0ZT0d7nqH9liWAAIKdAACe2XRS-e0JbA3KIndNgQ",
-    "unregisteredconsumer": "CgACAgIAAxkBAAIC0Gh5-7vPyvivL9O2qAyyEum-UWn5AAIPdAACe2XRS1AKLBQAAYZLOzYE",
-}
-texts = {
-    "ru": {
-        "welcome": "Здравствуйте, я Бот компании Ploom - Ваш помощник по обучению. Как я могу к вам обращаться?",
-        "name_reply": "Приятно познакомиться, {name}!\nВыберите раздел:",
-        "materials": "Материалы", "videoguides": "Видеоуроки", "contact": "Контакты", "search": "Поиск",
-        "choose_file": "Выберите нужный файл:", "back": "Назад", "contact_text": "Вы можете связаться с нами по следующим контактам:",
-        "file_titles": {
-            "direct": "Видео-инструкция Ploom Direct","reboot": "Перезагрузка PloomXAdvanced",
-            "replacement": "Замена в Phouse-IMS","return": "Возврат в Phouse-IMS",
-            "unregisteredconsumer": "Клиент без регистрации в Phouse-IMS","product": "Информация о продукте",
-            "sales": "Скрипты продаж","sticks": "Стики Sobranie","accessories": "Аксессуары"
-        }, "video_choice": "Выберите видеоурок:"
-    },
-    "az": {
-        "welcome":"Salam, mən Ploom şirkətinin Botuyam və Sizə təlimdə köməklik göstərəcəyəm. Sizə necə müraciət edə bilərəm?",
-        "name_reply":"Tanış olduğumuza şadam, {name}!\nZəhmət olmasa bölmə seçin:",
-        "materials":"Materiallar","videoguides":"Video dərslər","contact":"Əlaqə","search":"Axtarış",
-        "choose_file":"Zəhmət olmasa faylı seçin:","back":"Geri","contact_text":"Aşağıdakı şəxslərlə əlaqə saxlaya bilərsiniz:",
-        "file_titles":{
-            "direct":"Ploom Direct üzrə Video təlimat","reboot":"PloomXAdvanced Sıfırlanması",
-            "replacement":"Dəyisdirilmə Phouse-IMS","return":"Qaytarılma Phouse-IMS",
-            "unregisteredconsumer":"Qeydiyyatsız müştəri Phouse-IMS","product":"Məhsul haqqında məlumat",
-            "sales":"Satış skriptləri","sticks":"Sobranie Stikləri","accessories":"Aksessuarlar"
-        },"video_choice":"Video dərslər seçin:"
-    },
-    "en": {
-        "welcome":"Hello, I am the Ploom company Bot, and I will help You with your training. How can I address You?",
-        "name_reply":"Nice to meet you, {name}!\nPlease choose a section:",
-        "materials":"Materials","videoguides":"Video Lessons","contact":"Contact","search":"Search",
-        "choose_file":"Please choose a file:","back":"Back","contact_text":"You can contact us via:",
-        "file_titles":{
-            "direct":"Video Instructions of Ploom Direct","reboot":"How to reboot PloomXAdvanced",
-            "replacement":"Replacement Phouse-IMS","return":"Return&Refund Phouse-IMS",
-            "unregisteredconsumer":"Unregistered consumer Phouse-IMS","product":"Product Info",
-            "sales":"Sales Scripts","sticks":"Sobranie Sticks","accessories":"Accessories"
-        },"video_choice":"Choose a video lesson:"
-    }
-}
-user_data = {}
-search_keywords = {
-    "direct": ["direct","ploom direct","видео инструкция","инструкция","video instruction"],
-    "reboot": ["reboot","reset","перезагрузка","сброс","restart"],
-    "replacement": ["replacement","замена","phouse-ims","замена phouse-ims"],
-    "return": ["return","refund","возврат","phouse-ims"],
-    "unregisteredconsumer": ["unregistered","consumer","клиент","без регистрации","phouse-ims"],
-    "product": ["product","продукт","информация","info","продукт информация"],
-    "sales": ["sales","продажи","скрипты","scripts"],
-    "sticks": ["sticks","stiks","sobranie","стики"],
-    "accessories": ["accessories","аксессуары"],
-}
-
-# ──────────────── ACCESS ────────────────
-def maybe_answer_callback(update):
-    try:
-        if isinstance(update, TGCallbackQuery):
-            bot.answer_callback_query(update.id)
-    except Exception:
-        pass
-
-def require_access(handler):
-    """
-    Доступ только для:
-      - админов, ИЛИ
-      - пользователей с phone_ok=True (номер в whitelist) + (если включено) verified=True (OTP через WebApp)
-    """
-    @wraps(handler)
-    def wrapper(update, *args, **kwargs):
-        if isinstance(update, TGCallbackQuery):
-            uid = update.from_user.id
-            chat_id = update.message.chat.id
-            chat_type = getattr(update.message.chat, "type", "private")
-        else:
-            uid = update.from_user.id
-            chat_id = update.chat.id
-            chat_type = getattr(update.chat, "type", "private")
-
-        ensure_user_record(uid)
-
-        if uid in ADMIN_IDS:
-            return handler(update, *args, **kwargs)
-
-        if not ALLOW_GROUPS and chat_type in ("group", "supergroup"):
-            return
-
-        rec = users.get(str(uid), {})
-
-        if REQUIRE_PHONE and not rec.get("phone_ok"):
-            kb = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-            kb.add(types.KeyboardButton("Подтвердить номер 📱", request_contact=True))
-            bot.send_message(
-                chat_id,
-                "Доступ только для номеров из списка.\n"
-                "Нажмите «Подтвердить номер 📱», чтобы отправить свой номер из Telegram.",
-                reply_markup=kb
-            )
-            maybe_answer_callback(update)
-            return
-
-        if REQUIRE_CODE and not rec.get("verified", False):
-            kb = types.InlineKeyboardMarkup()
-            if WEBAPP_URL:
-                kb.add(types.InlineKeyboardButton(
-                    "Открыть форму подтверждения",
-                    web_app=types.WebAppInfo(url=WEBAPP_URL)
-                ))
-                bot.send_message(
-                    chat_id,
-                    "🔒 Требуется подтверждение входа. Откройте форму и завершите подтверждение.",
-                    reply_markup=kb
-                )
-            else:
-                bot.send_message(chat_id, "WEBAPP_URL не настроен. Обратитесь к администратору.")
-            maybe_answer_callback(update)
-            return
-
-        return handler(update, *args, **kwargs)
-    return wrapper
-
-# ──────────────── WebApp (Flask) ────────────────
-app = Flask(__name__)
-
-HTML_WEBAPP = r"""
-<!doctype html><html lang="ru"><head>
-<meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
-<script src="https://telegram.org/js/telegram-web-app.js"></script>
-<title>Подтверждение доступа</title>
-<style>
-  body{background:#111;color:#fff;font-family:system-ui,-apple-system,Segoe UI,Roboto,Arial,sans-serif;margin:0;padding:24px}
-  h1{font-size:20px;margin:0 0 16px}
-  .small{opacity:.8;font-size:12px;text-align:center;margin-top:8px}
-  .boxes{display:flex;gap:10px;justify-content:center;margin:24px 0}
-  .box{width:44px;height:56px;border-radius:12px;border:1px solid #333;display:flex;align-items:center;justify-content:center;font-size:24px;background:#1a1a1a}
-  #err{color:#f66;margin-top:8px;min-height:20px;text-align:center}
-  .btn{display:block;width:100%;padding:14px;border-radius:12px;border:none;background:#2ea44f;color:#fff;font-size:16px;margin-top:12px}
-  .sec{display:flex;gap:10px}
-  input[type=tel]{opacity:0;position:absolute;left:-9999px}
-</style></head><body>
-<h1>Подтверждение доступа</h1>
-<div class="small">Нажмите «Получить код», затем «Подтвердить».</div>
-<div class="boxes" id="boxes"></div>
-<div id="err"></div>
-<div class="sec">
-  <button class="btn" id="btnIssue" style="background:#444">Получить код</button>
-  <button class="btn" id="btnSend" disabled>Подтвердить</button>
-</div>
-<input id="hid" inputmode="numeric" pattern="[0-9]*" type="tel" maxlength="6" autocomplete="one-time-code" />
-<script>
-const tg = window.Telegram.WebApp; tg.expand();
-const initData = tg.initData || "";
-
-const hid = document.getElementById('hid');
-const boxes = document.getElementById('boxes');
-const btnIssue = document.getElementById('btnIssue');
-const btnSend = document.getElementById('btnSend');
-const err = document.getElementById('err');
-
-for(let i=0;i<6;i++){ const d=document.createElement('div'); d.className='box'; boxes.appendChild(d); }
-function render(){
-  const v=hid.value.replace(/\D/g,"").slice(0,6);
-  hid.value=v; [...boxes.children].forEach((b,i)=>{ b.textContent = v[i] ? v[i] : "" });
-  btnSend.disabled = v.length!==6;
-}
-boxes.addEventListener('click', ()=>hid.focus()); render();
-
-btnIssue.addEventListener('click', async ()=>{
-  try{
-    if(!initData){ err.textContent='WebApp открыт вне Telegram. Запустите форму из бота.'; return; }
-    const r = await fetch('/api/otp/issue?init_data=' + encodeURIComponent(initData), {
-      method:'POST',
-      headers:{'X-Init-Data': initData, 'Content-Type':'application/json'},
-      body: JSON.stringify({init_data: initData})
-    });
-    const j = await r.json();
-    if(!j.ok){ err.textContent = j.error || 'Не удалось получить код'; return; }
-    document.getElementById('hid').value = (j.code || '').toString().slice(0,6);
-    render();
-    err.textContent = 'Код сгенерирован. Нажмите «Подтвердить». Срок: ' + j.ttl_min + ' мин.';
-    hid.focus();
-  }catch(e){ err.textContent = 'Сеть недоступна'; }
-});
-
-btnSend.addEventListener('click', async ()=>{
-  try{
-    const code = hid.value;
-    const r = await fetch('/api/otp/verify?init_data=' + encodeURIComponent(initData), {
-      method:'POST',
-      headers:{'X-Init-Data': initData, 'Content-Type':'application/json'},
-      body: JSON.stringify({code, init_data: initData})
-    });
-    const j = await r.json();
-    if(!j.ok){ err.textContent = j.error || 'Код не принят'; return; }
-    tg.showAlert('Доступ подтверждён'); tg.close();
-  }catch(e){ err.textContent = 'Сеть недоступна'; }
-});
-</script></body></html>
-"""
-
-def _verify_webapp_init_data(init_data: str):
-    """
-    Каноничная проверка подписи WebApp. Возвращает {"user_id": int} или None.
-    """
-    try:
-        if not init_data:
-            return None
-        data = dict(parse_qsl(init_data, strict_parsing=True))
-        recv_hash = data.pop('hash', None)
-        if not recv_hash:
-            return None
-        data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
-        secret = hashlib.sha256(TOKEN.encode()).digest()
-        calc_hash = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
-        if calc_hash != recv_hash:
-            return None
-        user_json = data.get('user')
-        if not user_json:
-            return None
-        user = json.loads(user_json)
-        return {"user_id": int(user["id"])}
-    except Exception as e:
-        logging.error(f"verify_webapp_init_data error: {e}")
-        return None
-
-def _extract_init_data():
-    """
-    Берём init_data из заголовка, query и/или body — что дойдёт.
-    """
-    init_data = request.headers.get('X-Init-Data', '') or ""
-    if not init_data:
-        init_data = request.args.get('init_data', '') or ""
-    if not init_data:
-        init_data = (request.get_json(silent=True) or {}).get('init_data', '') or ""
-    return init_data
-
-@app.get("/webapp")
-def webapp_page():
-    return HTML_WEBAPP
-
-@app.post("/api/otp/issue")
-def api_issue():
-    init_data = _extract_init_data()
-    info = _verify_webapp_init_data(init_data)
-    if not info:
-        return jsonify(ok=False, error="bad signature"), 403
-    uid = info["user_id"]
-
-    # проверка номера (если включена)
-    if REQUIRE_PHONE:
-        ensure_user_record(uid)
-        if not users[str(uid)].get("phone_ok"):
-            return jsonify(ok=False, error="phone not approved"), 403
-
-    code = issue_otp(uid)
-    return jsonify(ok=True, code=code, ttl=OTP_TTL_SECS, ttl_min=max(1, OTP_TTL_SECS//60))
-
-@app.post("/api/otp/verify")
-def api_verify():
-    init_data = _extract_init_data()
-    info = _verify_webapp_init_data(init_data)
-    if not info:
-        return jsonify(ok=False, error="bad signature"), 403
-    uid = info["user_id"]
-
-    payload = request.get_json(silent=True) or {}
-    code = str(payload.get('code','')).strip()
-    ok, msg = check_otp(uid, code)
-    if not ok:
-        return jsonify(ok=False, error=msg)
-
-    ensure_user_record(uid)
-    users[str(uid)]["verified"] = True
-    _save_users()
-    return jsonify(ok=True)
-
-# ──────────────── Webhook endpoint (если используется) ────────────────
-WEBHOOK_PATH = f"/tg/{TOKEN}"
-
-@app.post(WEBHOOK_PATH)
-def telegram_webhook():
-    if request.headers.get('content-type') == 'application/json':
-        js = request.get_data().decode('utf-8')
-        update = telebot.types.Update.de_json(js)
-        bot.process_new_updates([update])
-        return 'ok', 200
-    return 'bad', 400
-
-# ──────────────── HANDLERS ────────────────
-@bot.message_handler(content_types=["contact"])
-def handle_contact(message):
-    uid = message.from_user.id
-    ensure_user_record(uid)
-
-    if not message.contact or message.contact.user_id != uid:
-        bot.reply_to(message, "Отправьте свой номер через кнопку «Подтвердить номер 📱».")
-        return
-
-    phone = normalize_phone(message.contact.phone_number)
-    if not phone:
-        bot.reply_to(message, "Не удалось распознать номер. Попробуйте ещё раз.")
-        return
-
-    users[str(uid)]["phone"] = phone
-    users[str(uid)]["phone_ok"] = (phone in ALLOWED_SET)
-    _save_users()
-
-    bot.send_message(message.chat.id, f"Номер получен: {phone}", reply_markup=types.ReplyKeyboardRemove())
-
-    if not users[str(uid)]["phone_ok"]:
-        bot.send_message(message.chat.id, "❌ Ваш номер не в списке доступа. Обратитесь к администратору.")
-        return
-
-    if REQUIRE_CODE and not users[str(uid)].get("verified"):
-        kb = types.InlineKeyboardMarkup()
-        if WEBAPP_URL:
-            kb.add(types.InlineKeyboardButton(
-                "Открыть форму подтверждения",
-                web_app=types.WebAppInfo(url=WEBAPP_URL)
-            ))
-        bot.send_message(message.chat.id, "✅ Номер подтверждён. Осталось подтвердить вход:", reply_markup=kb)
-    else:
-        bot.send_message(message.chat.id, "✅ Доступ разрешён. Открываю меню…")
-        try:
-            start(message)
-        except Exception:
-            pass
-
-@bot.message_handler(commands=["reload_phones"])
-def reload_phones_cmd(m):
-    if m.from_user.id not in ADMIN_IDS:
-        return
-    global ALLOWED_SET
-    ALLOWED_SET = load_allowed_phones()
-    bot.reply_to(m, f"Список телефонов обновлён. Всего: {len(ALLOWED_SET)}")
-
-@bot.message_handler(commands=['stats', 'count'])
-def send_stats(message):
-    total = len(users)
-    verified = sum(1 for v in users.values() if isinstance(v, dict) and v.get("verified"))
-    bot.send_message(message.chat.id, f"Всего пользователей: {total}\nПодтверждены (OTP): {verified}")
-
-@bot.message_handler(commands=['menu'])
-@require_access
-def show_menu(message):
-    uid = message.from_user.id
-    ensure_user_record(uid)
-    rec = users.get(str(uid), {})
-    lang = user_data.get(uid, {}).get("lang", "ru")
-    name = rec.get("name", "User")
-    send_main_menu(uid, lang, name)
-
-@bot.message_handler(commands=['start'])
-@require_access
-def start(message):
-    user_id = message.from_user.id
-    ensure_user_record(user_id)
-
-    rec = users.get(str(user_id), {})
-    if not rec.get("name"):
-        lang_markup = types.InlineKeyboardMarkup(row_width=3)
-        lang_markup.add(
-            types.InlineKeyboardButton("🇷🇺 Русский", callback_data="lang_ru"),
-            types.InlineKeyboardButton("🇦🇿 Azərbaycan", callback_data="lang_az"),
-            types.InlineKeyboardButton("🇬🇧 English", callback_data="lang_en")
-        )
-        intro_video_id = VIDEO_FILE_IDS.get("intro")
-        if intro_video_id:
-            try:
-                bot.send_video(message.chat.id, intro_video_id)
-            except Exception as e:
-                logging.error(f"Не удалось отправить видео приветствия: {e}")
-        sent = bot.send_message(
-            message.chat.id,
-            "Выберите язык / Select language / Dil seçin:",
-            reply_markup=lang_markup
-        )
-        user_data[user_id] = {"lang_msg": sent.message_id, "state": "awaiting_language"}
-    else:
-        lang = user_data.get(user_id, {}).get("lang", "ru")
-        name = rec.get("name", "User")
-        send_main_menu(user_id, lang, name)
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith("lang_"))
-@require_access
-def ask_name(call):
-    user_id = call.from_user.id
-    lang = call.data.split("_")[1]
-    user_data[user_id] = {"lang": lang, "state": "awaiting_name"}
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
-    sent = bot.send_message(call.message.chat.id, texts[lang]["welcome"])
-    user_data[user_id]["name_msg"] = sent.message_id
-    try:
-        bot.answer_callback_query(call.id)
-    except Exception:
-        pass
-
-@bot.message_handler(func=lambda m: m.from_user.id in user_data and user_data[m.from_user.id].get("state") == "awaiting_name")
-@require_access
-def get_name(message):
-    user_id = message.from_user.id
-    ensure_user_record(user_id)
-    name = (message.text or "").strip()
-
-    users[str(user_id)]["name"] = name
-    _save_users()
-    user_data[user_id]["name"] = name
-
-    lang = user_data[user_id].get("lang", "ru")
-    try:
-        nm = user_data[user_id].get("name_msg", 0)
-        if nm:
-            bot.delete_message(message.chat.id, nm)
-        bot.delete_message(message.chat.id, message.message_id)
-    except Exception:
-        pass
-
-    user_data[user_id]["state"] = "main"
-    send_main_menu(user_id, lang, name)
-
-def send_main_menu(user_id: int, lang: str = None, name: str = None):
-    rec = users.get(str(user_id), {})
-    lang = (lang or user_data.get(user_id, {}).get("lang") or "ru")
-    name = (name or user_data.get(user_id, {}).get("name") or rec.get("name", "User"))
-
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    markup.add(
-        types.InlineKeyboardButton(texts[lang]["materials"], callback_data="materials"),
-        types.InlineKeyboardButton(texts[lang]["videoguides"], callback_data="videoguides"),
-        types.InlineKeyboardButton(texts[lang]["contact"], callback_data="contact"),
-        types.InlineKeyboardButton(texts[lang]["search"], callback_data="search")
-    )
-    bot.send_message(user_id, texts[lang]["name_reply"].format(name=name), reply_markup=markup)
-
-    user_data.setdefault(user_id, {})
-    user_data[user_id].update({"state": "main", "lang": lang, "name": name})
-
-@bot.callback_query_handler(func=lambda call: True)
-@require_access
-def callback_handler(call):
-    user_id = call.from_user.id
-
-    if user_id not in user_data:
-        rec = users.get(str(user_id), {})
-        send_main_menu(user_id, "ru", rec.get("name", "User"))
-        try:
-            bot.answer_callback_query(call.id)
-        except Exception:
-            pass
-        return
-
-    lang = user_data[user_id].get("lang", "ru")
-    name = users.get(str(user_id), {}).get("name", "User")
-
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
-
-    if call.data == "materials":
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        for key, title in texts[lang]["file_titles"].items():
-            if key not in VIDEO_FILE_IDS:
-                markup.add(types.InlineKeyboardButton(title, callback_data=f"file_{key}"))
-        markup.add(types.InlineKeyboardButton(texts[lang]["back"], callback_data="main_menu"))
-        bot.send_message(call.message.chat.id, texts[lang]["choose_file"], reply_markup=markup)
-        user_data[user_id]["state"] = "materials"
-
-    elif call.data == "videoguides":
-        markup = types.InlineKeyboardMarkup()
-        for key in ["direct", "reboot", "replacement", "return", "unregisteredconsumer"]:
-            title = texts[lang]["file_titles"].get(key, key)
-            markup.add(types.InlineKeyboardButton(title, callback_data=f"file_{key}"))
-        markup.add(types.InlineKeyboardButton(texts[lang]["back"], callback_data="main_menu"))
-        bot.send_message(call.message.chat.id, texts[lang]["video_choice"], reply_markup=markup)
-        user_data[user_id]["state"] = "videoguides"
-
-    elif call.data.startswith("file_"):
-        file_key = call.data[5:]
-        back_to = "materials" if file_key in file_paths else "videoguides"
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(texts[lang]["back"], callback_data=back_to))
-
-        file_id = VIDEO_FILE_IDS.get(file_key)
-        if file_id:
-            bot.send_video(
-                call.message.chat.id,
-                file_id,
-                caption=texts[lang]["file_titles"].get(file_key, file_key),
-                reply_markup=markup
-            )
-        else:
-            path = file_paths.get(file_key)
-            if path and path.startswith("http"):
-                bot.send_message(
-                    call.message.chat.id,
-                    f"{texts[lang]['file_titles'].get(file_key, file_key)}:\n{path}",
-                    reply_markup=markup
-                )
-            else:
-                bot.send_message(call.message.chat.id, "Файл не найден.", reply_markup=markup)
-
-    elif call.data == "contact":
-        markup = types.InlineKeyboardMarkup()
-        if lang == "ru":
-            markup.add(types.InlineKeyboardButton("Мехти (техподдержка)", url="https://t.me/mexti_s"))
-            markup.add(types.InlineKeyboardButton("Хайям Махмудов (тренер)", url="https://t.me/mxm086"))
-        elif lang == "az":
-            markup.add(types.InlineKeyboardButton("Mehdi Suleymanov (texniki dəstək)", url="https://t.me/mexti_s"))
-            markup.add(types.InlineKeyboardButton("Xəyyam Mahmudov (təlimçi)", url="https://t.me/mxm086"))
-        elif lang == "en":
-            markup.add(types.InlineKeyboardButton("Mehti (tech Support)", url="https://t.me/mexti_s"))
-            markup.add(types.InlineKeyboardButton("Khayyam Mahmudov (trainer)", url="https://t.me/mxm086"))
-        markup.add(types.InlineKeyboardButton(texts[lang]["back"], callback_data="main_menu"))
-        bot.send_message(call.message.chat.id, texts[lang]["contact_text"], reply_markup=markup)
-        user_data[user_id]["state"] = "contact"
-
-    elif call.data == "search":
-        try:
-            bot.answer_callback_query(call.id)
-        except Exception:
-            pass
-        bot.send_message(call.message.chat.id, texts[lang]["search"] + ": Введите ключевое слово для поиска.")
-        user_data[user_id]["state"] = "search"
-
-    elif call.data == "main_menu":
-        send_main_menu(user_id, lang, name)
-
-    try:
-        bot.answer_callback_query(call.id)
-    except Exception:
-        pass
-
-@bot.message_handler(func=lambda m: m.from_user.id in user_data and user_data[m.from_user.id].get("state") == "search")
-@require_access
-def handle_search(message):
-    user_id = message.from_user.id
-    lang = user_data[user_id].get("lang", "ru")
-    query = (message.text or "").lower()
-
-    results = []
-    for key, keywords in search_keywords.items():
-        if any(word in query for word in keywords):
-            title = texts[lang]["file_titles"].get(key, key)
-            results.append((key, title))
-
-    if results:
-        markup = types.InlineKeyboardMarkup()
-        for key, title in results:
-            markup.add(types.InlineKeyboardButton(title, callback_data=f"file_{key}"))
-        markup.add(types.InlineKeyboardButton(texts[lang]["back"], callback_data="main_menu"))
-        bot.send_message(message.chat.id, f"Результаты поиска по запросу: «{message.text}»", reply_markup=markup)
-    else:
-        bot.send_message(message.chat.id, f"По запросу «{message.text}» ничего не найдено. Попробуйте другое ключевое слово.")
-
-    user_data[user_id]["state"] = "search"
-
-# ──────────────── RUN ────────────────
-if __name__ == "__main__":
-    try:
-        bot.remove_webhook()
-
-        if USE_WEBHOOK:
-            if not PUBLIC_URL:
-                raise SystemExit("PUBLIC_URL не задан. Укажи https://<your-app>.up.railway.app")
-            bot.set_webhook(url=PUBLIC_URL + f"/tg/{TOKEN}", drop_pending_updates=True)
-            app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8080")), threaded=True, use_reloader=False)
-        else:
-            threading.Thread(
-                target=lambda: app.run(host="0.0.0.0", port=int(os.getenv("PORT","8080")), threaded=True, use_reloader=False),
-                daemon=True
-            ).start()
-            bot.infinity_polling(skip_pending=True, timeout=60)
-
-    except ApiTelegramException as e:
-        print(f"❌ Telegram error: {e}")
-        raise
-
+from flask import Flask, request, jsonify, Response, stream_with_context
+import hmac, hashlib
+import io
+import threading
+import os
+import json
+import logging
+import re
+from functools import wraps
+import time
+import tempfile
+import atexit
+import signal
+from collections import OrderedDict
+
+import telebot
+from telebot import types
+from telebot.types import CallbackQuery as TGCallbackQuery
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+from dotenv import load_dotenv
+from urllib.parse import parse_qsl
+
+try:
+    from orjson import loads as json_loads     # тело вебхука разбирается в разы быстрее
+except ImportError:
+    json_loads = json.loads
+
+from storage import JsonUserStore, PostgresUserStore
+from phones import PhoneWhitelist, normalize_phone, decode as decode_phone
+from dispatch import ShardedExecutor, UpdateCheckpoint
+from router import Router
+from catalog import CatalogFile
+from analytics import EventLog
+from otp import MemoryOtpStore, PostgresOtpStore
+import broadcast as bcast
+import bulk
+from state import ConversationStore, SqliteStateBackend, PostgresStateBackend
+from outbound import SendScheduler, HttpSession
+from metrics import REGISTRY, Counter, Histogram, Gauge
+from tracing import Tracer, setup_logging, span
+
+# ─────────────────── ЛОГИ ───────────────────
+# в файл пишет отдельный поток (QueueListener) — медленный диск не держит хендлеры
+atexit.register(setup_logging('bot_errors.log', level=logging.ERROR))
+
+# ─────────────────── ENV ───────────────────
+load_dotenv(override=True)
+
+def _parse_int_set(env_name: str):
+    raw = (os.getenv(env_name) or "").strip()
+    if not raw:
+        return set()
+    return set(int(x) for x in raw.replace(" ", "").split(",") if x)
+
+# whitelist телефонов: компактный индекс, сам перечитывает файл при изменении (см. phones.py)
+REQUIRE_PHONE       = os.getenv("REQUIRE_PHONE", "0") == "1"
+ALLOWED_PHONES_FILE = (os.getenv("ALLOWED_PHONES_FILE") or "").strip()
+PHONES_WATCH_SECS   = float(os.getenv("PHONES_WATCH_SECS", "5"))
+
+allowed_phones = PhoneWhitelist(
+    ALLOWED_PHONES_FILE,
+    extra=[x for x in (os.getenv("ALLOWED_PHONES") or "").replace(" ", "").split(",") if x],
+)
+
+TOKEN = (os.getenv("BOT_TOKEN") or "").strip()
+if not TOKEN:
+    raise ValueError("BOT_TOKEN не найден в переменных окружения")
+
+ADMIN_IDS   = _parse_int_set("ADMIN_IDS")
+ALLOW_GROUPS = os.getenv("ALLOW_GROUPS", "0") == "1"
+
+# WebApp/OTP/Webhook
+REQUIRE_CODE  = os.getenv("REQUIRE_CODE", "0") == "1"
+OTP_TTL_SECS  = int(os.getenv("OTP_TTL_SECS", "600"))
+OTP_LENGTH    = int(os.getenv("OTP_LENGTH", "6"))
+OTP_ATTEMPTS  = int(os.getenv("OTP_ATTEMPTS", "3"))
+# лимиты выдачи кодов: на пользователя за окно и общий темп
+OTP_USER_MAX     = int(os.getenv("OTP_USER_MAX", "3"))
+OTP_USER_WINDOW  = int(os.getenv("OTP_USER_WINDOW", "600"))
+OTP_GLOBAL_RATE  = float(os.getenv("OTP_GLOBAL_RATE", "5"))
+OTP_GLOBAL_BURST = float(os.getenv("OTP_GLOBAL_BURST", "20"))
+USE_WEBHOOK   = os.getenv("USE_WEBHOOK", "0") == "1"
+PUBLIC_URL    = (os.getenv("PUBLIC_URL") or "").rstrip("/")
+WEBHOOK_PATH  = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+# секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token; по умолчанию — из токена
+WEBHOOK_SECRET = (os.getenv("WEBHOOK_SECRET") or "").strip()
+WEBHOOK_MAX_BODY = int(os.getenv("WEBHOOK_MAX_BODY", str(1 << 20)))
+UPDATE_WORKERS    = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_OVERFLOW   = (os.getenv("UPDATE_OVERFLOW") or "reject").strip()
+UPDATES_OFFSET_FILE = os.getenv("UPDATES_OFFSET_FILE", "updates.offset")
+UPDATE_MAX_AGE_SECS = int(os.getenv("UPDATE_MAX_AGE_SECS", "900"))      # 0 — не пропускать старые
+SHUTDOWN_DRAIN_SECS = float(os.getenv("SHUTDOWN_DRAIN_SECS", "20"))
+WEBAPP_URL    = (os.getenv("WEBAPP_URL") or "").strip()
+
+# Bot API: адрес (для локальной заглушки) и лимиты исходящих запросов
+TELEGRAM_API_URL     = (os.getenv("TELEGRAM_API_URL") or "").rstrip("/")
+TG_GLOBAL_RATE       = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE         = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST        = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_GROUP_RATE_PER_MIN = float(os.getenv("TG_GROUP_RATE_PER_MIN", "20"))
+TG_MAX_RETRIES       = int(os.getenv("TG_MAX_RETRIES", "3"))
+# HTTP: пул соединений под число воркеров (+ polling, вебхук, фоновые задачи)
+HTTP_POOL_SIZE       = int(os.getenv("HTTP_POOL_SIZE", str(UPDATE_WORKERS + 4)))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT    = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+HTTP_RETRIES         = int(os.getenv("HTTP_RETRIES", "2"))
+# каталог контента: файл и период проверки его изменений (0 — только /reload_catalog)
+CATALOG_FILE       = os.getenv("CATALOG_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json")
+CATALOG_WATCH_SECS = float(os.getenv("CATALOG_WATCH_SECS", "10"))
+# события использования (открытия, поиск, OTP): журнал и период сохранения агрегатов
+EVENTS_FILE        = os.getenv("EVENTS_FILE", "events.jsonl")
+EVENTS_ROLLUP_SECS = float(os.getenv("EVENTS_ROLLUP_SECS", "60"))
+
+# ─────────────────── USERS ───────────────────
+# USER_STORE=json     — снапшот users.json.snap (mmap) + журнал, запись в фоне (см. storage.py)
+# USER_STORE=postgres — таблица bot_users в DATABASE_URL
+USER_STORE   = (os.getenv("USER_STORE") or "json").strip().lower()
+DATABASE_URL = (os.getenv("DATABASE_URL") or "").strip()
+
+users_file = "users.json"
+if USER_STORE == "postgres":
+    if not DATABASE_URL:
+        raise ValueError("USER_STORE=postgres, но DATABASE_URL не задан")
+    users = PostgresUserStore(
+        DATABASE_URL,
+        minconn=int(os.getenv("PG_POOL_MIN", "1")),
+        maxconn=int(os.getenv("PG_POOL_MAX", "10")),
+    )
+else:
+    users = JsonUserStore(
+        users_file,
+        flush_interval=float(os.getenv("USERS_FLUSH_SECS", "1")),
+        compact_interval=float(os.getenv("USERS_COMPACT_SECS", "300")),
+    )
+atexit.register(users.close)
+
+def ensure_user_record(user_id: int):
+    return users.ensure(user_id)
+
+def on_phones_changed(added, removed):
+    """Список поменялся — пересчитать phone_ok только у владельцев затронутых номеров, пачками."""
+    changed = [decode_phone(n) for n in added] + [decode_phone(n) for n in removed]
+    batch = []
+    for uid, rec in users.find_by_phones(changed):
+        ok = rec.get("phone", "") in allowed_phones
+        if ok != bool(rec.get("phone_ok")):
+            batch.append((uid, {"phone_ok": ok}))
+        if len(batch) >= bulk.WRITE_BATCH:
+            users.update_many(batch)
+            batch = []
+    if batch:
+        users.update_many(batch)
+
+allowed_phones.on_change = on_phones_changed
+allowed_phones.watch(PHONES_WATCH_SECS)
+
+# Состояние диалога (язык, шаг, id служебных сообщений): LRU в памяти + общий слой.
+# STATE_STORE=sqlite   — state.db (по умолчанию при USER_STORE=json)
+# STATE_STORE=postgres — таблица bot_conv (по умолчанию при USER_STORE=postgres)
+# STATE_STORE=memory   — только в памяти, теряется при рестарте
+STATE_STORE = (os.getenv("STATE_STORE") or ("postgres" if USER_STORE == "postgres" else "sqlite")).strip().lower()
+if STATE_STORE == "postgres":
+    if USER_STORE != "postgres":
+        raise ValueError("STATE_STORE=postgres работает вместе с USER_STORE=postgres")
+    _state_backend = PostgresStateBackend(users, DATABASE_URL)
+elif STATE_STORE == "sqlite":
+    _state_backend = SqliteStateBackend(os.getenv("STATE_DB_PATH", "state.db"))
+else:
+    _state_backend = None
+user_data = ConversationStore(_state_backend, hot_size=int(os.getenv("STATE_HOT_SIZE", "10000")))
+atexit.register(user_data.close)
+
+# ──────────────── МЕТРИКИ ────────────────
+# GET /metrics — формат Prometheus. Если задан METRICS_TOKEN, он нужен в ?token= или Authorization: Bearer.
+METRICS_TOKEN = (os.getenv("METRICS_TOKEN") or "").strip()
+# /admin/* — импорт whitelist и выгрузка пользователей; нужен Authorization: Bearer <ADMIN_API_TOKEN>.
+# Пока токен не задан, этих адресов нет (404).
+ADMIN_API_TOKEN = (os.getenv("ADMIN_API_TOKEN") or "").strip()
+
+UPDATES_TOTAL    = Counter("bot_updates_total", "Принятые апдейты по типу", ["type"])
+HANDLER_SECONDS  = Histogram("bot_handler_seconds", "Время хендлеров и HTTP-эндпоинтов", ["handler"])
+BOT_API_REQUESTS = Counter("bot_api_requests_total", "Запросы к Bot API по методу и HTTP-коду (exc — исключение)",
+                           ["method", "code"])
+BOT_API_SECONDS  = Histogram("bot_api_request_seconds", "Время одного HTTP-запроса к Bot API", ["method"])
+UPDATES_SKIPPED  = Counter("bot_updates_skipped_total", "Апдейты, пропущенные без обработки", ["reason"])
+
+UPDATE_TYPES = ("message", "callback_query", "edited_message", "my_chat_member", "chat_member",
+                "channel_post", "edited_channel_post", "inline_query", "chat_join_request")
+# что разбирает router; остальное Telegram не присылает (allowed_updates в setWebhook / getUpdates)
+HANDLED_UPDATES = ["message", "callback_query"]
+
+def update_kind(update) -> str:
+    for t in UPDATE_TYPES:
+        if getattr(update, t, None) is not None:
+            return t
+    return "other"
+
+def count_update(update):
+    UPDATES_TOTAL.inc((update_kind(update),))
+
+def update_date(update):
+    """Время отправки сообщения; у callback и прочих своей даты нет — None."""
+    for kind in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        msg = getattr(update, kind, None)
+        if msg is not None:
+            return msg.date
+    return None
+
+def accept_update(update) -> bool:
+    """Учесть апдейт в метриках; False — он старше UPDATE_MAX_AGE_SECS и обрабатывать его не нужно."""
+    count_update(update)
+    date = update_date(update)
+    if UPDATE_MAX_AGE_SECS and date and time.time() - date > UPDATE_MAX_AGE_SECS:
+        UPDATES_SKIPPED.inc(("stale",))
+        return False
+    return True
+
+def skip_reason(data: dict):
+    """
+    Почему апдейт из тела вебхука обрабатывать не нужно (None — нужно).
+    Смотрит прямо в dict, до Update.de_json: тип апдейта, группа без ALLOW_GROUPS
+    (require_access всё равно промолчал бы, кроме админов), возраст сообщения.
+    """
+    msg = data.get("message")
+    if msg is not None:
+        sender = msg.get("from") or {}
+        if UPDATE_MAX_AGE_SECS and time.time() - msg.get("date", 0) > UPDATE_MAX_AGE_SECS:
+            return "stale"
+    else:
+        cq = data.get("callback_query")
+        if cq is None:
+            return "unhandled"
+        sender = cq.get("from") or {}
+        msg = cq.get("message") or {}
+    if _is_group((msg.get("chat") or {}).get("type")) and sender.get("id") not in ADMIN_IDS:
+        return "group"
+    return None
+
+def accept_raw_update(data: dict):
+    """Вебхук: Update из разобранного тела или None, если он не нужен (см. skip_reason)."""
+    kind = next((k for k in data if k != "update_id"), "other")
+    UPDATES_TOTAL.inc((kind if kind in UPDATE_TYPES else "other",))
+    reason = skip_reason(data)
+    if reason:
+        UPDATES_SKIPPED.inc((reason,))
+        return None
+    return telebot.types.Update.de_json(data)
+
+def timed(name: str):
+    return HANDLER_SECONDS.timed((name,))
+
+def observed_request(request):
+    """Обёртка над HttpSession.request: число, коды и время запросов по методу Bot API."""
+    def call(method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        code = "exc"
+        t0 = time.perf_counter()
+        try:
+            response = request(method, url, **kwargs)
+            code = str(response.status_code)
+            return response
+        finally:
+            BOT_API_SECONDS.observe(time.perf_counter() - t0, (api_method,))
+            BOT_API_REQUESTS.inc((api_method, code))
+    return call
+
+# ──────────────── ТРАССИРОВКА ────────────────
+# У каждого апдейта — trace: хендлер, вызовы Bot API, записи в хранилища, проверка доступа.
+# Апдейты дольше TRACE_SLOW_MS пишутся в TRACE_FILE (JSON-строка) и видны в /slow;
+# идущим дольше PROFILE_AFTER_MS снимаются стеки. /profile [сек] — стеки всех апдейтов.
+TRACE_SLOW_MS       = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_FILE          = os.getenv("TRACE_FILE", "traces.jsonl")
+PROFILE_AFTER_MS    = float(os.getenv("PROFILE_AFTER_MS", str(TRACE_SLOW_MS / 2)))   # 0 — не профилировать
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+
+tracer = Tracer(slow_ms=TRACE_SLOW_MS, profile_after_ms=PROFILE_AFTER_MS,
+                interval=PROFILE_INTERVAL_MS / 1000, log_file=TRACE_FILE).start()
+atexit.register(tracer.close)
+
+def update_user_id(update):
+    for kind in ("message", "callback_query", "edited_message"):
+        obj = getattr(update, kind, None)
+        if obj is not None and obj.from_user:
+            return obj.from_user.id
+    return None
+
+def traced_request(send):
+    """Вызов Bot API целиком — ожидание лимитов, повторы после 429, HTTP — спан api:<метод>."""
+    def call(method, url, **kwargs):
+        with span("api:" + url.rsplit("/", 1)[-1]):
+            return send(method, url, **kwargs)
+    return call
+
+# ──────────────── BOT ────────────────
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+    apihelper.FILE_URL = TELEGRAM_API_URL + "/file/bot{0}/{1}"
+
+http_session = HttpSession(
+    pool_size=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    retries=HTTP_RETRIES,
+)
+
+# все вызовы bot.* проходят через планировщик: лимиты, приоритеты, 429
+send_scheduler = SendScheduler(
+    observed_request(http_session.request),
+    global_rate=TG_GLOBAL_RATE,
+    chat_rate=TG_CHAT_RATE,
+    chat_burst=TG_CHAT_BURST,
+    group_rate_per_min=TG_GROUP_RATE_PER_MIN,
+    max_retries=TG_MAX_RETRIES,
+)
+apihelper.CUSTOM_REQUEST_SENDER = traced_request(send_scheduler)
+
+# хендлеры крутятся в воркерах update_executor (см. ниже), поэтому
+# собственный пул потоков telebot выключен: он перемешал бы порядок апдейтов
+bot = telebot.TeleBot(TOKEN, parse_mode=None, threaded=False)
+
+# хендлеры регистрируются в таблицах Router, а не в цепочке фильтров telebot (см. router.py)
+router = Router(state_of=user_data.state)
+
+def update_shard_key(update):
+    """Ключ шарда: чат (или пользователь), чтобы апдейты одного чата шли по порядку."""
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        cq = update.callback_query
+        return cq.message.chat.id if cq.message else cq.from_user.id
+    for kind in ("edited_message", "channel_post", "edited_channel_post"):
+        msg = getattr(update, kind, None)
+        if msg:
+            return msg.chat.id
+    return update.update_id
+
+# какие апдейты polling взяты и какие ещё не обработаны — переживает перезапуск (см. poll_updates)
+checkpoint = UpdateCheckpoint(UPDATES_OFFSET_FILE)
+
+def handle_update(update):
+    with tracer.trace(update.update_id, update_user_id(update), update_kind(update)) as tr:
+        try:
+            handler, arg = router.resolve(update)
+            if handler is not None:
+                tr.handler = handler.__name__
+                handler(arg)
+        finally:
+            checkpoint.finish(update.update_id)
+
+update_executor = ShardedExecutor(
+    handle_update,
+    key=update_shard_key,
+    workers=UPDATE_WORKERS,
+    maxsize=UPDATE_QUEUE_SIZE,
+    overflow=UPDATE_OVERFLOW,
+    name="updates",
+)
+
+# ──────────────── OTP ────────────────
+# OTP_STORE=memory   — коды в процессе (по умолчанию при USER_STORE=json)
+# OTP_STORE=postgres — общие для всех процессов вебхука (по умолчанию при USER_STORE=postgres)
+OTP_STORE = (os.getenv("OTP_STORE") or ("postgres" if USER_STORE == "postgres" else "memory")).strip().lower()
+
+_otp_limits = dict(
+    ttl=OTP_TTL_SECS, length=OTP_LENGTH, attempts=OTP_ATTEMPTS,
+    user_max=OTP_USER_MAX, user_window=OTP_USER_WINDOW,
+    global_rate=OTP_GLOBAL_RATE, global_burst=OTP_GLOBAL_BURST,
+)
+if OTP_STORE == "postgres":
+    if USER_STORE != "postgres":
+        raise ValueError("OTP_STORE=postgres работает вместе с USER_STORE=postgres")
+    otp_store = PostgresOtpStore(users, **_otp_limits)
+else:
+    otp_store = MemoryOtpStore(**_otp_limits)
+
+# ──────────────── КОНТЕНТ ────────────────
+# тексты, материалы, видео, поисковые слова и контакты — в catalog.json (см. catalog.py)
+def check_video_file_id(file_id: str):
+    """getFile: Telegram знает такой файл. «file is too big» — файл есть, просто не для скачивания."""
+    try:
+        bot.get_file(file_id)
+    except ApiTelegramException as e:
+        if "file is too big" not in (e.description or ""):
+            raise
+
+catalog = CatalogFile(CATALOG_FILE, check_file_id=check_video_file_id).watch(CATALOG_WATCH_SECS)
+
+def menu_markup(menu: str, lang: str = "ru") -> str:
+    """JSON клавиатуры из текущего снимка каталога."""
+    return catalog.current.markup(menu, lang)
+
+# аналитика: emit() только ставит событие в очередь, запись и агрегаты — в фоне (см. analytics.py)
+events = EventLog(EVENTS_FILE, rollup_every=EVENTS_ROLLUP_SECS)
+atexit.register(events.close)
+
+def track_open(uid: int, lang: str, data: str):
+    """Открытие материала или видео из каталога — в аналитику."""
+    if data.startswith("file_"):
+        key, c = data[5:], catalog.current
+        if key in c.videos or key in c.materials:
+            events.emit("open", uid, lang, k=key)
+
+# ──────────────── ACCESS ────────────────
+def maybe_answer_callback(update):
+    try:
+        if isinstance(update, TGCallbackQuery):
+            bot.answer_callback_query(update.id)
+    except Exception:
+        pass
+
+_PHONE_KB = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+_PHONE_KB.add(types.KeyboardButton("Подтвердить номер 📱", request_contact=True))
+_PHONE_KB = _PHONE_KB.to_json()
+
+def webapp_markup():
+    kb = types.InlineKeyboardMarkup()
+    if WEBAPP_URL:
+        kb.add(types.InlineKeyboardButton(
+            "Открыть форму подтверждения",
+            web_app=types.WebAppInfo(url=WEBAPP_URL)
+        ))
+    return kb.to_json()
+
+# Разрешения кэшируются по uid: пока запись пользователя не менялась, хендлеры
+# не ходят в хранилище. Сбрасываются при изменении phone_ok / verified / active
+# в этом процессе (users.on_change) и в любом случае через ACCESS_CACHE_TTL —
+# на случай, когда запись поменял другой процесс. Отказы не кэшируются.
+ACCESS_CACHE_TTL = float(os.getenv("ACCESS_CACHE_TTL", "60"))
+ACCESS_CACHE_MAX = 100_000
+ACCESS_FIELDS    = {"phone_ok", "verified", "active"}
+_access_granted: dict = {}   # uid -> до какого time.monotonic() действует
+
+def invalidate_access(uid: int):
+    _access_granted.pop(int(uid), None)
+
+def _on_user_change(uid: str, fields: dict):
+    if not ACCESS_FIELDS.isdisjoint(fields):
+        invalidate_access(uid)
+
+users.on_change = _on_user_change
+
+def _is_group(chat_type: str) -> bool:
+    return not ALLOW_GROUPS and chat_type in ("group", "supergroup")
+
+def access_reply(uid: int, chat_type: str):
+    """
+    Решение о доступе (общее для sync и async режимов):
+      None          — пропустить к хендлеру;
+      ""            — молча проигнорировать;
+      (текст, kb)   — ответить этим и не пускать.
+    """
+    expires = _access_granted.get(uid)
+    if expires is not None and expires > time.monotonic():
+        return "" if _is_group(chat_type) and uid not in ADMIN_IDS else None
+
+    with span("access"):
+        denial = _access_decision(uid, chat_type)
+    if denial is None:
+        if len(_access_granted) >= ACCESS_CACHE_MAX:
+            _access_granted.clear()
+        _access_granted[uid] = time.monotonic() + ACCESS_CACHE_TTL
+    return denial
+
+def _access_decision(uid: int, chat_type: str):
+    if not ensure_user_record(uid).get("active", True):
+        users.update(uid, active=True)   # снова пишет боту — значит, разблокировал
+
+    if uid in ADMIN_IDS:
+        return None
+
+    if _is_group(chat_type):
+        return ""
+
+    rec = users.get(str(uid), {})
+
+    if REQUIRE_PHONE and not rec.get("phone_ok"):
+        return (
+            "Доступ только для номеров из списка.\n"
+            "Нажмите «Подтвердить номер 📱», чтобы отправить свой номер из Telegram.",
+            _PHONE_KB,
+        )
+
+    if REQUIRE_CODE and not rec.get("verified", False):
+        if WEBAPP_URL:
+            return (
+                "🔒 Требуется подтверждение входа. Откройте форму и завершите подтверждение.",
+                webapp_markup(),
+            )
+        return "WEBAPP_URL не настроен. Обратитесь к администратору.", None
+
+    return None
+
+def update_origin(update):
+    """(uid, chat_id, chat_type) для сообщения или callback."""
+    msg = update.message if isinstance(update, TGCallbackQuery) else update
+    return update.from_user.id, msg.chat.id, getattr(msg.chat, "type", "private")
+
+def require_access(handler):
+    """
+    Доступ только для:
+      - админов, ИЛИ
+      - пользователей с phone_ok=True (номер в whitelist) + (если включено) verified=True (OTP через WebApp)
+    """
+    @wraps(handler)
+    def wrapper(update, *args, **kwargs):
+        uid, chat_id, chat_type = update_origin(update)
+        denial = access_reply(uid, chat_type)
+        if denial is None:
+            return handler(update, *args, **kwargs)
+        if denial:
+            text, kb = denial
+            bot.send_message(chat_id, text, reply_markup=kb)
+            maybe_answer_callback(update)
+    return wrapper
+
+# ──────────────── WebApp (Flask) ────────────────
+app = Flask(__name__)
+
+HTML_WEBAPP = r"""
+<!doctype html><html lang="ru"><head>
+<meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<script src="https://telegram.org/js/telegram-web-app.js"></script>
+<title>Подтверждение доступа</title>
+<style>
+  body{background:#111;color:#fff;font-family:system-ui,-apple-system,Segoe UI,Roboto,Arial,sans-serif;margin:0;padding:24px}
+  h1{font-size:20px;margin:0 0 16px}
+  .small{opacity:.8;font-size:12px;text-align:center;margin-top:8px}
+  .boxes{display:flex;gap:10px;justify-content:center;margin:24px 0}
+  .box{width:44px;height:56px;border-radius:12px;border:1px solid #333;display:flex;align-items:center;justify-content:center;font-size:24px;background:#1a1a1a}
+  #err{color:#f66;margin-top:8px;min-height:20px;text-align:center}
+  .btn{display:block;width:100%;padding:14px;border-radius:12px;border:none;background:#2ea44f;color:#fff;font-size:16px;margin-top:12px}
+  .sec{display:flex;gap:10px}
+  input[type=tel]{opacity:0;position:absolute;left:-9999px}
+</style></head><body>
+<h1>Подтверждение доступа</h1>
+<div class="small">Нажмите «Получить код», затем «Подтвердить».</div>
+<div class="boxes" id="boxes"></div>
+<div id="err"></div>
+<div class="sec">
+  <button class="btn" id="btnIssue" style="background:#444">Получить код</button>
+  <button class="btn" id="btnSend" disabled>Подтвердить</button>
+</div>
+<input id="hid" inputmode="numeric" pattern="[0-9]*" type="tel" maxlength="6" autocomplete="one-time-code" />
+<script>
+const tg = window.Telegram.WebApp; tg.expand();
+const initData = tg.initData || "";
+
+const hid = document.getElementById('hid');
+const boxes = document.getElementById('boxes');
+const btnIssue = document.getElementById('btnIssue');
+const btnSend = document.getElementById('btnSend');
+const err = document.getElementById('err');
+
+for(let i=0;i<6;i++){ const d=document.createElement('div'); d.className='box'; boxes.appendChild(d); }
+function render(){
+  const v=hid.value.replace(/\D/g,"").slice(0,6);
+  hid.value=v; [...boxes.children].forEach((b,i)=>{ b.textContent = v[i] ? v[i] : "" });
+  btnSend.disabled = v.length!==6;
+}
+boxes.addEventListener('click', ()=>hid.focus()); render();
+
+btnIssue.addEventListener('click', async ()=>{
+  try{
+    if(!initData){ err.textContent='WebApp открыт вне Telegram. Запустите форму из бота.'; return; }
+    const r = await fetch('/api/otp/issue?init_data=' + encodeURIComponent(initData), {
+      method:'POST',
+      headers:{'X-Init-Data': initData, 'Content-Type':'application/json'},
+      body: JSON.stringify({init_data: initData})
+    });
+    const j = await r.json();
+    if(!j.ok){ err.textContent = j.error || 'Не удалось получить код'; return; }
+    document.getElementById('hid').value = (j.code || '').toString().slice(0,6);
+    render();
+    err.textContent = 'Код сгенерирован. Нажмите «Подтвердить». Срок: ' + j.ttl_min + ' мин.';
+    hid.focus();
+  }catch(e){ err.textContent = 'Сеть недоступна'; }
+});
+
+btnSend.addEventListener('click', async ()=>{
+  try{
+    const code = hid.value;
+    const r = await fetch('/api/otp/verify?init_data=' + encodeURIComponent(initData), {
+      method:'POST',
+      headers:{'X-Init-Data': initData, 'Content-Type':'application/json'},
+      body: JSON.stringify({code, init_data: initData})
+    });
+    const j = await r.json();
+    if(!j.ok){ err.textContent = j.error || 'Код не принят'; return; }
+    tg.showAlert('Доступ подтверждён'); tg.close();
+  }catch(e){ err.textContent = 'Сеть недоступна'; }
+});
+</script></body></html>
+"""
+
+# Подпись initData: секрет считается один раз, проверенные initData кэшируются
+# до истечения auth_date (INIT_DATA_MAX_AGE секунд; 0 — не ограничивать возраст).
+INIT_DATA_MAX_AGE   = int(os.getenv("INIT_DATA_MAX_AGE", "86400"))
+INIT_DATA_CACHE_MAX = int(os.getenv("INIT_DATA_CACHE_MAX", "10000"))
+_WEBAPP_SECRET = hashlib.sha256(TOKEN.encode()).digest()
+_AUTH_DATE_RE = re.compile(r"(?:^|&)auth_date=(\d+)(?:&|$)")
+_init_data_cache: OrderedDict = OrderedDict()   # initData -> (когда истекает, {"user_id": ...})
+_init_data_lock = threading.Lock()
+
+def _init_data_expires(auth_date) -> float:
+    return int(auth_date) + INIT_DATA_MAX_AGE if INIT_DATA_MAX_AGE else float("inf")
+
+def _verify_webapp_init_data(init_data: str):
+    """
+    Каноничная проверка подписи WebApp. Возвращает {"user_id": int} или None.
+    """
+    if not init_data:
+        return None
+    now = time.time()
+    with _init_data_lock:
+        hit = _init_data_cache.get(init_data)
+        if hit is not None:
+            if hit[0] > now:
+                _init_data_cache.move_to_end(init_data)
+                return hit[1]
+            del _init_data_cache[init_data]
+            return None
+
+    # устаревшие отсекаем по сырой строке, до разбора и HMAC
+    if INIT_DATA_MAX_AGE:
+        m = _AUTH_DATE_RE.search(init_data)
+        if not m or _init_data_expires(m.group(1)) <= now:
+            return None
+    try:
+        data = dict(parse_qsl(init_data, strict_parsing=True))
+        recv_hash = data.pop('hash', None)
+        if not recv_hash:
+            return None
+        data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
+        calc_hash = hmac.new(_WEBAPP_SECRET, data_check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(calc_hash, recv_hash):
+            return None
+        # срок — по подписанному auth_date, а не по тому, что нашла регулярка
+        expires = _init_data_expires(data.get('auth_date') or 0)
+        if expires <= now:
+            return None
+        user_json = data.get('user')
+        if not user_json:
+            return None
+        user = json.loads(user_json)
+        info = {"user_id": int(user["id"])}
+    except Exception as e:
+        logging.error(f"verify_webapp_init_data error: {e}")
+        return None
+
+    with _init_data_lock:
+        _init_data_cache[init_data] = (expires, info)
+        if len(_init_data_cache) > INIT_DATA_CACHE_MAX:
+            _init_data_cache.popitem(last=False)
+    return info
+
+def _extract_init_data(payload: dict):
+    """
+    Берём init_data из заголовка, query и/или уже разобранного body — что дойдёт.
+    """
+    init_data = request.headers.get('X-Init-Data', '') or ""
+    if not init_data:
+        init_data = request.args.get('init_data', '') or ""
+    if not init_data:
+        init_data = payload.get('init_data', '') or ""
+    return init_data
+
+def _json_body() -> dict:
+    payload = request.get_json(silent=True)
+    return payload if isinstance(payload, dict) else {}
+
+@app.get("/webapp")
+def webapp_page():
+    return HTML_WEBAPP
+
+def otp_issue_response(init_data: str):
+    """(тело JSON-ответа, HTTP-статус) для /api/otp/issue — общее для Flask и ASGI."""
+    info = _verify_webapp_init_data(init_data)
+    if not info:
+        return {"ok": False, "error": "bad signature"}, 403
+    uid = info["user_id"]
+
+    # проверка номера (если включена)
+    if REQUIRE_PHONE:
+        if not ensure_user_record(uid).get("phone_ok"):
+            events.emit("otp", uid, k="issue", r="denied")
+            return {"ok": False, "error": "phone not approved"}, 403
+
+    code, retry_after = otp_store.issue(uid)
+    events.emit("otp", uid, k="issue", r="ok" if code else "throttled")
+    if code is None:
+        return {"ok": False, "error": f"Слишком много запросов кода. Повторите через {retry_after} с.",
+                "retry_after": retry_after}, 429
+    return {"ok": True, "code": code, "ttl": OTP_TTL_SECS, "ttl_min": max(1, OTP_TTL_SECS//60)}, 200
+
+def otp_verify_response(init_data: str, payload: dict):
+    """(тело JSON-ответа, HTTP-статус) для /api/otp/verify."""
+    info = _verify_webapp_init_data(init_data)
+    if not info:
+        return {"ok": False, "error": "bad signature"}, 403
+    uid = info["user_id"]
+
+    code = str(payload.get('code','')).strip()
+    ok, msg = otp_store.check(uid, code)
+    events.emit("otp", uid, k="verify", r="ok" if ok else "fail")
+    if not ok:
+        return {"ok": False, "error": msg}, 200
+
+    users.update(uid, verified=True)
+    return {"ok": True}, 200
+
+@app.post("/api/otp/issue")
+@timed("otp_issue")
+def api_issue():
+    body, status = otp_issue_response(_extract_init_data(_json_body()))
+    return jsonify(body), status
+
+@app.post("/api/otp/verify")
+@timed("otp_verify")
+def api_verify():
+    payload = _json_body()
+    body, status = otp_verify_response(_extract_init_data(payload), payload)
+    return jsonify(body), status
+
+# размеры очередей и структур в памяти — считаются только при запросе /metrics
+def _numeric(st: dict) -> dict:
+    return {(k,): v for k, v in st.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+
+Gauge("bot_update_queue", "Очередь апдейтов (depth, capacity, busy, lag_*_ms …)",
+      lambda: _numeric(update_executor.stats()), ["stat"])
+Gauge("bot_api_scheduler", "Планировщик исходящих запросов (throttled, retries, wait_seconds …)",
+      lambda: _numeric(send_scheduler.stats()), ["stat"])
+Gauge("bot_memory_entries", "Размеры структур в памяти", lambda: {
+    ("users",): users.count(),
+    ("user_data_hot",): user_data.stats()["hot"],
+    ("otp_outstanding",): otp_store.stats()["outstanding"],
+    ("phones",): len(allowed_phones),
+    ("init_data_cache",): len(_init_data_cache),
+}, ["structure"])
+
+def metrics_allowed(token: str, authorization: str) -> bool:
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(token or "", METRICS_TOKEN) or \
+        hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}")
+
+@app.get("/metrics")
+def metrics_page():
+    if not metrics_allowed(request.args.get("token", ""), request.headers.get("Authorization", "")):
+        return "forbidden", 403
+    return REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+# ──────────────── Webhook endpoint (если используется) ────────────────
+# Токена в пути нет: запрос без верного X-Telegram-Bot-Api-Secret-Token отбрасывается
+# до чтения тела, так что поток поддельных запросов почти ничего не стоит.
+WEBHOOK_SECRET = WEBHOOK_SECRET or hashlib.sha256(f"webhook:{TOKEN}".encode()).hexdigest()
+_WEBHOOK_SECRET = WEBHOOK_SECRET.encode()
+
+def webhook_allowed(secret: str, content_length) -> int:
+    """0 — пускать к телу; иначе HTTP-код отказа."""
+    if not hmac.compare_digest((secret or "").encode("utf-8", "replace"), _WEBHOOK_SECRET):
+        UPDATES_SKIPPED.inc(("forbidden",))
+        return 403
+    try:
+        size = int(content_length)
+    except (TypeError, ValueError):
+        return 411
+    return 413 if size > WEBHOOK_MAX_BODY else 0
+
+# вебхук только ставит апдейт в очередь и сразу отвечает, обработка — в воркерах
+@app.post(WEBHOOK_PATH)
+def telegram_webhook():
+    if stopping.is_set():
+        # идёт остановка — Telegram доставит апдейт новому процессу
+        return 'stopping', 503
+    denied = webhook_allowed(request.headers.get("X-Telegram-Bot-Api-Secret-Token"), request.content_length)
+    if denied:
+        return 'denied', denied
+    if request.headers.get('content-type') == 'application/json':
+        try:
+            data = json_loads(request.get_data())
+        except ValueError:
+            return 'bad', 400
+        update = accept_raw_update(data) if isinstance(data, dict) else None
+        if update is None:
+            return 'ok', 200
+        if not update_executor.submit(update):
+            # очередь полна — Telegram повторит доставку позже
+            return 'busy', 503
+        return 'ok', 200
+    return 'bad', 400
+
+# ──────────────── HANDLERS ────────────────
+@router.content("contact")
+@timed("handle_contact")
+def handle_contact(message):
+    uid = message.from_user.id
+    ensure_user_record(uid)
+
+    if not message.contact or message.contact.user_id != uid:
+        bot.reply_to(message, "Отправьте свой номер через кнопку «Подтвердить номер 📱».")
+        return
+
+    phone = normalize_phone(message.contact.phone_number)
+    if not phone:
+        bot.reply_to(message, "Не удалось распознать номер. Попробуйте ещё раз.")
+        return
+
+    rec = users.update(uid, phone=phone, phone_ok=(phone in allowed_phones))
+
+    bot.send_message(message.chat.id, f"Номер получен: {phone}", reply_markup=types.ReplyKeyboardRemove())
+
+    if not rec["phone_ok"]:
+        bot.send_message(message.chat.id, "❌ Ваш номер не в списке доступа. Обратитесь к администратору.")
+        return
+
+    if REQUIRE_CODE and not rec.get("verified"):
+        bot.send_message(message.chat.id, "✅ Номер подтверждён. Осталось подтвердить вход:", reply_markup=webapp_markup())
+    else:
+        bot.send_message(message.chat.id, "✅ Доступ разрешён. Открываю меню…")
+        try:
+            start(message)
+        except Exception:
+            pass
+
+@router.command("reload_phones")
+def reload_phones_cmd(m):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    # пересборка и пересчёт phone_ok — в фоне, ответим по готовности
+    allowed_phones.reload_async(lambda res: bot.reply_to(
+        m, "Список телефонов обновлён. Всего: {}, добавлено: {}, удалено: {}".format(*res)))
+
+@router.command("reload_catalog")
+def reload_catalog_cmd(m):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    # /reload_catalog all — проверить getFile у всех видео, а не только у новых
+    check_all = (m.text or "").split()[1:2] == ["all"]
+
+    def done(errors):
+        if errors:
+            bot.reply_to(m, "Каталог не обновлён, работает прежний:\n" + "\n".join(errors[:20]))
+        else:
+            bot.reply_to(m, "Каталог обновлён: " + ", ".join(f"{k}: {v}" for k, v in catalog.stats().items()))
+    catalog.reload_async(done, check_all=check_all)
+
+@router.command("queue")
+def queue_stats_cmd(m):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    lines = ["[updates]"] + [f"{k}: {v}" for k, v in update_executor.stats().items()]
+    lines += ["", "[checkpoint]"] + [f"{k}: {v}" for k, v in checkpoint.stats().items()]
+    lines += ["", "[trace]"] + [f"{k}: {v}" for k, v in tracer.stats().items()]
+    lines += ["", "[bot api]"] + [f"{k}: {v}" for k, v in send_scheduler.stats().items()]
+    lines += ["", "[http]"] + [f"{k}: {v}" for k, v in http_session.stats().items()]
+    lines += ["", "[state]"] + [f"{k}: {v}" for k, v in user_data.stats().items()]
+    lines += ["", "[phones]"] + [f"{k}: {v}" for k, v in allowed_phones.stats().items()]
+    lines += ["", "[otp]"] + [f"{k}: {v}" for k, v in otp_store.stats().items()]
+    lines += ["", "[catalog]"] + [f"{k}: {v}" for k, v in catalog.stats().items()]
+    lines += ["", "[events]"] + [f"{k}: {v}" for k, v in events.stats().items()]
+    bot.reply_to(m, "\n".join(lines))
+
+@router.command("slow")
+def slow_cmd(m):
+    """Последние апдейты дольше TRACE_SLOW_MS: хендлер, время и самые долгие спаны."""
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    recent = list(tracer.recent)[-10:]
+    if not recent:
+        bot.reply_to(m, f"Апдейтов дольше {TRACE_SLOW_MS:g} мс не было.")
+        return
+    lines = []
+    for tr in reversed(recent):
+        longest = sorted(tr.span_list(), key=lambda sp: -sp[2])[:3]
+        spans = ", ".join(f"{name} {dur * 1000:.0f}" for name, _, dur, _ in longest)
+        lines.append(f"#{tr.update_id} uid={tr.uid} {tr.handler}: {tr.ms:.0f} мс ({spans or 'без спанов'})")
+    bot.reply_to(m, "\n".join(lines) + f"\n\nПолностью (со стеками) — в {TRACE_FILE}")
+
+@router.command("profile")
+def profile_cmd(m):
+    """/profile [секунд] — стеки всех апдейтов в работе за это время (по умолчанию 30 с)."""
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    parts = (m.text or "").split()
+    seconds = min(int(parts[1]), 300) if len(parts) > 1 and parts[1].isdigit() else 30
+
+    def done(stacks):
+        if not stacks:
+            bot.send_message(m.chat.id, "Стеков не набралось: апдейтов в работе не было.")
+            return
+        total = sum(n for _, n in stacks)
+        lines = [f"{n * 100 / total:.0f}% {';'.join(stack.split(';')[-6:])}" for stack, n in stacks]
+        bot.send_message(m.chat.id, "\n\n".join(lines)[:4000])
+
+    if tracer.profile_all(seconds, done):
+        bot.reply_to(m, f"Профилирую {seconds} с…")
+    else:
+        bot.reply_to(m, "Профилирование уже идёт.")
+
+# ──────────────── ИМПОРТ / ВЫГРУЗКА ────────────────
+# Номера (и имена) — из CSV в ALLOWED_PHONES_FILE, пользователи — в CSV. Всё потоком (см. bulk.py):
+#   /import_phones — подписью к CSV-документу;   POST /admin/phones/import (тело — CSV или multipart file);
+#   /export_users [phone_ok|verified|active];      GET  /admin/users/export?only=…
+_bulk_lock = threading.Lock()     # импорт — по одному за раз
+
+def run_import(stream) -> dict:
+    """Импорт CSV из бинарного потока; None — уже идёт другой импорт."""
+    if not _bulk_lock.acquire(blocking=False):
+        return None
+    try:
+        text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+        return bulk.import_phones(bulk.read_rows(text), users, allowed_phones)
+    finally:
+        _bulk_lock.release()
+
+def _import_text(st: dict) -> str:
+    text = (f"Строк: {st['rows']}, новых номеров: {st['added']}, с ошибкой: {st['bad']}, "
+            f"имён обновлено: {st['names']}. Всего в списке: {st['whitelist']}")
+    if st["errors"]:
+        text += "\nОшибки (строка: значение):\n" + "\n".join(st["errors"])
+    return text
+
+def admin_api_allowed(authorization: str) -> int:
+    """0 — пускать; иначе HTTP-код отказа."""
+    if not ADMIN_API_TOKEN:
+        return 404
+    return 0 if hmac.compare_digest((authorization or "").encode("utf-8", "replace"),
+                                    f"Bearer {ADMIN_API_TOKEN}".encode()) else 403
+
+@app.post("/admin/phones/import")
+def admin_import_phones():
+    denied = admin_api_allowed(request.headers.get("Authorization"))
+    if denied:
+        return jsonify({"ok": False, "error": "denied"}), denied
+    upload = request.files.get("file") if request.mimetype == "multipart/form-data" else None
+    try:
+        st = run_import(upload.stream if upload is not None else request.stream)
+    except ValueError as e:          # ALLOWED_PHONES_FILE не задан
+        return jsonify({"ok": False, "error": str(e)}), 409
+    if st is None:
+        return jsonify({"ok": False, "error": "import in progress"}), 409
+    return jsonify({"ok": True, **st})
+
+@app.get("/admin/users/export")
+def admin_export_users():
+    denied = admin_api_allowed(request.headers.get("Authorization"))
+    if denied:
+        return "denied", denied
+    only = request.args.get("only") or None
+    if only is not None and only not in bulk.EXPORT_FILTERS:
+        return "bad filter", 400
+    return Response(stream_with_context(bulk.export_users(users, only)), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=users.csv"})
+
+@router.content("document")
+def import_phones_doc(m):
+    """CSV-документ с подписью /import_phones — дописать номера в whitelist."""
+    if m.from_user.id not in ADMIN_IDS or not (m.caption or "").startswith("/import_phones"):
+        return
+    if not allowed_phones.path:
+        bot.reply_to(m, "ALLOWED_PHONES_FILE не задан — импортировать некуда.")
+        return
+
+    def run():
+        try:
+            f = bot.get_file(m.document.file_id)
+            url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(TOKEN, f.file_path)
+            with http_session.session.get(url, stream=True, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)) as resp:
+                resp.raise_for_status()
+                resp.raw.decode_content = True
+                resp.raw.auto_close = False     # иначе TextIOWrapper упрётся в закрытый поток на последней строке
+                st = run_import(resp.raw)
+            bot.reply_to(m, "Импорт уже идёт, дождитесь окончания." if st is None else _import_text(st))
+        except Exception as e:
+            logging.error(f"import_phones error: {e}")
+            bot.reply_to(m, f"Импорт не удался: {e}")
+    threading.Thread(target=run, name="import-phones", daemon=True).start()
+    bot.reply_to(m, "Импортирую…")
+
+@router.command("import_phones")
+def import_phones_cmd(m):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    bot.reply_to(m, "Пришлите CSV-файл (телефон[,имя]) документом с подписью /import_phones.")
+
+@router.command("export_users")
+def export_users_cmd(m):
+    """/export_users [phone_ok|verified|active] — CSV документом."""
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    parts = (m.text or "").split()
+    only = parts[1] if len(parts) > 1 else None
+    if only is not None and only not in bulk.EXPORT_FILTERS:
+        bot.reply_to(m, "Фильтр: " + ", ".join(bulk.EXPORT_FILTERS))
+        return
+
+    def run():
+        try:
+            # через временный файл: в памяти только кусок CSV
+            with tempfile.TemporaryFile("w+b") as f:
+                for part in bulk.export_users(users, only):
+                    f.write(part.encode("utf-8"))
+                f.seek(0)
+                bot.send_document(m.chat.id, f, visible_file_name=f"users_{only or 'all'}.csv")
+        except Exception as e:
+            logging.error(f"export_users error: {e}")
+            bot.reply_to(m, f"Выгрузка не удалась: {e}")
+    threading.Thread(target=run, name="export-users", daemon=True).start()
+
+# ──────────────── РАССЫЛКИ ────────────────
+# /broadcast verified|phone_ok|all <текст> — или ответом на сообщение, которое нужно разослать
+BROADCAST_FILE    = "broadcast.json"
+BROADCAST_THREADS = int(os.getenv("BROADCAST_THREADS", "8"))
+BROADCAST_TARGETS = ("verified", "phone_ok", "all")
+current_broadcast = None
+
+def _broadcast_send(uid: int, job: dict):
+    if job.get("message_id"):
+        bot.copy_message(uid, job["from_chat"], job["message_id"])
+    else:
+        bot.send_message(uid, job["text"])
+
+def _broadcast_text(st: dict) -> str:
+    head = {"running": "📣 Рассылка идёт", "done": "✅ Рассылка завершена",
+            "cancelled": "⏹ Рассылка остановлена"}.get(st["status"], st["status"])
+    return (f"{head} [{st['id']}, {st['target']}]\n"
+            f"Отправлено: {st['sent']}\nОшибки: {st['failed']}\nЗаблокировали бота: {st['blocked']}\n"
+            f"Темп: {st['rate']} сообщ./с, прошло {st['elapsed_s']} с")
+
+def _broadcast_progress(job: dict, st: dict):
+    text = _broadcast_text(st)
+    try:
+        bot.edit_message_text(text, job["admin_chat"], job["status_msg"])
+    except Exception:
+        job["status_msg"] = bot.send_message(job["admin_chat"], text).message_id
+
+def start_broadcast(job: dict):
+    global current_broadcast
+    current_broadcast = bcast.Broadcast(
+        job, send=_broadcast_send, iter_uids=users.iter_uids,
+        on_blocked=lambda uid: users.update(uid, active=False),
+        on_progress=_broadcast_progress, path=BROADCAST_FILE, threads=BROADCAST_THREADS,
+    ).start()
+    return current_broadcast
+
+def resume_broadcast():
+    """После рестарта продолжить незавершённую рассылку с checkpoint'а."""
+    job = bcast.load_checkpoint(BROADCAST_FILE)
+    if job and job.get("status") == "running":
+        start_broadcast(job)
+        try:
+            bot.send_message(job["admin_chat"], f"Рассылка {job['id']} продолжена после перезапуска "
+                                                f"(уже отправлено: {job['sent']}).")
+        except Exception:
+            pass
+
+@router.command("broadcast")
+def broadcast_cmd(m):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    if current_broadcast and current_broadcast.running:
+        bot.reply_to(m, "Уже идёт рассылка. /broadcast_status — прогресс, /broadcast_cancel — остановить.")
+        return
+    parts = (m.text or "").split(maxsplit=2)
+    target = parts[1] if len(parts) > 1 else ""
+    text = parts[2] if len(parts) > 2 else ""
+    src = m.reply_to_message
+    if target not in BROADCAST_TARGETS or not (src or text):
+        bot.reply_to(m, "Использование: /broadcast verified|phone_ok|all <текст>\n"
+                        "или ответом на сообщение, которое нужно разослать.")
+        return
+    status = bot.reply_to(m, "📣 Рассылка запускается…")
+    start_broadcast(bcast.new_job(
+        target, m.chat.id, status_msg=status.message_id, from_chat=m.chat.id,
+        message_id=src.message_id if src else None, text=text,
+    ))
+
+@router.command("broadcast_status")
+def broadcast_status_cmd(m):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    if not current_broadcast:
+        bot.reply_to(m, "Рассылок не было.")
+        return
+    bot.reply_to(m, _broadcast_text(current_broadcast.stats()))
+
+@router.command("broadcast_cancel")
+def broadcast_cancel_cmd(m):
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    if current_broadcast and current_broadcast.running:
+        current_broadcast.cancel()
+        bot.reply_to(m, "Останавливаю рассылку…")
+    else:
+        bot.reply_to(m, "Активной рассылки нет.")
+
+@router.command("stats", "count")
+def send_stats(message):
+    c = users.counts()
+    bot.send_message(message.chat.id,
+                     f"Всего пользователей: {c['total']}\nНомер в списке: {c['phone_ok']}\n"
+                     f"Подтверждены (OTP): {c['verified']}\nАктивны: {c['active']}")
+
+def _top_lines(title: str, rows) -> list:
+    return [title] + ([f"{n:>5}  {key}" for key, n in rows] or ["—"])
+
+@router.command("top")
+def top_cmd(m):
+    """/top [язык] — что открывают и что ищут."""
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    args = (m.text or "").split()[1:]
+    lang = args[0] if args else None
+    c = catalog.current
+    titles = c.t(lang or c.default_lang)["file_titles"]
+    opened = [(titles.get(k, k), n) for k, n in events.top("open", lang, 15)]
+    lines = _top_lines(f"Открывают{f' ({lang})' if lang else ''}:", opened)
+    lines += [""] + _top_lines("Ищут:", events.top("search", lang, 10))
+    lines += [""] + _top_lines("OTP:", events.top("otp", None, 10))
+    bot.reply_to(m, "\n".join(lines))
+
+@router.command("misses")
+def misses_cmd(m):
+    """/misses [язык] — запросы, по которым поиск ничего не нашёл."""
+    if m.from_user.id not in ADMIN_IDS:
+        return
+    args = (m.text or "").split()[1:]
+    lang = args[0] if args else None
+    bot.reply_to(m, "\n".join(_top_lines(f"Не нашлось{f' ({lang})' if lang else ''}:",
+                                          events.top("miss", lang, 20))))
+
+@router.command("menu")
+@timed("show_menu")
+@require_access
+def show_menu(message):
+    uid = message.from_user.id
+    ensure_user_record(uid)
+    rec = users.get(str(uid), {})
+    send_main_menu(uid, user_data.lang(uid), rec.get("name", "User"))
+
+LANG_PROMPT = "Выберите язык / Select language / Dil seçin:"
+
+@router.command("start")
+@timed("start")
+@require_access
+def start(message):
+    user_id = message.from_user.id
+    ensure_user_record(user_id)
+
+    rec = users.get(str(user_id), {})
+    if not rec.get("name"):
+        intro_video_id = catalog.current.videos.get("intro")
+        if intro_video_id:
+            try:
+                bot.send_video(message.chat.id, intro_video_id)
+            except Exception as e:
+                logging.error(f"Не удалось отправить видео приветствия: {e}")
+        sent = bot.send_message(message.chat.id, LANG_PROMPT, reply_markup=menu_markup("lang", "*"))
+        user_data.set(user_id, lang_msg=sent.message_id, state="awaiting_language")
+    else:
+        send_main_menu(user_id, user_data.lang(user_id), rec.get("name", "User"))
+
+@router.callback(prefix="lang")
+@timed("ask_name")
+@require_access
+def ask_name(call):
+    user_id = call.from_user.id
+    c = catalog.current
+    lang = call.data.split("_")[1]
+    if lang not in c.texts:
+        lang = c.default_lang
+    # выбор языка превращаем в приветствие на месте
+    try:
+        bot.edit_message_text(c.t(lang)["welcome"], call.message.chat.id, call.message.message_id)
+        name_msg = call.message.message_id
+    except Exception:
+        try:
+            bot.delete_message(call.message.chat.id, call.message.message_id)
+        except Exception:
+            pass
+        name_msg = bot.send_message(call.message.chat.id, c.t(lang)["welcome"]).message_id
+    user_data.set(user_id, lang=lang, state="awaiting_name", name_msg=name_msg)
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+@router.state("awaiting_name")
+@timed("get_name")
+@require_access
+def get_name(message):
+    user_id = message.from_user.id
+    ensure_user_record(user_id)
+    name = (message.text or "").strip()
+
+    users.update(user_id, name=name)
+
+    conv = user_data.get(user_id, {})
+    try:
+        nm = conv.get("name_msg", 0)
+        if nm:
+            bot.delete_message(message.chat.id, nm)
+        bot.delete_message(message.chat.id, message.message_id)
+    except Exception:
+        pass
+
+    send_main_menu(user_id, conv.get("lang", "ru"), name)
+
+def send_main_menu(user_id: int, lang: str = None, name: str = None):
+    rec = users.get(str(user_id), {})
+    conv = user_data.get(user_id, {})
+    lang = (lang or conv.get("lang") or "ru")
+    name = (name or conv.get("name") or rec.get("name", "User"))
+
+    bot.send_message(user_id, catalog.current.t(lang)["name_reply"].format(name=name), reply_markup=menu_markup("main", lang))
+
+    user_data.update(user_id, state="main", lang=lang, name=name)
+
+# ──────────────── НАВИГАЦИЯ ────────────────
+# callback_data -> (текст экрана, клавиатура, состояние после перехода)
+MENU_TREE = {
+    "main_menu":   (lambda t, name: t["name_reply"].format(name=name), "main", "main"),
+    "materials":   (lambda t, name: t["choose_file"], "materials", "materials"),
+    "videoguides": (lambda t, name: t["video_choice"], "videoguides", "videoguides"),
+    "contact":     (lambda t, name: t["contact_text"], "contact", "contact"),
+    "search":      (lambda t, name: t["search"] + ": Введите ключевое слово для поиска.", None, "search"),
+}
+
+def render_screen(data: str, lang: str, name: str):
+    """
+    Экран для callback_data: (file_id видео или None, текст/подпись, клавиатура, состояние или None).
+    None — если такого экрана нет.
+    """
+    c = catalog.current
+    t = c.t(lang)
+    if data in MENU_TREE:
+        text, menu, state = MENU_TREE[data]
+        return None, text(t, name), (menu_markup(menu, lang) if menu else None), state
+    if data.startswith("file_"):
+        file_key = data[5:]
+        back_to = "materials" if file_key in c.materials else "videoguides"
+        markup = menu_markup("back:" + back_to, lang)
+        title = t["file_titles"].get(file_key, file_key)
+        file_id = c.videos.get(file_key)
+        if file_id:
+            return file_id, title, markup, None
+        path = c.materials.get(file_key)
+        if path and path.startswith("http"):
+            return None, f"{title}:\n{path}", markup, None
+        return None, "Файл не найден.", markup, None
+    return None
+
+def show_screen(message, video, text, markup):
+    """
+    Показать экран вместо сообщения message. Текстовое сообщение правится на месте
+    (один запрос, без мигания); удалить и отправить заново приходится, только если
+    в сообщении или на новом экране видео, либо сообщение уже нельзя править.
+    """
+    chat_id = message.chat.id
+    if video is None and getattr(message, "content_type", None) == "text":
+        try:
+            bot.edit_message_text(text, chat_id, message.message_id, reply_markup=markup)
+            return
+        except ApiTelegramException as e:
+            if "message is not modified" in (e.description or ""):
+                return
+    try:
+        bot.delete_message(chat_id, message.message_id)
+    except Exception:
+        pass
+    if video:
+        bot.send_video(chat_id, video, caption=text, reply_markup=markup)
+    else:
+        bot.send_message(chat_id, text, reply_markup=markup)
+
+@router.default_callback
+@timed("callback_handler")
+@require_access
+def callback_handler(call):
+    user_id = call.from_user.id
+    name = users.get(str(user_id), {}).get("name", "User")
+
+    conv = user_data.get(user_id)
+    if conv is None:
+        conv = user_data.set(user_id, lang="ru", name=name)
+        data = "main_menu"
+    else:
+        data = call.data
+    lang = conv.get("lang", "ru")
+
+    screen = render_screen(data, lang, name)
+    if screen:
+        video, text, markup, state = screen
+        show_screen(call.message, video, text, markup)
+        track_open(user_id, lang, data)
+        if state:
+            user_data.update(user_id, state=state)
+
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+@router.state("search")
+@timed("handle_search")
+@require_access
+def handle_search(message):
+    user_id = message.from_user.id
+    lang = user_data.lang(user_id)
+    query = (message.text or "").lower()
+
+    results = catalog.current.search.search(query)
+    events.emit("search", user_id, lang, q=query, n=len(results))
+
+    if results:
+        markup = menu_markup("results:" + ",".join(results), lang)
+        bot.send_message(message.chat.id, f"Результаты поиска по запросу: «{message.text}»", reply_markup=markup)
+    else:
+        bot.send_message(message.chat.id, f"По запросу «{message.text}» ничего не найдено. Попробуйте другое ключевое слово.")
+
+# ──────────────── POLLING ────────────────
+UPDATES_BATCH = 100     # больше getUpdates не отдаёт
+
+def _submit_polled(update):
+    if accept_update(update):
+        update_executor.submit(update, wait=True)
+    else:
+        checkpoint.finish(update.update_id)
+
+def poll_updates(timeout: int = 60):
+    """
+    Long polling через тот же update_executor, что и вебхук.
+
+    Telegram получает offset = checkpoint.offset() — после последнего взятого
+    апдейта, так что приём не ждёт медленных хендлеров. Взятые, но не
+    обработанные апдейты checkpoint записывает до их подтверждения
+    (save() перед каждым getUpdates), после перезапуска они обрабатываются
+    заново (replay). Сырые апдейты — из apihelper.get_updates: их и хранит checkpoint.
+    При старте накопившееся за время простоя выбирается пачками с
+    long_polling_timeout=1: если апдейты есть, Telegram отдаёт их сразу
+    (0 не годится — telebot заменит его своими 10 с);
+    сообщения старше UPDATE_MAX_AGE_SECS пропускаются.
+    """
+    replayed = checkpoint.replay()
+    for raw in replayed:
+        _submit_polled(types.Update.de_json(raw))
+    if replayed:
+        logging.warning(f"checkpoint: {len(replayed)} unfinished updates replayed")
+    draining, drained, t0 = True, 0, time.monotonic()
+    while not stopping.is_set():
+        checkpoint.save()
+        try:
+            batch = apihelper.get_updates(TOKEN, offset=checkpoint.offset(), limit=UPDATES_BATCH,
+                                          timeout=timeout + 5, allowed_updates=HANDLED_UPDATES,
+                                          long_polling_timeout=1 if draining else timeout)
+        except Exception as e:
+            logging.error(f"polling error: {e}")
+            time.sleep(3)
+            continue
+        fresh = 0
+        for raw in batch:
+            if not checkpoint.take(raw["update_id"], raw):
+                continue
+            fresh += 1
+            _submit_polled(types.Update.de_json(raw))
+        if draining:
+            drained += fresh
+            if len(batch) < UPDATES_BATCH:
+                draining = False
+                if drained:
+                    logging.warning(f"backlog: {drained} updates taken in {time.monotonic() - t0:.1f}s")
+
+# ──────────────── SHUTDOWN ────────────────
+# SIGTERM (деплой): перестаём брать апдейты, доделываем принятые, сохраняем checkpoint
+stopping = threading.Event()
+
+def _on_sigterm(signum, frame):
+    if stopping.is_set():
+        return
+    stopping.set()
+    # прерывает app.run / ожидание getUpdates в главном потоке; дальше — shutdown_gracefully()
+    raise SystemExit(0)
+
+def shutdown_gracefully():
+    stopping.set()
+    t0 = time.monotonic()
+    update_executor.shutdown(timeout=SHUTDOWN_DRAIN_SECS)
+    checkpoint.close()
+    left = update_executor.stats()["depth"]
+    logging.warning(f"shutdown: updates drained in {time.monotonic() - t0:.1f}s, left in queue: {left}, "
+                    f"checkpoint: {checkpoint.done}")
+
+# ──────────────── RUN ────────────────
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    try:
+        if USE_WEBHOOK:
+            if not PUBLIC_URL:
+                raise SystemExit("PUBLIC_URL не задан. Укажи https://<your-app>.up.railway.app")
+            # без drop_pending_updates: накопившееся за деплой Telegram доставит на вебхук
+            bot.set_webhook(url=PUBLIC_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                            allowed_updates=HANDLED_UPDATES)
+            update_executor.start()
+            resume_broadcast()
+            app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8080")), threaded=True, use_reloader=False)
+        else:
+            bot.remove_webhook()
+            threading.Thread(
+                target=lambda: app.run(host="0.0.0.0", port=int(os.getenv("PORT","8080")), threaded=True, use_reloader=False),
+                daemon=True
+            ).start()
+            update_executor.start()
+            resume_broadcast()
+            poll_updates(timeout=60)
+
+    except ApiTelegramException as e:
+        print(f"❌ Telegram error: {e}")
+        raise
+    finally:
+        shutdown_gracefully()
@@ -0,0 +1,475 @@
+"""
+Asyncio-режим бота: те же экраны и правила доступа на AsyncTeleBot,
+вебхук / WebApp / OTP — ASGI-приложение на том же event loop.
+
+    python bot_async.py                     # polling или вебхук (USE_WEBHOOK=1) + ASGI
+    uvicorn bot_async:app --port 8080       # только ASGI (вебхук ставится при старте)
+
+Пользователи, user_data, контент, клавиатуры и OTP общие с bot.py —
+отсюда он только импортируется, синхронный бот при этом не запускается.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from functools import wraps
+from urllib.parse import parse_qsl
+
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+
+import bot as core
+from tracing import span
+from dispatch import AsyncChatSerializer
+from router import Router
+
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "1000"))
+PORT = int(os.getenv("PORT", "8080"))
+
+# ──────────────── BOT ────────────────
+if core.TELEGRAM_API_URL:
+    asyncio_helper.API_URL = core.TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+
+def _observed(process_request):
+    """Те же метрики Bot API, что и core.observed_request, для asyncio_helper."""
+    async def call(token, url, method="get", params=None, files=None, **kwargs):
+        code = "exc"
+        t0 = time.perf_counter()
+        try:
+            result = await process_request(token, url, method, params, files, **kwargs)
+            code = "200"
+            return result
+        except asyncio_helper.ApiTelegramException as e:
+            code = str(e.error_code)
+            raise
+        finally:
+            core.BOT_API_SECONDS.observe(time.perf_counter() - t0, (url,))
+            core.BOT_API_REQUESTS.inc((url, code))
+    return call
+
+def _traced(process_request):
+    """Спан api:<метод> текущего апдейта, как core.traced_request."""
+    async def call(token, url, method="get", params=None, files=None, **kwargs):
+        with span("api:" + url):
+            return await process_request(token, url, method, params, files, **kwargs)
+    return call
+
+# лимиты Bot API общие с синхронным режимом (те же бакеты SendScheduler)
+asyncio_helper._process_request = _traced(core.send_scheduler.wrap_async(
+    _observed(asyncio_helper._process_request), asyncio_helper.ApiTelegramException))
+
+abot = AsyncTeleBot(core.TOKEN, parse_mode=None)
+
+# хендлеры — в таблицах Router, как и в bot.py; dispatch() отдаёт корутину хендлера
+arouter = Router(state_of=core.user_data.state)
+
+async def _process(update):
+    # стеки не снимаем: поток loop общий для всех апдейтов
+    with core.tracer.trace(update.update_id, core.update_user_id(update), core.update_kind(update),
+                           sample=False) as tr:
+        try:
+            msg = update.message
+            if msg is not None and msg.content_type == "text" and msg.from_user:
+                # шаг диалога для arouter.resolve — в LRU заранее, чтобы state_of не ходил в базу на loop
+                await store(core.user_data.state, msg.from_user.id)
+            handler, arg = arouter.resolve(update)
+            if handler is not None:
+                tr.handler = handler.__name__
+                pending = handler(arg)
+                if pending is not None:
+                    await pending
+        finally:
+            core.checkpoint.finish(update.update_id)
+
+updates = AsyncChatSerializer(_process, key=core.update_shard_key, max_inflight=ASYNC_MAX_INFLIGHT)
+
+async def store(fn, *args, **kwargs):
+    """
+    Вызов хранилища — в пуле потоков: users.json, state.db и Postgres держат
+    блокировки и ходят на диск/в сеть, а промах LRU user_data читает базу.
+    """
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+async def _answer(call):
+    try:
+        await abot.answer_callback_query(call.id)
+    except Exception:
+        pass
+
+# ──────────────── ACCESS ────────────────
+def require_access(handler):
+    """Те же правила, что core.require_access, решение — core.access_reply."""
+    @wraps(handler)
+    async def wrapper(update, *args, **kwargs):
+        uid, chat_id, chat_type = core.update_origin(update)
+        denial = await store(core.access_reply, uid, chat_type)
+        if denial is None:
+            return await handler(update, *args, **kwargs)
+        if denial:
+            text, kb = denial
+            await abot.send_message(chat_id, text, reply_markup=kb)
+            if isinstance(update, types.CallbackQuery):
+                await _answer(update)
+    return wrapper
+
+# ──────────────── HANDLERS ────────────────
+@arouter.content("contact")
+@core.timed("handle_contact")
+async def handle_contact(message):
+    uid = message.from_user.id
+    await store(core.ensure_user_record, uid)
+
+    if not message.contact or message.contact.user_id != uid:
+        await abot.reply_to(message, "Отправьте свой номер через кнопку «Подтвердить номер 📱».")
+        return
+
+    phone = core.normalize_phone(message.contact.phone_number)
+    if not phone:
+        await abot.reply_to(message, "Не удалось распознать номер. Попробуйте ещё раз.")
+        return
+
+    rec = await store(core.users.update, uid, phone=phone, phone_ok=(phone in core.allowed_phones))
+
+    await abot.send_message(message.chat.id, f"Номер получен: {phone}", reply_markup=types.ReplyKeyboardRemove())
+
+    if not rec["phone_ok"]:
+        await abot.send_message(message.chat.id, "❌ Ваш номер не в списке доступа. Обратитесь к администратору.")
+        return
+
+    if core.REQUIRE_CODE and not rec.get("verified"):
+        await abot.send_message(message.chat.id, "✅ Номер подтверждён. Осталось подтвердить вход:",
+                                reply_markup=core.webapp_markup())
+    else:
+        await abot.send_message(message.chat.id, "✅ Доступ разрешён. Открываю меню…")
+        try:
+            await start(message)
+        except Exception:
+            pass
+
+@arouter.command("menu")
+@core.timed("show_menu")
+@require_access
+async def show_menu(message):
+    await send_main_menu(message.from_user.id)
+
+@arouter.command("start")
+@core.timed("start")
+@require_access
+async def start(message):
+    user_id = message.from_user.id
+    rec = await store(core.users.get, str(user_id), {})
+    if rec.get("name"):
+        await send_main_menu(user_id)
+        return
+
+    # видео приветствия и выбор языка уходят параллельно
+    intro_video_id = core.catalog.current.videos.get("intro")
+    prompt = abot.send_message(message.chat.id, core.LANG_PROMPT, reply_markup=core.menu_markup("lang", "*"))
+    if intro_video_id:
+        video, sent = await asyncio.gather(abot.send_video(message.chat.id, intro_video_id), prompt,
+                                           return_exceptions=True)
+        if isinstance(video, Exception):
+            logging.error(f"Не удалось отправить видео приветствия: {video}")
+        if isinstance(sent, Exception):
+            raise sent
+    else:
+        sent = await prompt
+    await store(core.user_data.set, user_id, lang_msg=sent.message_id, state="awaiting_language")
+
+@arouter.callback(prefix="lang")
+@core.timed("ask_name")
+@require_access
+async def ask_name(call):
+    user_id = call.from_user.id
+    c = core.catalog.current
+    lang = call.data.split("_")[1]
+    if lang not in c.texts:
+        lang = c.default_lang
+    welcome = c.t(lang)["welcome"]
+    chat_id, name_msg = call.message.chat.id, call.message.message_id
+    try:
+        await abot.edit_message_text(welcome, chat_id, name_msg)
+    except Exception:
+        try:
+            await abot.delete_message(chat_id, name_msg)
+        except Exception:
+            pass
+        name_msg = (await abot.send_message(chat_id, welcome)).message_id
+    await store(core.user_data.set, user_id, lang=lang, state="awaiting_name", name_msg=name_msg)
+    await _answer(call)
+
+@arouter.state("awaiting_name")
+@core.timed("get_name")
+@require_access
+async def get_name(message):
+    user_id = message.from_user.id
+    name = (message.text or "").strip()
+
+    await store(core.users.update, user_id, name=name)
+    conv = await store(core.user_data.get, user_id, {})
+
+    # удаления не зависят друг от друга — отправляем разом
+    chat_id = message.chat.id
+    deletes = [abot.delete_message(chat_id, message.message_id)]
+    nm = conv.get("name_msg", 0)
+    if nm:
+        deletes.append(abot.delete_message(chat_id, nm))
+    await asyncio.gather(*deletes, return_exceptions=True)
+
+    await send_main_menu(user_id, conv.get("lang", "ru"), name)
+
+async def send_main_menu(user_id: int, lang: str = None, name: str = None):
+    rec = await store(core.users.get, str(user_id), {})
+    conv = await store(core.user_data.get, user_id, {})
+    lang = (lang or conv.get("lang") or "ru")
+    name = (name or conv.get("name") or rec.get("name", "User"))
+
+    await abot.send_message(user_id, core.catalog.current.t(lang)["name_reply"].format(name=name),
+                            reply_markup=core.menu_markup("main", lang))
+
+    await store(core.user_data.update, user_id, state="main", lang=lang, name=name)
+
+async def show_screen(message, video, text, markup):
+    """Как core.show_screen: правка на месте, удалить и отправить — только если иначе нельзя."""
+    chat_id = message.chat.id
+    if video is None and getattr(message, "content_type", None) == "text":
+        try:
+            await abot.edit_message_text(text, chat_id, message.message_id, reply_markup=markup)
+            return
+        except asyncio_helper.ApiTelegramException as e:
+            if "message is not modified" in (e.description or ""):
+                return
+    try:
+        await abot.delete_message(chat_id, message.message_id)
+    except Exception:
+        pass
+    if video:
+        await abot.send_video(chat_id, video, caption=text, reply_markup=markup)
+    else:
+        await abot.send_message(chat_id, text, reply_markup=markup)
+
+@arouter.default_callback
+@core.timed("callback_handler")
+@require_access
+async def callback_handler(call):
+    user_id = call.from_user.id
+    name = (await store(core.users.get, str(user_id), {})).get("name", "User")
+
+    conv = await store(core.user_data.get, user_id)
+    if conv is None:
+        conv = await store(core.user_data.set, user_id, lang="ru", name=name)
+        data = "main_menu"
+    else:
+        data = call.data
+    lang = conv.get("lang", "ru")
+
+    screen = core.render_screen(data, lang, name)
+    if screen:
+        video, text, markup, state = screen
+        # ответ на callback убирает «часики» — не ждём его после перерисовки
+        await asyncio.gather(show_screen(call.message, video, text, markup), _answer(call))
+        core.track_open(user_id, lang, data)
+        if state:
+            await store(core.user_data.update, user_id, state=state)
+    else:
+        await _answer(call)
+
+@arouter.state("search")
+@core.timed("handle_search")
+@require_access
+async def handle_search(message):
+    user_id = message.from_user.id
+    lang = await store(core.user_data.lang, user_id)
+    query = (message.text or "").lower()
+    results = core.catalog.current.search.search(query)
+    core.events.emit("search", user_id, lang, q=query, n=len(results))
+
+    if results:
+        markup = core.menu_markup("results:" + ",".join(results), lang)
+        await abot.send_message(message.chat.id, f"Результаты поиска по запросу: «{message.text}»",
+                                reply_markup=markup)
+    else:
+        await abot.send_message(message.chat.id,
+                                f"По запросу «{message.text}» ничего не найдено. Попробуйте другое ключевое слово.")
+
+def _threaded(handler):
+    """Sync-хендлер из core.router — в пуле потоков, отвечает через синхронный bot."""
+    @wraps(handler)
+    async def run(arg):
+        await asyncio.to_thread(handler, arg)
+    return run
+
+# админские команды (/stats, /broadcast, /import_phones, …), документы и всё,
+# что не переписано на async, — из таблиц bot.py
+arouter.include(core.router, _threaded)
+
+# ──────────────── ASGI ────────────────
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        msg = await receive()
+        chunks.append(msg.get("body", b""))
+        if not msg.get("more_body"):
+            return b"".join(chunks)
+
+async def _respond(send, status: int, body, content_type: str = "text/plain; charset=utf-8"):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type.encode()),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+async def _respond_json(send, payload: dict, status: int):
+    await _respond(send, status, json.dumps(payload, ensure_ascii=False), "application/json")
+
+async def _lifespan(receive, send):
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            if core.USE_WEBHOOK:
+                if not core.PUBLIC_URL:
+                    await send({"type": "lifespan.startup.failed", "message": "PUBLIC_URL не задан"})
+                    return
+                # без drop_pending_updates: накопившееся за деплой Telegram доставит на вебхук
+                await abot.set_webhook(url=core.PUBLIC_URL + WEBHOOK_PATH, secret_token=core.WEBHOOK_SECRET,
+                                       allowed_updates=core.HANDLED_UPDATES)
+            await asyncio.to_thread(core.resume_broadcast)
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            await updates.join()
+            if asyncio_helper.session_manager.session:
+                await asyncio_helper.session_manager.session.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+WEBHOOK_PATH = core.WEBHOOK_PATH
+
+async def app(scope, receive, send):
+    """Маршруты те же, что у Flask-приложения bot.py."""
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    method, path = scope["method"], scope["path"]
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+
+    if method == "GET" and path == "/metrics":
+        query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        if not core.metrics_allowed(query.get("token", ""), headers.get("authorization", "")):
+            return await _respond(send, 403, "forbidden")
+        return await _respond(send, 200, core.REGISTRY.render(), "text/plain; version=0.0.4; charset=utf-8")
+
+    if method == "GET" and path == "/webapp":
+        return await _respond(send, 200, core.HTML_WEBAPP, "text/html; charset=utf-8")
+
+    if method == "POST" and path in ("/api/otp/issue", "/api/otp/verify"):
+        body = await _read_body(receive)
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        init_data = headers.get("x-init-data") or query.get("init_data") or payload.get("init_data") or ""
+        t0 = time.perf_counter()
+        if path.endswith("/issue"):
+            res = await store(core.otp_issue_response, init_data)
+        else:
+            res = await store(core.otp_verify_response, init_data, payload)
+        core.HANDLER_SECONDS.observe(time.perf_counter() - t0, ("otp_" + path.rsplit("/", 1)[-1],))
+        return await _respond_json(send, *res)
+
+    if method == "POST" and path == WEBHOOK_PATH:
+        # секрет и размер — до чтения тела, как в core.telegram_webhook
+        denied = core.webhook_allowed(headers.get("x-telegram-bot-api-secret-token"), headers.get("content-length"))
+        if denied:
+            return await _respond(send, denied, "denied")
+        if headers.get("content-type") != "application/json":
+            return await _respond(send, 400, "bad")
+        try:
+            data = core.json_loads(await _read_body(receive))
+        except ValueError:
+            return await _respond(send, 400, "bad")
+        update = core.accept_raw_update(data) if isinstance(data, dict) else None
+        if update is None:
+            return await _respond(send, 200, "ok")
+        if not updates.submit(update):
+            # слишком много апдейтов в работе — Telegram повторит доставку позже
+            return await _respond(send, 503, "busy")
+        return await _respond(send, 200, "ok")
+
+    return await _respond(send, 404, "not found")
+
+# ──────────────── POLLING ────────────────
+async def _submit_polled(update):
+    if not core.accept_update(update):
+        core.checkpoint.finish(update.update_id)
+        return
+    while not updates.submit(update):
+        await asyncio.sleep(0.05)
+
+async def poll_updates(timeout: int = 60):
+    """
+    То же, что core.poll_updates, на том же loop: подтверждаем взятое, недоделанное — из checkpoint.replay().
+    Backlog — с timeout=0: asyncio_helper его не подменяет, Telegram отвечает сразу.
+    """
+    for raw in core.checkpoint.replay():
+        await _submit_polled(types.Update.de_json(raw))
+    draining, drained, t0 = True, 0, time.monotonic()
+    while True:
+        core.checkpoint.save()
+        try:
+            batch = await asyncio_helper.get_updates(core.TOKEN, offset=core.checkpoint.offset(),
+                                                     limit=core.UPDATES_BATCH, timeout=0 if draining else timeout,
+                                                     allowed_updates=core.HANDLED_UPDATES,
+                                                     request_timeout=timeout + 5)
+        except Exception as e:
+            logging.error(f"polling error: {e}")
+            await asyncio.sleep(3)
+            continue
+        fresh = 0
+        for raw in batch:
+            if not core.checkpoint.take(raw["update_id"], raw):
+                continue
+            fresh += 1
+            await _submit_polled(types.Update.de_json(raw))
+        if draining:
+            drained += fresh
+            if len(batch) < core.UPDATES_BATCH:
+                draining = False
+                if drained:
+                    logging.warning(f"backlog: {drained} updates taken in {time.monotonic() - t0:.1f}s")
+
+# ──────────────── RUN ────────────────
+async def main():
+    import uvicorn
+
+    # uvicorn ловит SIGTERM сам (server.serve() завершается, lifespan дожидается
+    # апдейтов) и после выхода посылает его себе повторно — тут он уже не убивает
+    # процесс, а только отмечает остановку, чтобы доделать polling ниже
+    signal.signal(signal.SIGTERM, lambda signum, frame: core.stopping.set())
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=PORT, lifespan="on", log_level="warning"))
+    if core.USE_WEBHOOK:
+        await server.serve()
+        return
+    await abot.delete_webhook()
+    poller = asyncio.create_task(poll_updates(timeout=60))
+    try:
+        await server.serve()
+    finally:
+        poller.cancel()
+        await asyncio.gather(poller, return_exceptions=True)
+        try:
+            await asyncio.wait_for(updates.join(), core.SHUTDOWN_DRAIN_SECS)
+        except asyncio.TimeoutError:
+            logging.error(f"shutdown: {updates.stats()['inflight']} updates still in work")
+        core.checkpoint.close()
+        if asyncio_helper.session_manager.session:
+            await asyncio_helper.session_manager.session.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,201 @@
+"""
+Рассылка по пользователям из хранилища.
+
+Получатели идут потоком из UserStore.iter_uids() по возрастанию uid,
+отправляют их несколько потоков под outbound.bulk(): темп и 429 держит
+SendScheduler, а интерактивные ответы бота идут впереди рассылки.
+
+Прогресс — «всё до uid N включительно обработано» — и счётчики
+регулярно пишутся в checkpoint-файл (tmp + os.replace). После падения
+или рестарта рассылка продолжается с uid > N; те, кому сообщение ушло,
+но кто ещё не попал в checkpoint, получат его повторно (at-least-once).
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+import outbound
+
+RESULTS = ("sent", "failed", "blocked")
+
+
+def new_job(target: str, admin_chat: int, **fields) -> dict:
+    return {"id": uuid.uuid4().hex[:8], "target": target, "admin_chat": admin_chat,
+            "status": "running", "after": None, "started": time.time(),
+            **dict.fromkeys(RESULTS, 0), **fields}
+
+
+def load_checkpoint(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class Broadcast:
+    def __init__(self, job: dict, send, iter_uids, on_blocked=None, on_progress=None,
+                 path: str = "broadcast.json", threads: int = 8,
+                 save_every: float = 2.0, progress_every: float = 15.0):
+        """
+        send(uid, job)        — отправить одному; исключение Bot API = неудача;
+        iter_uids(field, after) — получатели по возрастанию uid;
+        on_blocked(uid)       — Telegram ответил 403;
+        on_progress(job, stats) — периодически и в конце.
+        """
+        self.job = job
+        self.send = send
+        self.iter_uids = iter_uids
+        self.on_blocked = on_blocked
+        self.on_progress = on_progress
+        self.path = path
+        self.threads = max(1, threads)
+        self.save_every = save_every
+        self.progress_every = progress_every
+
+        self._lock = threading.Lock()
+        self._pending = deque()   # выданные воркерам uid по порядку
+        self._finished = set()    # обработанные, но ещё не под watermark
+        self._cancel = threading.Event()
+        self._thread = None
+        self._run_started = 0.0
+        self._run_done = 0
+        self._saved_at = 0.0
+        self._reported_at = 0.0
+
+    # ─────────────── управление ───────────────
+    def start(self):
+        self.save()
+        self._thread = threading.Thread(target=self._run, name=f"broadcast-{self.job['id']}", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout: float = None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    # ─────────────── работа ───────────────
+    def _run(self):
+        self._run_started = time.monotonic()
+        field = None if self.job["target"] == "all" else self.job["target"]
+        q = queue.Queue(maxsize=self.threads * 4)
+        workers = [threading.Thread(target=self._worker, args=(q,), daemon=True) for _ in range(self.threads)]
+        for t in workers:
+            t.start()
+        try:
+            for uid in self.iter_uids(field, self.job["after"]):
+                if self._cancel.is_set():
+                    break
+                with self._lock:
+                    self._pending.append(uid)
+                q.put(uid)
+        except Exception as e:
+            logging.error(f"broadcast {self.job['id']} recipients error: {e}")
+            self._cancel.set()
+        for _ in workers:
+            q.put(None)
+        for t in workers:
+            t.join()
+
+        with self._lock:
+            self.job["status"] = "cancelled" if self._cancel.is_set() else "done"
+            self.job["finished"] = time.time()
+        self.save()
+        self._report()
+
+    def _worker(self, q: queue.Queue):
+        with outbound.bulk():
+            while True:
+                uid = q.get()
+                if uid is None:
+                    return
+                if self._cancel.is_set():
+                    continue      # не отмечаем — при возобновлении уйдёт заново
+                try:
+                    self.send(uid, self.job)
+                    result = "sent"
+                except ApiTelegramException as e:
+                    result = "blocked" if e.error_code == 403 else "failed"
+                    if result == "failed":
+                        logging.error(f"broadcast {self.job['id']} -> {uid}: {e}")
+                except Exception as e:
+                    result = "failed"
+                    logging.error(f"broadcast {self.job['id']} -> {uid}: {e}")
+                if result == "blocked" and self.on_blocked:
+                    try:
+                        self.on_blocked(uid)
+                    except Exception as e:
+                        logging.error(f"broadcast on_blocked error: {e}")
+                try:
+                    self._done(uid, result)
+                except Exception as e:
+                    # воркер не должен умереть: _run ждёт на q.put, пока очередь разбирают
+                    logging.error(f"broadcast {self.job['id']} bookkeeping error: {e}")
+
+    def _done(self, uid: int, result: str):
+        now = time.monotonic()
+        with self._lock:
+            self.job[result] += 1
+            self._run_done += 1
+            self._finished.add(uid)
+            while self._pending and self._pending[0] in self._finished:
+                self._finished.discard(self._pending[0])
+                self.job["after"] = self._pending.popleft()
+            save = now - self._saved_at >= self.save_every
+            report = now - self._reported_at >= self.progress_every
+            if save:
+                self._saved_at = now
+            if report:
+                self._reported_at = now
+        if save:
+            self.save()
+        if report:
+            self._report()
+
+    def _report(self):
+        if self.on_progress:
+            try:
+                self.on_progress(self.job, self.stats())
+            except Exception as e:
+                logging.error(f"broadcast progress error: {e}")
+
+    # ─────────────── состояние ───────────────
+    def save(self):
+        with self._lock:
+            data = json.dumps(self.job, ensure_ascii=False)
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            # рассылка идёт дальше; checkpoint догонит при следующем save()
+            logging.error(f"broadcast {self.job['id']} checkpoint save error: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self._run_started if self._run_started else 0.0
+            return {
+                "id": self.job["id"], "target": self.job["target"], "status": self.job["status"],
+                **{k: self.job[k] for k in RESULTS},
+                "in_flight": len(self._pending),
+                "after_uid": self.job["after"],
+                "rate": round(self._run_done / elapsed, 1) if elapsed else 0.0,
+                "elapsed_s": round(elapsed),
+            }
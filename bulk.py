@@ -0,0 +1,133 @@
+"""
+Массовый импорт whitelist из CSV и выгрузка пользователей в CSV.
+
+Всё построчно. CSV читается из потока (тело HTTP-запроса, документ из
+Telegram), новые номера дописываются в файл whitelist пачками по
+IMPORT_CHUNK. В памяти — текущая пачка плюс номера (int), дописанные за
+импорт (чтобы повтор в другой пачке не попал в файл дважды), и пары
+номер-имя из файла: владельцы ищутся одним find_by_phones после всего
+файла, имена уходят в хранилище пачками через users.update_many.
+
+phone_ok импорт сам не трогает: после записи whitelist пересобирается,
+и on_change получает все добавленные номера разом — владельцы находятся
+одним find_by_phones и обновляются тоже пачками (bot.on_phones_changed).
+
+Выгрузка — генератор кусков CSV по EXPORT_CHUNK строк поверх
+users.iter_records(): отдаётся потоком в HTTP-ответ или в файл.
+"""
+import csv
+import io
+import itertools
+
+from phones import decode, encode
+
+PHONE_HEADERS = {"phone", "phone_number", "телефон", "номер"}
+NAME_HEADERS = {"name", "имя", "фио"}
+EXPORT_FIELDS = ("uid", "name", "phone", "phone_ok", "verified", "active")
+EXPORT_FILTERS = ("phone_ok", "verified", "active")
+IMPORT_CHUNK = 5000      # номеров на пачку записи в whitelist
+WRITE_BATCH = 500        # записей на users.update_many
+EXPORT_CHUNK = 1000
+NAME_MAX = 64
+
+
+def read_rows(stream):
+    """
+    (номер строки, телефон, имя) из текстового потока CSV.
+    Разделитель — «,» или «;» (Excel), по первой строке. Если в первой
+    строке есть заголовок (phone/телефон, name/имя) — столбцы по нему,
+    иначе телефон — первый столбец, имя — второй.
+    """
+    first = stream.readline()
+    if not first:
+        return
+    delimiter = ";" if first.count(";") > first.count(",") else ","
+    reader = csv.reader(itertools.chain([first], stream), delimiter=delimiter)
+    first_row = next(reader)
+    header = [c.strip().lower() for c in first_row]
+    phone_col = next((i for i, c in enumerate(header) if c in PHONE_HEADERS), None)
+    if phone_col is None:
+        phone_col, name_col, head = 0, 1, [first_row]    # заголовка нет — это уже данные
+    else:
+        name_col = next((i for i, c in enumerate(header) if c in NAME_HEADERS), None)
+        head = []
+    for row in itertools.chain(head, reader):
+        if not row:
+            continue
+        phone = row[phone_col] if phone_col < len(row) else ""
+        name = row[name_col] if name_col is not None and name_col < len(row) else ""
+        yield reader.line_num, phone, " ".join(name.split())[:NAME_MAX]
+
+
+def import_phones(rows, users, whitelist) -> dict:
+    """
+    rows      — из read_rows;
+    users     — UserStore;
+    whitelist — PhoneWhitelist с файлом (новые номера дописываются в него).
+    Возвращает счётчики и первые ошибочные строки.
+    """
+    st = {"rows": 0, "bad": 0, "added": 0, "names": 0, "errors": []}
+    chunk = {}            # номер (int) -> имя
+    written = set()       # номера, уже дописанные в этом импорте
+    named = {}            # номер (int) -> имя, для владельцев — после всего файла
+
+    def flush(out):
+        fresh = [n for n in chunk if n not in whitelist and n not in written]
+        out.write("".join(f"{decode(n)},{chunk[n]}\n" if chunk[n] else f"{decode(n)}\n" for n in fresh))
+        out.flush()
+        written.update(fresh)
+        named.update((n, name) for n, name in chunk.items() if name)
+        chunk.clear()
+
+    with whitelist.appending() as out:
+        for line_no, phone, name in rows:
+            st["rows"] += 1
+            n = encode(phone)
+            if not n:
+                st["bad"] += 1
+                if len(st["errors"]) < 5:
+                    st["errors"].append(f"{line_no}: {phone!r}")
+                continue
+            if name or n not in chunk:
+                chunk[n] = name
+            if len(chunk) >= IMPORT_CHUNK:
+                flush(out)
+        flush(out)
+
+    # владельцы — одним find_by_phones на весь файл (у JSON это один проход по записям)
+    if named:
+        batch = []
+        for uid, rec in users.find_by_phones(decode(n) for n in named):
+            name = named.get(encode(rec.get("phone") or ""))
+            if name and rec.get("name") != name:
+                batch.append((uid, {"name": name}))
+            if len(batch) >= WRITE_BATCH:
+                st["names"] += users.update_many(batch)
+                batch = []
+        if batch:
+            st["names"] += users.update_many(batch)
+    # новые номера разом уходят в on_change — там пересчитывается phone_ok
+    st["whitelist"], st["added"], _ = whitelist.reload()
+    return st
+
+
+def export_users(users, only: str = None):
+    """Куски CSV (str): заголовок и пользователи; only — только с истинным полем (phone_ok, verified, active)."""
+    if only is not None and only not in EXPORT_FILTERS:
+        raise ValueError(f"only must be one of {EXPORT_FILTERS}")
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(EXPORT_FIELDS)
+    n = 0
+    for uid, rec in users.iter_records():
+        if only and not rec.get(only):
+            continue
+        w.writerow((uid, rec.get("name", ""), rec.get("phone", ""),
+                    int(bool(rec.get("phone_ok"))), int(bool(rec.get("verified"))),
+                    int(bool(rec.get("active", True)))))
+        n += 1
+        if n % EXPORT_CHUNK == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
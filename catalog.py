@@ -0,0 +1,252 @@
+"""
+Каталог контента: тексты по языкам, материалы, видео, поисковые слова, контакты.
+
+Источник — catalog.json. Из него собирается неизменяемый снимок Catalog:
+тексты (только для чтения), готовый JSON всех статичных клавиатур на
+каждый язык и поисковый индекс. Хендлер берёт catalog.current один раз
+и работает с ним до конца — снимок после сборки никто не меняет.
+
+CatalogFile пересобирает снимок в фоне (по изменению файла или по
+команде), проверяет file_id видео через getFile и только после этого
+подменяет current одним присваиванием. Ошибка в файле или битый
+file_id — остаётся прежний снимок.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from telebot import types
+
+from search import SearchIndex
+
+TEXT_KEYS = ("welcome", "name_reply", "materials", "videoguides", "contact", "search",
+             "choose_file", "back", "contact_text", "video_choice", "file_titles")
+STATIC_MENUS = ("lang", "main", "materials", "videoguides", "contact", "back:materials", "back:videoguides")
+RESULTS_CACHE_MAX = 1024   # сочетаний результатов поиска много — не растём бесконечно
+
+
+def _freeze(v):
+    if isinstance(v, dict):
+        return MappingProxyType({k: _freeze(x) for k, x in v.items()})
+    if isinstance(v, list):
+        return tuple(_freeze(x) for x in v)
+    return v
+
+
+def _check(data: dict):
+    """Структура catalog.json; ValueError с перечнем проблем."""
+    errors = []
+    for key, kind in (("languages", dict), ("materials", dict), ("videos", dict), ("video_guides", list),
+                      ("search_keywords", dict), ("contacts", dict), ("texts", dict)):
+        if not isinstance(data.get(key), kind):
+            errors.append(f"{key}: ожидается {kind.__name__}")
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    default = data.get("default_lang", "ru")
+    if default not in data["texts"]:
+        errors.append(f"default_lang {default!r} нет в texts")
+    for lang in data["languages"]:
+        t = data["texts"].get(lang)
+        if not isinstance(t, dict):
+            errors.append(f"texts.{lang}: нет текстов")
+            continue
+        missing = [k for k in TEXT_KEYS if k not in t]
+        if missing:
+            errors.append(f"texts.{lang}: нет {', '.join(missing)}")
+    for key in data["video_guides"]:
+        if key not in data["videos"]:
+            errors.append(f"video_guides: {key!r} нет в videos")
+    for key in list(data["materials"]) + list(data["videos"]):
+        # callback_data у Telegram — не длиннее 64 байт
+        if len(f"file_{key}".encode()) > 64:
+            errors.append(f"ключ {key!r} слишком длинный для callback_data")
+    if errors:
+        raise ValueError("; ".join(errors))
+
+
+class Catalog:
+    def __init__(self, data: dict, rev: str = ""):
+        _check(data)
+        self.rev = rev
+        self.default_lang = data.get("default_lang", "ru")
+        self.languages = _freeze(data["languages"])
+        self.texts = _freeze(data["texts"])
+        self.materials = _freeze(data["materials"])
+        self.videos = _freeze(data["videos"])
+        self.video_guides = _freeze(data["video_guides"])
+        self.contacts = _freeze(data["contacts"])
+        self.search = SearchIndex(
+            data["search_keywords"],
+            {lang: t["file_titles"] for lang, t in data["texts"].items()},
+        )
+        self._menus = {(menu, lang): self.build_menu(menu, lang).to_json()
+                       for menu in STATIC_MENUS for lang in self.texts}
+        self._results: dict = {}
+
+    def t(self, lang: str):
+        """Тексты языка (или языка по умолчанию)."""
+        return self.texts.get(lang) or self.texts[self.default_lang]
+
+    def build_menu(self, menu: str, lang: str) -> types.InlineKeyboardMarkup:
+        """
+        menu: lang | main | materials | videoguides | contact
+              | back:<callback>  — одна кнопка «Назад»
+              | results:<k1,k2>  — результаты поиска
+        """
+        t = self.t(lang)
+        titles = t["file_titles"]
+        back = types.InlineKeyboardButton(t["back"], callback_data="main_menu")
+
+        if menu == "lang":
+            markup = types.InlineKeyboardMarkup(row_width=3)
+            markup.add(*[types.InlineKeyboardButton(title, callback_data=f"lang_{code}")
+                         for code, title in self.languages.items()])
+        elif menu == "main":
+            markup = types.InlineKeyboardMarkup(row_width=2)
+            markup.add(
+                types.InlineKeyboardButton(t["materials"], callback_data="materials"),
+                types.InlineKeyboardButton(t["videoguides"], callback_data="videoguides"),
+                types.InlineKeyboardButton(t["contact"], callback_data="contact"),
+                types.InlineKeyboardButton(t["search"], callback_data="search")
+            )
+        elif menu == "materials":
+            markup = types.InlineKeyboardMarkup(row_width=1)
+            for key in self.materials:
+                markup.add(types.InlineKeyboardButton(titles.get(key, key), callback_data=f"file_{key}"))
+            markup.add(back)
+        elif menu == "videoguides":
+            markup = types.InlineKeyboardMarkup()
+            for key in self.video_guides:
+                markup.add(types.InlineKeyboardButton(titles.get(key, key), callback_data=f"file_{key}"))
+            markup.add(back)
+        elif menu == "contact":
+            markup = types.InlineKeyboardMarkup()
+            for title, url in self.contacts.get(lang, ()):
+                markup.add(types.InlineKeyboardButton(title, url=url))
+            markup.add(back)
+        elif menu.startswith("back:"):
+            markup = types.InlineKeyboardMarkup()
+            markup.add(types.InlineKeyboardButton(t["back"], callback_data=menu[5:]))
+        elif menu.startswith("results:"):
+            markup = types.InlineKeyboardMarkup()
+            for key in menu[8:].split(","):
+                markup.add(types.InlineKeyboardButton(titles.get(key, key), callback_data=f"file_{key}"))
+            markup.add(back)
+        else:
+            raise KeyError(menu)
+        return markup
+
+    def markup(self, menu: str, lang: str) -> str:
+        """
+        JSON клавиатуры. Статичные меню собраны при сборке снимка, остальные
+        (результаты поиска) — при первом запросе; telebot отправляет строку как есть.
+        """
+        if lang not in self.texts:
+            lang = self.default_lang
+        js = self._menus.get((menu, lang)) or self._results.get((menu, lang))
+        if js is None:
+            js = self.build_menu(menu, lang).to_json()
+            if len(self._results) >= RESULTS_CACHE_MAX:
+                self._results.clear()
+            self._results[(menu, lang)] = js
+        return js
+
+    def stats(self) -> dict:
+        return {"rev": self.rev, "languages": len(self.languages), "materials": len(self.materials),
+                "videos": len(self.videos), "searchable": len(self.search), "menus": len(self._menus)}
+
+
+def compile_file(path: str) -> Catalog:
+    with open(path, "rb") as f:
+        raw = f.read()
+    return Catalog(json.loads(raw), rev=hashlib.sha1(raw).hexdigest()[:8])
+
+
+class CatalogFile:
+    def __init__(self, path: str, check_file_id=None):
+        """
+        path          — catalog.json;
+        check_file_id — check_file_id(file_id): исключение, если Telegram такой файл не знает.
+                        Первый снимок при старте не проверяется — он уже был в работе.
+        """
+        self.path = path
+        self.check_file_id = check_file_id
+        self.current = compile_file(path)
+        self.loaded_at = time.time()
+        self._stamp = self._file_stamp()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _bad_videos(self, new: Catalog, check_all: bool) -> list:
+        """Ошибки getFile; file_id, которые уже были в живом снимке, повторно не проверяем."""
+        if self.check_file_id is None:
+            return []
+        live = set() if check_all else set(self.current.videos.values())
+        errors = []
+        for key, file_id in new.videos.items():
+            if file_id in live:
+                continue
+            try:
+                self.check_file_id(file_id)
+            except Exception as e:
+                errors.append(f"videos.{key}: {e}")
+        return errors
+
+    def reload(self, check_all: bool = False) -> list:
+        """
+        Собрать и проверить новый снимок; подменить, если всё в порядке.
+        Возвращает список ошибок — пустой, если снимок подменён.
+        """
+        with self._reload_lock:
+            self._stamp = self._file_stamp()
+            try:
+                new = compile_file(self.path)
+            except (OSError, ValueError) as e:
+                return [f"{self.path}: {e}"]
+            errors = self._bad_videos(new, check_all)
+            if errors:
+                return errors
+            self.current = new
+            self.loaded_at = time.time()
+        return []
+
+    def reload_async(self, done=None, check_all: bool = False):
+        """reload() в фоновом потоке; done(ошибки) — по завершении."""
+        def run():
+            errors = self.reload(check_all)
+            if done:
+                done(errors)
+        threading.Thread(target=run, name="catalog-reload", daemon=True).start()
+
+    def watch(self, interval: float = 10.0):
+        """Следить за файлом: при смене mtime/размера — reload() в этом же фоновом потоке."""
+        def loop():
+            while not self._stop.wait(interval):
+                if self._file_stamp() != self._stamp:
+                    errors = self.reload()
+                    if errors:
+                        logging.error(f"catalog reload rejected: {'; '.join(errors)}")
+                    else:
+                        logging.warning(f"catalog reloaded: rev {self.current.rev}")
+        if interval > 0:
+            threading.Thread(target=loop, name="catalog-watch", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {**self.current.stats(),
+                "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded_at))}
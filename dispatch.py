@@ -0,0 +1,355 @@
+"""
+Приём апдейтов отдельно от их обработки.
+
+ShardedExecutor раскладывает апдейты по N шардам по ключу (chat id):
+у каждого шарда своя ограниченная очередь и один воркер. Апдейты одного
+чата обрабатываются строго по порядку, разные чаты — параллельно.
+Используется и вебхуком, и циклом long polling.
+
+AsyncChatSerializer — то же для asyncio-режима: цепочка задач на чат,
+общий лимит задач в работе вместо очередей.
+
+UpdateCheckpoint — какие апдейты long polling взяты и какие из них ещё не
+обработаны (переживает перезапуск).
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+OVERFLOW_POLICIES = ("reject", "drop_oldest", "block")
+
+
+class ShardedExecutor:
+    """
+    Поведение при переполнении очереди шарда (overflow):
+      reject      — submit() возвращает False, вебхук отвечает 503 и Telegram
+                    доставит апдейт повторно позже;
+      drop_oldest — выкидываем самый старый апдейт шарда, новый принимаем;
+      block       — ждём место до block_timeout секунд, потом как reject.
+    submit(..., wait=True) ждёт места без ограничения — так работает polling:
+    пока воркеры заняты, новые апдейты просто не забираются у Telegram.
+    Воркеры запускаются start() или первым submit() — например, когда app
+    импортирует WSGI-сервер (gunicorn) и до start() в __main__ дело не доходит.
+    """
+
+    def __init__(self, handler, key=None, workers: int = 8, maxsize: int = 1000,
+                 overflow: str = "reject", block_timeout: float = 2.0, name: str = "updates"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
+        self.handler = handler
+        self.key = key or (lambda item: 0)
+        self.workers = max(1, workers)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.name = name
+
+        per_shard = max(1, maxsize // self.workers)
+        self._queues = [queue.Queue(maxsize=per_shard) for _ in range(self.workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self.counters = {
+            "submitted": 0, "processed": 0, "failed": 0,
+            "rejected": 0, "dropped": 0,
+        }
+        self._lag_last = 0.0
+        self._lag_max = 0.0
+        self._lag_avg = 0.0   # EWMA
+
+    def start(self):
+        """Запустить воркеров; повторный вызов ничего не делает."""
+        with self._lock:
+            if self._threads:
+                return self
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._worker, args=(q,), name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def _shard(self, item) -> queue.Queue:
+        try:
+            k = self.key(item)
+        except Exception:
+            k = 0
+        return self._queues[hash(k) % self.workers]
+
+    # ─────────────── приём ───────────────
+    def submit(self, item, wait: bool = False) -> bool:
+        if not self._threads:
+            self.start()
+        q = self._shard(item)
+        entry = (time.monotonic(), item)
+        try:
+            if wait:
+                q.put(entry)
+            elif self.overflow == "block":
+                q.put(entry, timeout=self.block_timeout)
+            else:
+                q.put_nowait(entry)
+        except queue.Full:
+            if self.overflow != "drop_oldest":
+                self._count("rejected")
+                return False
+            try:
+                q.get_nowait()
+                q.task_done()
+                self._count("dropped")
+            except queue.Empty:
+                pass
+            try:
+                q.put_nowait(entry)
+            except queue.Full:
+                self._count("rejected")
+                return False
+        self._count("submitted")
+        return True
+
+    # ─────────────── обработка ───────────────
+    def _worker(self, q: queue.Queue):
+        while True:
+            enqueued, item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            lag = time.monotonic() - enqueued
+            with self._lock:
+                self._busy += 1
+                self._lag_last = lag
+                self._lag_max = max(self._lag_max, lag)
+                self._lag_avg = lag if not self._lag_avg else 0.9 * self._lag_avg + 0.1 * lag
+            try:
+                self.handler(item)
+                self._count("processed")
+            except Exception as e:
+                self._count("failed")
+                logging.error(f"{self.name} handler error: {e}")
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                q.task_done()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counters[key] += 1
+
+    def stats(self) -> dict:
+        depths = [q.qsize() for q in self._queues]
+        with self._lock:
+            return {
+                **self.counters,
+                "depth": sum(depths),
+                "depth_max_shard": max(depths),
+                "capacity": sum(q.maxsize for q in self._queues),
+                "workers": self.workers,
+                "busy": self._busy,
+                "lag_last_ms": round(self._lag_last * 1000, 1),
+                "lag_avg_ms": round(self._lag_avg * 1000, 1),
+                "lag_max_ms": round(self._lag_max * 1000, 1),
+            }
+
+    def join(self):
+        """Дождаться, пока все принятые апдейты будут обработаны."""
+        for q in self._queues:
+            q.join()
+
+    def shutdown(self, timeout: float = 10.0):
+        """Доработать очереди и остановить воркеров."""
+        deadline = time.monotonic() + timeout
+        for q in self._queues:
+            try:
+                q.put((time.monotonic(), None), timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+
+class AsyncChatSerializer:
+    """
+    Каждый новый апдейт чата ждёт завершения предыдущего апдейта этого чата;
+    разные чаты идут параллельно на одном event loop. Если задач в работе
+    больше max_inflight, submit() возвращает False (вебхук отвечает 503).
+    """
+
+    def __init__(self, handler, key=None, max_inflight: int = 1000, name: str = "updates"):
+        self.handler = handler          # async def handler(item)
+        self.key = key or (lambda item: 0)
+        self.max_inflight = max_inflight
+        self.name = name
+        self._tails: dict = {}
+        self._inflight = 0
+        self.counters = {"submitted": 0, "processed": 0, "failed": 0, "rejected": 0}
+        self._lag_last = 0.0
+        self._lag_max = 0.0
+
+    def submit(self, item) -> bool:
+        if self._inflight >= self.max_inflight:
+            self.counters["rejected"] += 1
+            return False
+        try:
+            k = self.key(item)
+        except Exception:
+            k = 0
+        prev = self._tails.get(k)
+        task = asyncio.get_running_loop().create_task(self._run(prev, item, time.monotonic()))
+        self._tails[k] = task
+        task.add_done_callback(lambda t, k=k: self._tails.pop(k, None) if self._tails.get(k) is t else None)
+        self._inflight += 1
+        self.counters["submitted"] += 1
+        return True
+
+    async def _run(self, prev, item, enqueued: float):
+        try:
+            if prev is not None:
+                await asyncio.wait([prev])
+            lag = time.monotonic() - enqueued
+            self._lag_last = lag
+            self._lag_max = max(self._lag_max, lag)
+            await self.handler(item)
+            self.counters["processed"] += 1
+        except Exception as e:
+            self.counters["failed"] += 1
+            logging.error(f"{self.name} handler error: {e}")
+        finally:
+            self._inflight -= 1
+
+    async def join(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "inflight": self._inflight,
+            "chats": len(self._tails),
+            "capacity": self.max_inflight,
+            "lag_last_ms": round(self._lag_last * 1000, 1),
+            "lag_max_ms": round(self._lag_max * 1000, 1),
+        }
+
+
+class UpdateCheckpoint:
+    """
+    Учёт апдейтов long polling: что взято, что обработано, что повторить после рестарта.
+
+    Апдейты берутся в работу по возрастанию update_id (take) и сразу
+    подтверждаются Telegram: offset = последний взятый + 1, так что медленный
+    чат не задерживает приём остальных. Завершаются они в воркерах в любом
+    порядке (finish); done — наибольший update_id, до которого включительно
+    всё обработано. Взятые, но не обработанные апдейты хранятся целиком и
+    пишутся в файл вместе с done (tmp + fsync + os.replace) — до
+    подтверждения (save() перед каждым getUpdates), раз в save_every секунд
+    и при close(). После перезапуска их отдаёт replay(); то, что успели
+    обработать, повторно не обрабатывается.
+    """
+
+    def __init__(self, path: str = "updates.offset", save_every: float = 1.0):
+        self.path = path
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._pending = deque()      # взятые, по возрастанию
+        self._inflight = set()       # взятые и не завершённые — для finish() чужих id
+        self._finished = set()       # завершённые раньше более старых
+        self._raw = {}               # update_id -> апдейт (dict) для взятых и не завершённых
+        self.done, self._taken, self._replay = self._load()     # done None — чекпоинта ещё нет
+        self._version = 0            # растёт при take/finish — есть что сохранять
+        self._saved = 0
+        self._saved_at = 0.0
+        self.counters = {"taken": 0, "duplicates": 0, "replayed": 0, "saves": 0}
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.loads(f.read())
+        except FileNotFoundError:
+            return None, None, []
+        except (OSError, ValueError) as e:
+            logging.error(f"update checkpoint unreadable, starting without it: {e}")
+            return None, None, []
+        if isinstance(data, int):          # прежний формат — только done
+            return data, data, []
+        return data["done"], data["taken"], sorted(data.get("pending") or [], key=lambda u: u["update_id"])
+
+    def offset(self):
+        """offset для getUpdates — после последнего взятого; None — всё, что Telegram ещё хранит."""
+        with self._lock:
+            return None if self._taken is None else self._taken + 1
+
+    def replay(self) -> list:
+        """Апдейты, взятые до перезапуска и не обработанные; они снова в работе — их надо обработать."""
+        with self._lock:
+            items, self._replay = self._replay, []
+            for raw in items:
+                self._pending.append(raw["update_id"])
+                self._inflight.add(raw["update_id"])
+                self._raw[raw["update_id"]] = raw
+            self.counters["replayed"] += len(items)
+            return items
+
+    def take(self, update_id: int, raw: dict = None) -> bool:
+        """Взять апдейт в работу (raw — он сам, для повтора после рестарта); False — уже взят."""
+        with self._lock:
+            if self._taken is not None and update_id <= self._taken:
+                self.counters["duplicates"] += 1
+                return False
+            if self.done is None:
+                self.done = update_id - 1
+            self._taken = update_id
+            self._pending.append(update_id)
+            self._inflight.add(update_id)
+            if raw is not None:
+                self._raw[update_id] = raw
+            self._version += 1
+            self.counters["taken"] += 1
+            return True
+
+    def finish(self, update_id: int):
+        """Апдейт обработан (или пропущен). Не взятые через take() (вебхук) игнорируются."""
+        with self._lock:
+            if update_id not in self._inflight:
+                return
+            self._inflight.discard(update_id)
+            self._finished.add(update_id)
+            self._raw.pop(update_id, None)
+            while self._pending and self._pending[0] in self._finished:
+                self._finished.discard(self._pending[0])
+                self.done = self._pending.popleft()
+            if not self._pending:
+                self.done = self._taken     # после replay между повторёнными могли быть обработанные
+            self._version += 1
+            due = time.monotonic() - self._saved_at >= self.save_every
+        if due:
+            self.save()
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                if self._version == self._saved or self.done is None:
+                    return
+                version = self._version
+                state = {"done": self.done, "taken": self._taken, "pending": list(self._raw.values())}
+            tmp = self.path + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(state, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                self._saved, self._saved_at = version, time.monotonic()
+                self.counters["saves"] += 1
+            except OSError as e:
+                logging.error(f"update checkpoint save error: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "done": self.done, "last_taken": self._taken, "inflight": len(self._inflight)}
+
+    def close(self):
+        self.save()
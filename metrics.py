@@ -0,0 +1,167 @@
+"""
+Метрики в текстовом формате Prometheus (0.0.4) без внешних зависимостей.
+
+Counter и Histogram считают в памяти процесса: значения по кортежу
+меток, одна блокировка на метрику, observe() — bisect по границам
+корзин. Gauge — функция, которую зовут только при отдаче /metrics.
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            try:
+                lines.extend(m.samples())
+            except Exception as e:
+                lines.append(f"# error: {_esc(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=(), registry: Registry = REGISTRY):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, labels=(), n: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict = {}   # метки -> [счётчики корзин..., +Inf], сумма
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value: float, labels=()):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][i] += 1
+            s[1] += value
+
+    def timed(self, labels=()):
+        """Декоратор: время вызова функции (обычной или async)."""
+        def deco(fn):
+            if asyncio.iscoroutinefunction(fn):
+                @wraps(fn)
+                async def awrapper(*args, **kwargs):
+                    t0 = time.perf_counter()
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - t0, labels)
+                return awrapper
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - t0, labels)
+            return wrapper
+        return deco
+
+    def summary(self, labels=()) -> dict:
+        """count, sum и оценки p50/p99 по корзинам (верхняя граница корзины)."""
+        with self._lock:
+            s = self._series.get(labels)
+            counts, total = (list(s[0]), s[1]) if s else ([0] * (len(self.buckets) + 1), 0.0)
+        n = sum(counts)
+        out = {"count": n, "sum": total}
+        for q in (0.5, 0.99):
+            acc, rank = 0, q * n
+            bound = 0.0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                if acc >= rank:
+                    break
+            out[f"p{round(q * 100)}"] = bound if n else 0.0
+        return out
+
+    def series(self):
+        with self._lock:
+            return list(self._series)
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(s[0]), s[1]) for k, s in self._series.items()]
+        out = []
+        for k, counts, total in items:
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = 'le="%s"' % _num(bound)
+                out.append(f"{self.name}_bucket{_labels(self.labels, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labels, k)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labels, k)} {acc}")
+        return out
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn, labels=(), registry: Registry = REGISTRY):
+        """fn() -> число или {кортеж меток: число}."""
+        self.name, self.help, self.labels, self.fn = name, help, tuple(labels), fn
+        registry.register(self)
+
+    def samples(self):
+        v = self.fn()
+        if isinstance(v, dict):
+            return [f"{self.name}{_labels(self.labels, k)} {_num(x)}" for k, x in v.items()]
+        return [f"{self.name} {_num(v)}"]
@@ -0,0 +1,284 @@
+"""
+Одноразовые коды подтверждения входа (WebApp).
+
+OtpStore — общий интерфейс, которым пользуется bot.py:
+  issue(uid)       -> (код, 0) или (None, через сколько секунд можно снова);
+  check(uid, code) -> (ok, текст ошибки);
+  stats()          -> outstanding (живые коды), issued, verified, expired_unused,
+                      superseded, blocked, throttled_user, throttled_global.
+Реализации:
+  - MemoryOtpStore   — в процессе; сроки кодов лежат в куче, истёкшие снимаются
+                       по O(log n) на код при каждом обращении;
+  - PostgresOtpStore — таблицы bot_otp*, общие для нескольких процессов вебхука.
+
+Лимиты выдачи: не больше user_max кодов пользователю за user_window секунд
+и не больше global_rate кодов в секунду на всех (запас global_burst).
+"""
+import heapq
+import secrets
+import threading
+import time
+from collections import deque
+
+from outbound import TokenBucket
+
+COUNTERS = ("issued", "verified", "expired_unused", "superseded", "blocked",
+            "throttled_user", "throttled_global")
+
+MSG_NOT_ISSUED = "Код не запрошен."
+MSG_EXPIRED = "Код истёк. Запросите новый."
+MSG_BLOCKED = "Код заблокирован. Запросите новый."
+
+
+def gen_code(n: int) -> str:
+    return f"{secrets.randbelow(10 ** n):0{n}d}"
+
+
+class OtpStore:
+    def __init__(self, ttl: int = 600, length: int = 6, attempts: int = 3,
+                 user_max: int = 3, user_window: int = 600,
+                 global_rate: float = 5.0, global_burst: float = 20.0):
+        self.ttl = ttl
+        self.length = length
+        self.attempts = attempts
+        self.user_max = user_max
+        self.user_window = user_window
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+
+    def issue(self, uid: int):
+        raise NotImplementedError
+
+    def check(self, uid: int, code: str):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class MemoryOtpStore(OtpStore):
+    def __init__(self, **limits):
+        super().__init__(**limits)
+        self._codes: dict = {}      # uid -> [код, срок, попыток осталось]
+        self._expiry: list = []     # куча (срок, uid); пары от заменённых кодов пропускаются
+        self._issued: dict = {}     # uid -> deque времён выдачи в окне лимита
+        self._windows: list = []    # куча (когда окно пользователя опустеет, uid)
+        self._global = TokenBucket(self.global_rate, self.global_burst)
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def _purge(self, now: float):
+        h = self._expiry
+        while h and h[0][0] <= now:
+            exp, uid = heapq.heappop(h)
+            rec = self._codes.get(uid)
+            if rec and rec[1] == exp:
+                del self._codes[uid]
+                self.counters["expired_unused"] += 1
+        h = self._windows
+        while h and h[0][0] <= now:
+            _, uid = heapq.heappop(h)
+            q = self._issued.get(uid)
+            if q and q[-1] + self.user_window <= now:
+                del self._issued[uid]
+
+    def issue(self, uid: int):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            q = self._issued.get(uid)
+            if q:
+                while q and q[0] + self.user_window <= now:
+                    q.popleft()
+                if len(q) >= self.user_max:
+                    self.counters["throttled_user"] += 1
+                    return None, int(q[0] + self.user_window - now) + 1
+            wait = self._global.take(time.monotonic())
+            if wait > 0:
+                self.counters["throttled_global"] += 1
+                return None, int(wait) + 1
+
+            if uid in self._codes:
+                self.counters["superseded"] += 1
+            code = gen_code(self.length)
+            exp = now + self.ttl
+            self._codes[uid] = [code, exp, self.attempts]
+            heapq.heappush(self._expiry, (exp, uid))
+            self._issued.setdefault(uid, deque()).append(now)
+            heapq.heappush(self._windows, (now + self.user_window, uid))
+            self.counters["issued"] += 1
+            return code, 0
+
+    def check(self, uid: int, code: str):
+        now = time.time()
+        with self._lock:
+            rec = self._codes.get(uid)
+            if rec and now > rec[1]:
+                del self._codes[uid]
+                self.counters["expired_unused"] += 1
+                return False, MSG_EXPIRED
+            self._purge(now)
+            if not rec:
+                return False, MSG_NOT_ISSUED
+            if code != rec[0]:
+                rec[2] -= 1
+                if rec[2] <= 0:
+                    del self._codes[uid]
+                    self.counters["blocked"] += 1
+                    return False, MSG_BLOCKED
+                return False, f"Неверный код. Осталось попыток: {rec[2]}"
+            del self._codes[uid]
+            self.counters["verified"] += 1
+            return True, ""
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._purge(time.time())
+            return {"outstanding": len(self._codes), **self.counters,
+                    "rate_tracked_users": len(self._issued)}
+
+
+class PostgresOtpStore(OtpStore):
+    """
+    Коды и лимиты в той же базе, что и bot_users (соединения — из пула PostgresUserStore),
+    поэтому все процессы вебхука видят одни и те же коды, окна и общий бакет.
+    Истёкшие коды гасятся одним UPDATE по индексу на exp не чаще purge_every секунд.
+
+    Строка пользователя блокируется до любых проверок: issue() начинает с
+    INSERT … ON CONFLICT DO UPDATE (строка появляется и блокируется одним
+    запросом, даже если её ещё не было), check() — один UPDATE по строке,
+    взятой FOR UPDATE. Одновременные запросы одного пользователя идут по
+    очереди, лимит выдачи и счётчик попыток не обходятся гонкой.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bot_otp (
+            uid      BIGINT PRIMARY KEY,
+            code     TEXT,
+            exp      DOUBLE PRECISION NOT NULL DEFAULT 0,
+            attempts INT NOT NULL DEFAULT 0,
+            issued   DOUBLE PRECISION[] NOT NULL DEFAULT '{}'
+        );
+        CREATE INDEX IF NOT EXISTS bot_otp_live_exp ON bot_otp (exp) WHERE code IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS bot_otp_stats (
+            name  TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS bot_otp_bucket (
+            id     INT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            stamp  DOUBLE PRECISION NOT NULL
+        );
+    """
+
+    def __init__(self, db, purge_every: float = 30.0, **limits):
+        super().__init__(**limits)
+        self.db = db                      # PostgresUserStore
+        self.purge_every = purge_every
+        self._next_purge = 0.0
+        with db._cursor() as cur:
+            cur.execute(self.SCHEMA)
+            cur.execute("INSERT INTO bot_otp_bucket (id, tokens, stamp) VALUES (1, %s, %s) "
+                        "ON CONFLICT (id) DO NOTHING", (self.global_burst, time.time()))
+
+    def _count(self, cur, name: str, n: int = 1):
+        if n:
+            self.db._execute(cur, "otp_count",
+                             "INSERT INTO bot_otp_stats (name, value) VALUES ($1, $2) "
+                             "ON CONFLICT (name) DO UPDATE SET value = bot_otp_stats.value + EXCLUDED.value",
+                             (name, n))
+
+    def purge(self):
+        now = time.time()
+        with self.db._cursor() as cur:
+            self.db._execute(cur, "otp_expire",
+                             "WITH gone AS (UPDATE bot_otp SET code = NULL "
+                             "WHERE code IS NOT NULL AND exp <= $1 RETURNING 1) SELECT count(*) FROM gone",
+                             (now,))
+            self._count(cur, "expired_unused", cur.fetchone()[0])
+            # пустые строки, у которых и окно лимита уже прошло
+            self.db._execute(cur, "otp_gc",
+                             "DELETE FROM bot_otp WHERE code IS NULL "
+                             "AND coalesce(issued[cardinality(issued)], 0) <= $1",
+                             (now - self.user_window,))
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now >= self._next_purge:
+            self._next_purge = now + self.purge_every
+            self.purge()
+
+    def issue(self, uid: int):
+        self._maybe_purge()
+        now = time.time()
+        since = now - self.user_window
+        with self.db._cursor() as cur:
+            # SELECT … FOR UPDATE не блокирует строку, которой ещё нет, — поэтому upsert
+            self.db._execute(cur, "otp_lock",
+                             "INSERT INTO bot_otp (uid) VALUES ($1) "
+                             "ON CONFLICT (uid) DO UPDATE SET uid = EXCLUDED.uid "
+                             "RETURNING issued, code IS NOT NULL AND exp > $2",
+                             (int(uid), now))
+            issued, live = cur.fetchone()
+            recent = sorted(t for t in issued or () if t > since)
+            if len(recent) >= self.user_max:
+                self._count(cur, "throttled_user")
+                return None, int(recent[0] + self.user_window - now) + 1
+
+            self.db._execute(cur, "otp_take",
+                             "UPDATE bot_otp_bucket SET stamp = $1, "
+                             "tokens = LEAST($2, tokens + ($1 - stamp) * $3) - 1 "
+                             "WHERE id = 1 AND LEAST($2, tokens + ($1 - stamp) * $3) >= 1 RETURNING tokens",
+                             (now, float(self.global_burst), float(self.global_rate)))
+            if cur.fetchone() is None:
+                self._count(cur, "throttled_global")
+                return None, int(1 / self.global_rate) + 1
+
+            code = gen_code(self.length)
+            self.db._execute(cur, "otp_set",
+                             "UPDATE bot_otp SET code = $2, exp = $3, attempts = $4, issued = $5 WHERE uid = $1",
+                             (int(uid), code, now + self.ttl, self.attempts, recent + [now]))
+            self._count(cur, "issued")
+            if live:
+                self._count(cur, "superseded")
+            return code, 0
+
+    def check(self, uid: int, code: str):
+        now = time.time()
+        with self.db._cursor() as cur:
+            # проверка и списание попытки — один запрос по заблокированной строке:
+            # верный код гасится, неверный отнимает попытку, истёкший гасится с attempts = 0
+            self.db._execute(cur, "otp_check",
+                             "WITH cur AS (SELECT uid, code = $2 AS hit, exp < $3 AS expired, attempts "
+                             "FROM bot_otp WHERE uid = $1 AND code IS NOT NULL FOR UPDATE) "
+                             "UPDATE bot_otp b SET "
+                             "attempts = CASE WHEN cur.expired THEN 0 WHEN cur.hit THEN cur.attempts "
+                             "ELSE cur.attempts - 1 END, "
+                             "code = CASE WHEN NOT cur.expired AND NOT cur.hit AND cur.attempts > 1 "
+                             "THEN b.code END "
+                             "FROM cur WHERE b.uid = cur.uid RETURNING cur.hit, cur.expired, b.attempts",
+                             (int(uid), code, now))
+            row = cur.fetchone()
+            if row is None:
+                return False, MSG_NOT_ISSUED
+            hit, expired, attempts = row
+            if expired:
+                self._count(cur, "expired_unused")
+                return False, MSG_EXPIRED
+            if hit:
+                self._count(cur, "verified")
+                return True, ""
+            if attempts <= 0:
+                self._count(cur, "blocked")
+                return False, MSG_BLOCKED
+            return False, f"Неверный код. Осталось попыток: {attempts}"
+
+    def stats(self) -> dict:
+        self._maybe_purge()
+        with self.db._cursor() as cur:
+            self.db._execute(cur, "otp_live",
+                             "SELECT count(*) FROM bot_otp WHERE code IS NOT NULL AND exp > $1", (time.time(),))
+            st = {"outstanding": cur.fetchone()[0], **dict.fromkeys(COUNTERS, 0)}
+            cur.execute("SELECT name, value FROM bot_otp_stats")
+            st.update(cur.fetchall())
+        return st
@@ -0,0 +1,431 @@
+"""
+Исходящие запросы к Bot API.
+
+SendScheduler подключается к telebot через apihelper.CUSTOM_REQUEST_SENDER,
+поэтому через него идёт каждый вызов bot.* из любого потока:
+  - общий token bucket (лимит Telegram ~30 сообщений/с на бота);
+  - bucket на каждый чат (личка ~1/с с небольшим burst, группы ~20/мин);
+  - очередь к общему bucket'у с приоритетом: интерактивные ответы раньше
+    массовых рассылок (см. bulk());
+  - на 429 чат (а при волне 429 — весь бот) ставится на паузу retry_after,
+    запрос повторяется сам не раньше чем через retry_after, хендлер об этом
+    не узнаёт.
+
+HttpSession — сам HTTP-транспорт под планировщиком: один пул keep-alive
+соединений на все потоки, свои таймауты для обычных вызовов и long poll,
+повтор с jitter при обрыве соединения, счётчики подключений и запросов.
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+INTERACTIVE = 0
+BULK = 1
+
+# служебные методы не расходуют лимит на сообщения (но retry_after на 429 соблюдают)
+EXEMPT_METHODS = {
+    "getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo",
+    "answerCallbackQuery", "getFile", "getChat",
+}
+# методы, которые Telegram считает сообщениями в конкретный чат
+PER_CHAT_PREFIXES = ("send", "copyMessage", "forwardMessage", "edit")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def take(self, now: float) -> float:
+        """Забрать токен. 0 — забрали, иначе сколько секунд подождать."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, until: float):
+        self.paused_until = max(self.paused_until, until)
+
+
+_ctx = threading.local()
+
+
+@contextmanager
+def bulk():
+    """Запросы внутри блока идут с низким приоритетом (рассылки и т.п.)."""
+    prev = getattr(_ctx, "priority", INTERACTIVE)
+    _ctx.priority = BULK
+    try:
+        yield
+    finally:
+        _ctx.priority = prev
+
+
+def _method_of(url: str) -> str:
+    return url.rsplit("/", 1)[-1]
+
+
+def _chat_of(params) -> int:
+    if not params:
+        return None
+    try:
+        return int(params.get("chat_id"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(response) -> float:
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except Exception:
+        return 1.0
+
+
+class SendScheduler:
+    def __init__(self, request, global_rate: float = 30.0, chat_rate: float = 1.0,
+                 chat_burst: float = 3.0, group_rate_per_min: float = 20.0,
+                 max_retries: int = 3, global_burst: float = 1.0):
+        """
+        request — функция с сигнатурой requests.request, которой реально
+        уходит HTTP-запрос (telebot передаёт method, url, params, files, timeout, proxies).
+        Общий burst по умолчанию 1: лимит Telegram считается по скользящему
+        окну, и накопленный запас сверх темпа сразу даёт 429.
+        """
+        self.request = request
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_min / 60.0
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: dict = {}
+        self._chats_lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._waiters = []            # heap (priority, seq)
+        self._seq = itertools.count()
+        self._recent_429 = []         # (время, chat_id) за последнюю секунду
+
+        self._mlock = threading.Lock()
+        self.metrics = {
+            "requests": 0, "throttled": 0, "wait_seconds": 0.0,
+            "http_429": 0, "retries": 0, "gave_up": 0, "global_pauses": 0,
+            "interactive": 0, "bulk": 0,
+        }
+
+    def _inc(self, key: str, n=1):
+        with self._mlock:
+            self.metrics[key] += n
+
+    # ─────────────── лимиты ───────────────
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            with self._chats_lock:
+                b = self._chats.get(chat_id)
+                if b is None:
+                    if len(self._chats) > 50000:
+                        self._prune_chats()
+                    if chat_id < 0:
+                        b = TokenBucket(self.group_rate, 1)
+                    else:
+                        b = TokenBucket(self.chat_rate, self.chat_burst)
+                    self._chats[chat_id] = b
+        return b
+
+    def _prune_chats(self):
+        now = time.monotonic()
+        idle = [c for c, b in self._chats.items() if now - b.stamp > 60 and now > b.paused_until]
+        for c in idle:
+            del self._chats[c]
+
+    def _acquire_chat(self, chat_id: int) -> float:
+        waited = 0.0
+        b = self._chat_bucket(chat_id)
+        while True:
+            with self._chats_lock:
+                wait = b.take(time.monotonic())
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def _acquire_global(self, priority: int) -> float:
+        t0 = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    if self._waiters[0] == ticket:
+                        wait = self._global.take(time.monotonic())
+                        if wait <= 0:
+                            return time.monotonic() - t0
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait(0.5)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def _on_429(self, chat_id, retry_after: float, exempt: bool = False) -> float:
+        """Пауза чата (при волне 429 — всего бота); возвращает момент, раньше которого не повторять."""
+        until = time.monotonic() + retry_after
+        self._inc("http_429")
+        if exempt:
+            # служебный метод — лимиты сообщений тут ни при чём, ждём только retry_after
+            return until
+        if chat_id is not None:
+            with self._chats_lock:
+                self._chat_bucket(chat_id).pause(until)
+        now = time.monotonic()
+        with self._cond:
+            self._recent_429 = [(t, c) for t, c in self._recent_429 if now - t < 1.0]
+            self._recent_429.append((now, chat_id))
+            # 429 сразу в нескольких чатах (или без чата) — упёрлись в общий лимит
+            if chat_id is None or len({c for _, c in self._recent_429}) >= 3:
+                self._global.pause(until)
+                self._inc("global_pauses")
+            self._cond.notify_all()
+        return until
+
+    # ─────────────── отправка ───────────────
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        """Совместим с apihelper.CUSTOM_REQUEST_SENDER."""
+        api_method = _method_of(url)
+        exempt = api_method in EXEMPT_METHODS
+        priority = getattr(_ctx, "priority", INTERACTIVE)
+        chat_id = _chat_of(params)
+        per_chat = chat_id is not None and api_method.startswith(PER_CHAT_PREFIXES)
+        if not exempt:
+            self._inc("requests")
+            self._inc("bulk" if priority == BULK else "interactive")
+
+        attempt = 0
+        while True:
+            if not exempt:
+                waited = self._acquire_chat(chat_id) if per_chat else 0.0
+                waited += self._acquire_global(priority)
+                if waited > 0.001:
+                    self._inc("throttled")
+                    self._inc("wait_seconds", waited)
+
+            response = self.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+            if response.status_code != 429:
+                return response
+
+            until = self._on_429(chat_id, _retry_after(response), exempt)
+            if attempt >= self.max_retries:
+                self._inc("gave_up")
+                logging.error(f"{api_method}: 429 after {attempt} retries, chat={chat_id}")
+                return response
+            attempt += 1
+            self._inc("retries")
+            # бакет чата ждут только send*/edit*, поэтому retry_after выдерживаем здесь для любого метода
+            time.sleep(max(0.0, until - time.monotonic()))
+
+    # ─────────────── asyncio-режим ───────────────
+    async def acquire_async(self, chat_id, api_method: str):
+        """
+        То же ожидание лимитов для корутин (bot_async.py): event loop не блокируется,
+        бакеты и метрики общие с синхронным режимом. Приоритеты здесь не учитываются.
+        """
+        import asyncio
+
+        waited = 0.0
+        if chat_id is not None and api_method.startswith(PER_CHAT_PREFIXES):
+            b = self._chat_bucket(chat_id)
+            while True:
+                with self._chats_lock:
+                    wait = b.take(time.monotonic())
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+                waited += wait
+        while True:
+            with self._cond:
+                wait = self._global.take(time.monotonic())
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited > 0.001:
+            self._inc("throttled")
+            self._inc("wait_seconds", waited)
+
+    def wrap_async(self, process_request, api_error):
+        """
+        Обёртка над telebot.asyncio_helper._process_request: лимиты и повтор на 429.
+        api_error — класс исключения Bot API из asyncio_helper.
+        """
+        import asyncio
+
+        async def limited(token, url, method="get", params=None, files=None, **kwargs):
+            exempt = url in EXEMPT_METHODS
+            chat_id = _chat_of(params)
+            if not exempt:
+                self._inc("requests")
+                self._inc("interactive")
+            attempt = 0
+            while True:
+                if not exempt:
+                    await self.acquire_async(chat_id, url)
+                try:
+                    # _process_request меняет params — на повтор нужна копия
+                    return await process_request(token, url, method, dict(params) if params else params,
+                                                 files, **kwargs)
+                except api_error as e:
+                    if e.error_code != 429:
+                        raise
+                    retry_after = float(((e.result_json or {}).get("parameters") or {}).get("retry_after", 1))
+                    until = self._on_429(chat_id, retry_after, exempt)
+                    if attempt >= self.max_retries:
+                        self._inc("gave_up")
+                        raise
+                    attempt += 1
+                    self._inc("retries")
+                    await asyncio.sleep(max(0.0, until - time.monotonic()))
+        return limited
+
+    def stats(self) -> dict:
+        with self._mlock:
+            st = dict(self.metrics)
+        st["wait_seconds"] = round(st["wait_seconds"], 2)
+        st["waiting"] = len(self._waiters)
+        st["chats_tracked"] = len(self._chats)
+        return st
+
+
+# ─────────────── HTTP-транспорт ───────────────
+class _Timing:
+    """Счётчик + сумма + максимум, потокобезопасно."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def snapshot(self, prefix: str) -> dict:
+        with self._lock:
+            avg = self.total / self.count if self.count else 0.0
+            return {
+                f"{prefix}": self.count,
+                f"{prefix}_avg_ms": round(avg * 1000, 1),
+                f"{prefix}_max_ms": round(self.max * 1000, 1),
+            }
+
+
+def _timed_pools(connects: _Timing) -> dict:
+    """Классы пулов urllib3, чьи соединения засекают время установки (TCP+TLS)."""
+
+    class TimedHTTPConnection(HTTPConnection):
+        def connect(self):
+            t0 = time.perf_counter()
+            super().connect()
+            connects.add(time.perf_counter() - t0)
+
+    class TimedHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            t0 = time.perf_counter()
+            super().connect()
+            connects.add(time.perf_counter() - t0)
+
+    class TimedHTTPPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    return {"http": TimedHTTPPool, "https": TimedHTTPSPool}
+
+
+class HttpSession:
+    """
+    Общий requests.Session для всех потоков бота.
+
+    pool_size — сколько keep-alive соединений держать к api.telegram.org;
+    при нехватке поток ждёт свободное соединение, а не открывает новое.
+    Обычные вызовы идут с (connect_timeout, read_timeout); getUpdates
+    сохраняет таймаут, который telebot посчитал под long poll.
+    Обрыв соединения (ConnectionError) повторяется до retries раз
+    с экспоненциальной задержкой и jitter; ReadTimeout не повторяем —
+    запрос мог уже дойти до Telegram.
+    """
+
+    def __init__(self, pool_size: int = 16, connect_timeout: float = 5.0,
+                 read_timeout: float = 20.0, retries: int = 2, backoff: float = 0.2):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.connects = _Timing()
+        self.requests = _Timing()
+        self._mlock = threading.Lock()
+        self.retried = 0
+        self.failed = 0
+
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+        adapter.poolmanager.pool_classes_by_scheme = _timed_pools(self.connects)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        if _method_of(url) != "getUpdates" or timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        attempt = 0
+        while True:
+            t0 = time.perf_counter()
+            try:
+                response = self.session.request(method, url, params=params, files=files,
+                                                timeout=timeout, proxies=proxies)
+            except requests.exceptions.ConnectionError:
+                if attempt >= self.retries:
+                    with self._mlock:
+                        self.failed += 1
+                    raise
+                attempt += 1
+                with self._mlock:
+                    self.retried += 1
+                time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+                if files:
+                    for f in files.values():
+                        fh = f[1] if isinstance(f, tuple) else f
+                        if hasattr(fh, "seek"):
+                            fh.seek(0)
+                continue
+            self.requests.add(time.perf_counter() - t0)
+            return response
+
+    def stats(self) -> dict:
+        st = {**self.connects.snapshot("connects"), **self.requests.snapshot("requests")}
+        with self._mlock:
+            st["retried"] = self.retried
+            st["failed"] = self.failed
+        # доля запросов, ушедших по уже открытому соединению
+        st["reuse_ratio"] = round(1 - st["connects"] / st["requests"], 3) if st["requests"] else 0.0
+        return st
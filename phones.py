@@ -0,0 +1,191 @@
+"""
+Whitelist телефонов.
+
+PhoneIndex — отсортированный array('q') номеров E.164 в виде целых
+(+994515207545 -> 994515207545): 8 байт на номер вместо строки в set,
+проверка — bisect, O(log n).
+
+PhoneWhitelist держит текущий индекс и пересобирает его в фоне:
+по изменению файла (watch) или по команде (reload). Новый индекс
+подменяется одним присваиванием; on_change получает только добавленные
+и удалённые номера — по ним бот пересчитывает phone_ok.
+
+Строка файла — номер, после запятой может идти имя (так пишет импорт
+из CSV): «+994501234567,Имя Фамилия».
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+def normalize_phone(p: str) -> str:
+    if not p:
+        return ""
+    digits = "".join(ch for ch in str(p) if ch.isdigit())
+    return f"+{digits}" if digits else ""
+
+
+def encode(phone: str) -> int:
+    """'+994…' -> 994…; 0 — не номер."""
+    digits = normalize_phone(phone)[1:]
+    return int(digits) if digits and len(digits) <= 18 else 0
+
+
+def decode(n: int) -> str:
+    return f"+{n}"
+
+
+def _diff(old: array, new: array):
+    """Слиянием двух отсортированных массивов: (добавленные, удалённые)."""
+    added, removed = array("q"), array("q")
+    i = j = 0
+    while i < len(old) and j < len(new):
+        a, b = old[i], new[j]
+        if a == b:
+            i += 1
+            j += 1
+        elif a < b:
+            removed.append(a)
+            i += 1
+        else:
+            added.append(b)
+            j += 1
+    removed.extend(old[i:])
+    added.extend(new[j:])
+    return added, removed
+
+
+class PhoneIndex:
+    def __init__(self, numbers=()):
+        self._a = array("q", sorted({n for n in numbers if n}))
+
+    def __contains__(self, phone) -> bool:
+        n = encode(phone) if isinstance(phone, str) else phone
+        a = self._a
+        i = bisect_left(a, n)
+        return i < len(a) and a[i] == n
+
+    def __len__(self) -> int:
+        return len(self._a)
+
+    def nbytes(self) -> int:
+        return self._a.itemsize * len(self._a)
+
+    def diff(self, other: "PhoneIndex"):
+        return _diff(self._a, other._a)
+
+
+def read_phones(path: str):
+    """Номера из файла (по одному на строке, # — комментарий, после запятой — имя) как целые."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield encode(line.split(",", 1)[0])
+    except FileNotFoundError:
+        return
+
+
+class PhoneWhitelist:
+    def __init__(self, path: str = "", extra=(), on_change=None):
+        """
+        path      — файл со списком (может не существовать);
+        extra     — номера из ALLOWED_PHONES, всегда добавляются к файлу;
+        on_change — on_change(added, removed): массивы целых, вызывается после подмены.
+        """
+        self.path = path
+        self.extra = [encode(p) for p in extra]
+        self.on_change = on_change
+        self.index = self._build()
+        self.loaded_at = time.time()
+        self._stamp = self._file_stamp()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def __contains__(self, phone) -> bool:
+        return phone in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _build(self) -> PhoneIndex:
+        numbers = list(self.extra)
+        if self.path:
+            numbers.extend(read_phones(self.path))
+        return PhoneIndex(numbers)
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except (OSError, ValueError):
+            return None
+
+    def reload(self):
+        """Пересобрать индекс и подменить. Возвращает (всего, добавлено, удалено)."""
+        with self._reload_lock:
+            self._stamp = self._file_stamp()
+            new = self._build()
+            added, removed = self.index.diff(new)
+            self.index = new
+            self.loaded_at = time.time()
+        if (added or removed) and self.on_change:
+            try:
+                self.on_change(added, removed)
+            except Exception as e:
+                logging.error(f"phones on_change error: {e}")
+        return len(new), len(added), len(removed)
+
+    @contextmanager
+    def appending(self):
+        """
+        Файл для дописывания. Пока он открыт, пересборка (watch, reload) ждёт —
+        большой импорт не пересобирает индекс на каждой пачке; после — reload().
+        """
+        if not self.path:
+            raise ValueError("whitelist file is not configured")
+        with self._reload_lock:
+            try:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    tail = f.read(1)
+            except OSError:          # файла нет или он пустой
+                tail = b"\n"
+            with open(self.path, "a", encoding="utf-8") as f:
+                if tail != b"\n":
+                    f.write("\n")
+                yield f
+
+    def reload_async(self, done=None):
+        """reload() в фоновом потоке; done(результат) — по завершении."""
+        def run():
+            res = self.reload()
+            if done:
+                done(res)
+        threading.Thread(target=run, name="phones-reload", daemon=True).start()
+
+    def watch(self, interval: float = 5.0):
+        """Следить за файлом: при смене mtime/размера — reload() в этом же фоновом потоке."""
+        def loop():
+            while not self._stop.wait(interval):
+                if self._file_stamp() != self._stamp:
+                    try:
+                        total, added, removed = self.reload()
+                        logging.warning(f"phones reloaded: {total} (+{added} -{removed})")
+                    except Exception as e:
+                        logging.error(f"phones reload error: {e}")
+        if self.path and interval > 0:
+            threading.Thread(target=loop, name="phones-watch", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {"phones": len(self.index), "bytes": self.index.nbytes(),
+                "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded_at))}
@@ -0,0 +1,118 @@
+"""
+Маршрутизация апдейтов таблицами вместо цепочки фильтров telebot.
+
+telebot перебирает хендлеры в порядке регистрации и на каждом зовёт
+фильтр; здесь хендлер находится одним-двумя поисками в dict:
+  - сообщение: команда -> content_type -> шаг диалога -> хендлер по умолчанию;
+  - callback:  точное callback_data -> префикс до первого «_» -> по умолчанию.
+Шаг диалога читается (state_of) только для текста без известной команды.
+
+Один Router годится и для TeleBot, и для AsyncTeleBot: dispatch()
+возвращает то, что вернул хендлер, — для async-хендлера это корутина.
+"""
+
+
+class Router:
+    def __init__(self, state_of=None):
+        """state_of(uid) -> шаг диалога или None."""
+        self.state_of = state_of
+        self._commands: dict = {}
+        self._content: dict = {}
+        self._states: dict = {}
+        self._callbacks: dict = {}
+        self._prefixes: dict = {}
+        self._default_message = None
+        self._default_callback = None
+
+    # ─────────────── регистрация ───────────────
+    @staticmethod
+    def _add(table: dict, keys, handler):
+        for key in keys:
+            if key in table:
+                raise ValueError(f"route {key!r} already registered to {table[key].__name__}")
+            table[key] = handler
+        return handler
+
+    def command(self, *names):
+        return lambda handler: self._add(self._commands, names, handler)
+
+    def content(self, *content_types):
+        """Нетекстовые сообщения по content_type (contact, photo, …)."""
+        return lambda handler: self._add(self._content, content_types, handler)
+
+    def state(self, *states):
+        """Текстовые сообщения (не команды) на шаге диалога."""
+        return lambda handler: self._add(self._states, states, handler)
+
+    def callback(self, *data, prefix: str = None):
+        """Точные callback_data или префикс: prefix="lang" ловит lang_ru, lang_en, …"""
+        if prefix is not None:
+            return lambda handler: self._add(self._prefixes, (prefix,), handler)
+        return lambda handler: self._add(self._callbacks, data, handler)
+
+    def default_message(self, handler):
+        self._default_message = handler
+        return handler
+
+    def default_callback(self, handler):
+        self._default_callback = handler
+        return handler
+
+    def include(self, other: "Router", wrap=lambda handler: handler):
+        """
+        Взять из other маршруты, которых здесь нет (и хендлеры по умолчанию,
+        если свои не заданы); wrap(handler) — например, sync-хендлер в async.
+        """
+        for mine, theirs in ((self._commands, other._commands), (self._content, other._content),
+                             (self._states, other._states), (self._callbacks, other._callbacks),
+                             (self._prefixes, other._prefixes)):
+            for key, handler in theirs.items():
+                if key not in mine:
+                    mine[key] = wrap(handler)
+        if self._default_message is None and other._default_message is not None:
+            self._default_message = wrap(other._default_message)
+        if self._default_callback is None and other._default_callback is not None:
+            self._default_callback = wrap(other._default_callback)
+
+    # ─────────────── поиск ───────────────
+    def resolve_message(self, message):
+        if message.content_type == "text":
+            text = message.text or ""
+            if text.startswith("/"):
+                cmd = text.split(maxsplit=1)[0][1:].split("@", 1)[0]
+                handler = self._commands.get(cmd)
+                if handler is not None:
+                    return handler
+            if self._states and self.state_of is not None and message.from_user:
+                handler = self._states.get(self.state_of(message.from_user.id))
+                if handler is not None:
+                    return handler
+        else:
+            handler = self._content.get(message.content_type)
+            if handler is not None:
+                return handler
+        return self._default_message
+
+    def resolve_callback(self, call):
+        data = call.data or ""
+        handler = self._callbacks.get(data)
+        if handler is None:
+            handler = self._prefixes.get(data.partition("_")[0])
+        return handler or self._default_callback
+
+    def resolve(self, update):
+        """(хендлер, его аргумент) для апдейта; хендлер None — обрабатывать нечем."""
+        if update.message is not None:
+            return self.resolve_message(update.message), update.message
+        if update.callback_query is not None:
+            return self.resolve_callback(update.callback_query), update.callback_query
+        return None, None
+
+    def dispatch(self, update):
+        """Вызвать хендлер апдейта; None — если для него ничего нет."""
+        handler, arg = self.resolve(update)
+        return handler(arg) if handler else None
+
+    def stats(self) -> dict:
+        return {"commands": len(self._commands), "content": len(self._content), "states": len(self._states),
+                "callbacks": len(self._callbacks), "prefixes": len(self._prefixes)}
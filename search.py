@@ -0,0 +1,150 @@
+"""
+Поиск по материалам.
+
+SearchIndex строится один раз из ключевых слов и локализованных заголовков:
+  - все строки приводятся к одной латинской «фонетической» форме
+    (транслит кириллицы, азербайджанские буквы, c/k, x/ks, y/i …),
+    поэтому «стики», «stiks» и «sticks» сходятся;
+  - обратный индекс токен -> материалы даёт точные совпадения за O(1);
+  - триграммный индекс по словарю находит кандидатов для префиксов и опечаток,
+    расстояние Дамерау–Левенштейна считается только для них.
+Результаты ранжируются по сумме весов совпавших токенов.
+"""
+import re
+from collections import defaultdict
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+    # азербайджанская латиница
+    "ə": "e", "ı": "i", "ö": "o", "ü": "u", "ş": "sh", "ç": "ch", "ğ": "g",
+}
+# применяется после транслита к обеим сторонам, так что «ошибки» складываются одинаково
+_FOLD = (("ck", "k"), ("ph", "f"), ("x", "ks"), ("c", "k"), ("q", "k"), ("w", "v"), ("y", "i"))
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+W_KEYWORD = 1.0
+W_TITLE = 0.8
+W_PREFIX = 0.8
+W_FUZZY = 0.6
+W_PHRASE = 0.5
+
+
+def fold(text: str) -> str:
+    s = "".join(_TRANSLIT.get(ch, ch) for ch in (text or "").lower())
+    for a, b in _FOLD:
+        s = s.replace(a, b)
+    return s
+
+
+def tokenize(text: str) -> list:
+    return [t for t in _TOKEN_RE.findall(fold(text)) if len(t) >= 2]
+
+
+def _trigrams(tok: str) -> set:
+    t = f"${tok}$"
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+def _distance(a: str, b: str, limit: int) -> int:
+    """Дамерау–Левенштейн с ранним выходом, если расстояние > limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _allowed_typos(tok: str) -> int:
+    if len(tok) >= 7:
+        return 2
+    if len(tok) >= 4:
+        return 1
+    return 0
+
+
+class SearchIndex:
+    """
+    keywords: {key: [фразы]}, titles: {lang: {key: заголовок}}.
+    Порядок ключей в keywords задаёт порядок при равном счёте.
+    """
+
+    def __init__(self, keywords: dict, titles: dict):
+        self._order = {}
+        self._postings = defaultdict(dict)   # токен -> {key: вес}
+        self._phrases = []                   # (set токенов, key) для фраз из 2+ слов
+        self._grams = defaultdict(set)       # триграмма -> токены словаря
+
+        def add(key, text, weight):
+            self._order.setdefault(key, len(self._order))
+            toks = tokenize(text)
+            for tok in toks:
+                if self._postings[tok].get(key, 0) < weight:
+                    self._postings[tok][key] = weight
+            if len(toks) > 1:
+                self._phrases.append((frozenset(toks), key))
+
+        for key, words in keywords.items():
+            for w in words:
+                add(key, w, W_KEYWORD)
+        for per_lang in titles.values():
+            for key, title in per_lang.items():
+                add(key, title, W_TITLE)
+
+        for tok in self._postings:
+            for g in _trigrams(tok):
+                self._grams[g].add(tok)
+
+    def __len__(self):
+        return len(self._order)
+
+    def _expand(self, qtok: str) -> dict:
+        """Токены словаря, подходящие к токену запроса: {токен: множитель}."""
+        if qtok in self._postings:
+            return {qtok: 1.0}
+        matches = {}
+        candidates = set()
+        for g in _trigrams(qtok):
+            candidates |= self._grams.get(g, set())
+        limit = _allowed_typos(qtok)
+        for tok in candidates:
+            if len(qtok) >= 3 and len(tok) >= 3 and (tok.startswith(qtok) or qtok.startswith(tok)):
+                matches[tok] = W_PREFIX
+            elif limit and _distance(qtok, tok, limit) <= limit:
+                matches[tok] = W_FUZZY
+        return matches
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """Ключи материалов по убыванию релевантности."""
+        qtoks = tokenize(query)
+        if not qtoks:
+            return []
+        scores = defaultdict(float)
+        exact = set()
+        for qtok in dict.fromkeys(qtoks):
+            best = {}
+            for tok, mult in self._expand(qtok).items():
+                if mult == 1.0:
+                    exact.add(tok)
+                for key, weight in self._postings[tok].items():
+                    best[key] = max(best.get(key, 0.0), weight * mult)
+            for key, sc in best.items():
+                scores[key] += sc
+        for toks, key in self._phrases:
+            if key in scores and toks <= exact:
+                scores[key] += W_PHRASE
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], self._order[kv[0]]))
+        return [key for key, _ in ranked[:limit]]
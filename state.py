@@ -0,0 +1,335 @@
+"""
+Состояние диалога (язык, шаг сценария, имя, id служебных сообщений).
+
+ConversationStore — горячий слой: ограниченный LRU в памяти. За ним —
+постоянный общий слой, куда каждое изменение пишется сразу:
+  - SqliteStateBackend   — файл state.db (один хост, переживает рестарт);
+    если файл пишут несколько процессов, фоновый поток раз в SQLITE_POLL
+    секунд сверяет PRAGMA data_version и при чужой записи сбрасывает LRU
+    целиком — чужие изменения видны с задержкой не больше SQLITE_POLL;
+  - PostgresStateBackend — таблица bot_conv; изменения рассылаются через
+    NOTIFY, и другие процессы вебхука выкидывают запись из своего LRU.
+Без постоянного слоя (backend=None) это просто словарь в памяти.
+
+В LRU запись хранится кортежем (lang, state, name, lang_msg, name_msg),
+строки lang/state интернированы; пользователи, которых нет в базе,
+запоминаются как отсутствующие — фильтры хендлеров не ходят в базу
+на каждое сообщение.
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+from tracing import spanned
+
+FIELDS = ("lang", "state", "name", "lang_msg", "name_msg")
+KEY_LOCKS = 64            # блокировки записей по uid (полосами)
+SQLITE_POLL = 0.5         # как часто SqliteStateBackend проверяет чужие записи, с
+_EMPTY = (None,) * len(FIELDS)
+_MISSING = object()       # «в базе нет» — тоже кэшируем
+
+
+def _pack(rec: dict) -> tuple:
+    lang, state = rec.get("lang"), rec.get("state")
+    return (sys.intern(lang) if lang else lang, sys.intern(state) if state else state,
+            rec.get("name"), rec.get("lang_msg"), rec.get("name_msg"))
+
+
+def _unpack(row: tuple) -> dict:
+    return {k: v for k, v in zip(FIELDS, row) if v is not None}
+
+
+class ConversationStore:
+    def __init__(self, backend=None, hot_size: int = 10000):
+        self.backend = backend
+        self.hot_size = hot_size
+        self._hot: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # чтение-изменение-запись одного uid — под его блокировкой, иначе апдейты
+        # пользователя из разных шардов затирают шаг/поля друг друга
+        self._key_locks = [threading.Lock() for _ in range(KEY_LOCKS)]
+        self._epoch = 0           # растёт при сбросе записей — загрузка, начатая до него, устарела
+        self.counters = {"hits": 0, "misses": 0, "evicted": 0, "invalidated": 0, "resets": 0}
+        if backend is not None:
+            backend.on_invalidate = self.invalidate
+            if hasattr(backend, "on_reset"):
+                backend.on_reset = self.reset
+
+    def _row(self, uid: int):
+        with self._lock:
+            row = self._hot.get(uid)
+            if row is not None:
+                self._hot.move_to_end(uid)
+                self.counters["hits"] += 1
+                return None if row is _MISSING else row
+            epoch = self._epoch
+        if self.backend is None:
+            return None
+        row = self.backend.load(uid)
+        with self._lock:
+            self.counters["misses"] += 1
+            cached = self._hot.get(uid)
+            if cached is not None:
+                # пока читали базу, запись успел положить set()/update() — она новее
+                return None if cached is _MISSING else cached
+            if epoch == self._epoch:
+                self._put(uid, _MISSING if row is None else row)
+        return row
+
+    def _put(self, uid: int, row):
+        self._hot[uid] = row
+        self._hot.move_to_end(uid)
+        if self.backend is not None and len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+            self.counters["evicted"] += 1
+
+    # ─────────────── чтение ───────────────
+    def get(self, uid: int, default=None):
+        row = self._row(uid)
+        return _unpack(row) if row is not None else default
+
+    def state(self, uid: int):
+        """Шаг сценария — для фильтров хендлеров."""
+        row = self._row(uid)
+        return row[1] if row is not None else None
+
+    def lang(self, uid: int, default: str = "ru") -> str:
+        row = self._row(uid)
+        return (row[0] if row is not None else None) or default
+
+    def __contains__(self, uid) -> bool:
+        return self._row(uid) is not None
+
+    # ─────────────── запись ───────────────
+    def _key_lock(self, uid: int) -> threading.Lock:
+        return self._key_locks[hash(uid) % KEY_LOCKS]
+
+    def set(self, uid: int, **fields) -> dict:
+        """Заменить запись целиком."""
+        row = _pack(fields)
+        with self._key_lock(uid):
+            self._write(uid, row)
+        return _unpack(row)
+
+    def update(self, uid: int, **fields) -> dict:
+        """Дописать поля к записи (создаст её, если нет)."""
+        with self._key_lock(uid):
+            rec = _unpack(self._row(uid) or _EMPTY)
+            rec.update(fields)
+            row = _pack(rec)
+            self._write(uid, row)
+        return _unpack(row)
+
+    def _write(self, uid: int, row: tuple):
+        if self.backend is not None:
+            self.backend.save(uid, row)
+        with self._lock:
+            self._put(uid, row)
+
+    def invalidate(self, uid: int):
+        """Запись поменял другой процесс — перечитаем из базы при следующем обращении."""
+        with self._lock:
+            self._epoch += 1
+            if self._hot.pop(uid, None) is not None:
+                self.counters["invalidated"] += 1
+
+    def reset(self):
+        """Базу менял другой процесс, но неизвестно что — сбрасываем весь LRU."""
+        with self._lock:
+            self._epoch += 1
+            self._hot.clear()
+            self.counters["resets"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hot": len(self._hot), "hot_size": self.hot_size, **self.counters}
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+
+class SqliteStateBackend:
+    """
+    Таблица conv_state в файле. PRAGMA data_version меняется, когда файл
+    закоммитило другое соединение (свои записи её не трогают) — по ней поток
+    sqlite-watch замечает другие процессы и зовёт on_reset.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conv_state (
+            uid      INTEGER PRIMARY KEY,
+            lang     TEXT,
+            state    TEXT,
+            name     TEXT,
+            lang_msg INTEGER,
+            name_msg INTEGER
+        )
+    """
+
+    def __init__(self, path: str, poll: float = SQLITE_POLL):
+        self.on_invalidate = None
+        self.on_reset = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._version = self._data_version()
+        self._stop = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, args=(poll,), name="sqlite-watch", daemon=True)
+        self._watcher.start()
+
+    def _data_version(self) -> int:
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _watch(self, poll: float):
+        while not self._stop.wait(poll):
+            try:
+                version = self._data_version()
+            except sqlite3.Error as e:
+                if not self._stop.is_set():
+                    logging.error(f"sqlite watch error: {e}")
+                continue
+            if version != self._version:
+                self._version = version
+                if self.on_reset:
+                    self.on_reset()
+
+    def load(self, uid: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lang, state, name, lang_msg, name_msg FROM conv_state WHERE uid = ?", (uid,)
+            ).fetchone()
+        return _pack(dict(zip(FIELDS, row))) if row else None
+
+    @spanned("state.save")
+    def save(self, uid: int, row: tuple):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO conv_state VALUES (?, ?, ?, ?, ?, ?)", (uid, *row))
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._conn.close()
+
+
+class PostgresStateBackend:
+    """
+    Таблица bot_conv, соединения — из пула PostgresUserStore.
+    Каждая запись шлёт NOTIFY bot_conv '<uid>:<pid>'; фоновый поток слушает канал
+    и сообщает ConversationStore об изменениях из других процессов.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bot_conv (
+            uid      BIGINT PRIMARY KEY,
+            lang     TEXT,
+            state    TEXT,
+            name     TEXT,
+            lang_msg BIGINT,
+            name_msg BIGINT
+        )
+    """
+
+    def __init__(self, db, dsn: str):
+        self.db = db                      # PostgresUserStore
+        self.on_invalidate = None
+        self._me = str(os.getpid())
+        self._stop = threading.Event()
+        with db._cursor() as cur:
+            cur.execute(self.SCHEMA)
+        self._listener = threading.Thread(target=self._listen, args=(dsn,), name="conv-listen", daemon=True)
+        self._listener.start()
+
+    def load(self, uid: int):
+        with self.db._cursor() as cur:
+            self.db._execute(cur, "conv_get",
+                             "SELECT lang, state, name, lang_msg, name_msg FROM bot_conv WHERE uid = $1", (uid,))
+            row = cur.fetchone()
+        return _pack(dict(zip(FIELDS, row))) if row else None
+
+    @spanned("state.save")
+    def save(self, uid: int, row: tuple):
+        with self.db._cursor() as cur:
+            self.db._execute(cur, "conv_put",
+                             "INSERT INTO bot_conv (uid, lang, state, name, lang_msg, name_msg) "
+                             "VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (uid) DO UPDATE SET "
+                             "lang = EXCLUDED.lang, state = EXCLUDED.state, name = EXCLUDED.name, "
+                             "lang_msg = EXCLUDED.lang_msg, name_msg = EXCLUDED.name_msg",
+                             (uid, *row))
+            cur.execute("SELECT pg_notify('bot_conv', %s)", (f"{uid}:{self._me}",))
+
+    def _listen(self, dsn: str):
+        import select
+        import psycopg2
+
+        while not self._stop.is_set():
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.autocommit = True
+                conn.cursor().execute("LISTEN bot_conv")
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            uid, _, pid = conn.notifies.pop(0).payload.partition(":")
+                            if pid != self._me and self.on_invalidate:
+                                self.on_invalidate(int(uid))
+                conn.close()
+            except Exception as e:
+                logging.error(f"conv listen error: {e}")
+                self._stop.wait(3)
+
+    def close(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    # python state.py bench [N] — память горячего слоя на N пользователей
+    import time
+    import tracemalloc
+
+    n = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[1] == "bench" else 100_000
+    rec = lambda i: dict(lang=("ru", "en", "tr")[i % 3], state=("main", "materials", "search")[i % 3],
+                         name=f"user{i}", lang_msg=i * 2, name_msg=i * 2 + 1)
+
+    tracemalloc.start()
+    plain = {i: rec(i) for i in range(n)}
+    size_dict = tracemalloc.get_traced_memory()[0]
+    del plain
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    store = ConversationStore(hot_size=n)
+    for i in range(n):
+        store.set(i, **rec(i))
+    size_lru = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    print(f"{n} users: dict of dicts {size_dict / 2**20:.1f} MiB, "
+          f"ConversationStore {size_lru / 2**20:.1f} MiB")
+
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "state.db")
+    tracemalloc.start()
+    store = ConversationStore(SqliteStateBackend(path), hot_size=10_000)
+    for i in range(n):
+        store.set(i, **rec(i))
+    size_hot = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"sqlite + LRU 10000: {size_hot / 2**20:.1f} MiB in memory")
+    t0 = time.perf_counter()
+    for i in range(n):
+        store.set(i, **rec(i))
+    t1 = time.perf_counter()
+    for i in range(n):
+        store.state(i)
+    t2 = time.perf_counter()
+    for _ in range(n):
+        store.state(n - 1)
+    t3 = time.perf_counter()
+    print(f"sqlite: write {(t1 - t0) / n * 1e6:.1f} us, cold read {(t2 - t1) / n * 1e6:.1f} us, "
+          f"hot read {(t3 - t2) / n * 1e6:.2f} us; {store.stats()}")
@@ -0,0 +1,903 @@
+"""
+Хранилище пользователей.
+
+UserStore — общий интерфейс, которым пользуется bot.py. Реализации:
+  - JsonUserStore — users.json (по умолчанию);
+  - PostgresUserStore — таблица bot_users, пул соединений, prepared statements.
+
+JsonUserStore на диск пишет в фоне: изменения дописываются в журнал
+(users.json.journal) пачками с одним fsync, периодически журнал
+сворачивается в компактный снапшот users.json.snap (tmp + os.replace).
+Хендлеры только помечают записи «грязными» и никогда не ждут диск.
+
+Снапшот открывается через mmap и при старте не разбирается: в памяти —
+только прочитанные и изменённые записи. Старый users.json читается,
+лишь пока снапшота нет, и после первого сворачивания больше не пишется.
+"""
+import csv
+import io
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+
+from tracing import spanned
+
+# active=False — Telegram ответил 403 (бот заблокирован), рассылки такого пропускают
+DEFAULT_RECORD = {"name": "", "verified": False, "phone": "", "phone_ok": False, "active": True}
+FIELDS = tuple(DEFAULT_RECORD)
+# булевы поля, для которых count(field) ведётся инкрементально, без прохода по записям
+COUNTED = ("verified", "phone_ok", "active")
+
+
+def normalize_record(v) -> dict:
+    """
+    Миграция старого формата (строка с именем) и добивка недостающих полей.
+    """
+    if isinstance(v, str):
+        return dict(DEFAULT_RECORD, name=v)
+    if not isinstance(v, dict):
+        return dict(DEFAULT_RECORD)
+    for k, d in DEFAULT_RECORD.items():
+        if k not in v:
+            v[k] = d
+    return v
+
+
+def read_legacy_file(path: str):
+    """
+    users.json целиком. Возвращает (данные, uid'ы, которые пришлось
+    мигрировать из старого формата).
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+    except FileNotFoundError:
+        loaded = {}
+    if not isinstance(loaded, dict):
+        loaded = {}
+
+    migrated = set()
+    for k, v in loaded.items():
+        if not isinstance(v, dict) or any(f not in v for f in DEFAULT_RECORD):
+            migrated.add(k)
+        loaded[k] = normalize_record(v)
+    return loaded, migrated
+
+
+def iter_journal(path: str):
+    """Пары (uid: str, запись) из журнала по порядку."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    yield str(entry["u"]), normalize_record(entry["r"])
+                except (ValueError, KeyError, TypeError):
+                    # недописанный хвост после падения — пропускаем
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def read_users_file(path: str):
+    """
+    Все пользователи хранилища JsonUserStore в памяти: снапшот (или старый
+    users.json) + журнал. Возвращает (данные, мигрированные uid'ы).
+    """
+    if os.path.exists(path + ".snap"):
+        snap = Snapshot(path + ".snap")
+        loaded, migrated = {key: snap.record(i, key) for key, i in snap.entries()}, set()
+    else:
+        loaded, migrated = read_legacy_file(path)
+    replayed = 0
+    for key, rec in iter_journal(path + ".journal"):
+        loaded[key] = rec
+        replayed += 1
+    if replayed:
+        logging.info(f"users: replayed {replayed} journal entries")
+    return loaded, migrated
+
+
+# ─────────────── компактный снапшот ───────────────
+# users.json.snap:
+#   MAGIC | записи: JSON-массивы значений полей подряд
+#         | uid: int64 × n по возрастанию | смещения записей: uint64 × (n+1)
+#         | футер JSON (n, поля, счётчики, нечисловые uid) | длина футера: uint64 | MAGIC
+# Файл отображается через mmap: при открытии читается только футер, массивы
+# uid и смещений используются прямо из отображения, запись декодируется
+# при первом обращении к ней (и тогда же добивается недостающими полями).
+SNAP_MAGIC = b"USNAP01\n"
+
+
+class Snapshot:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if len(mm) < 32 or mm[:8] != SNAP_MAGIC or mm[-8:] != SNAP_MAGIC:
+            raise ValueError(f"{path}: не снапшот пользователей")
+        flen = int.from_bytes(mm[-16:-8], "little")
+        footer = json.loads(mm[-16 - flen:-16])
+        self.n = footer["n"]
+        self.fields = tuple(footer["fields"])
+        self.extra = footer.get("extra", {})
+        # счётчики полей, которых в снапшоте ещё не было, — по значению по умолчанию
+        self.counts = {f: footer["counts"].get(f, 0) if f in self.fields
+                       else (self.n + len(self.extra) if DEFAULT_RECORD[f] else 0) for f in COUNTED}
+        mv = memoryview(mm)
+        start = footer["index"]
+        self._uids = mv[start:start + 8 * self.n].cast("q")
+        self._offs = mv[start + 8 * self.n:start + 16 * self.n + 8].cast("Q")
+
+    def __len__(self) -> int:
+        return self.n + len(self.extra)
+
+    def _find(self, key: str) -> int:
+        try:
+            uid = int(key)
+        except ValueError:
+            return -1
+        i = bisect_left(self._uids, uid)
+        return i if i < self.n and self._uids[i] == uid else -1
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.extra or self._find(key) >= 0
+
+    def record(self, i: int, key: str = None) -> dict:
+        if i < 0:
+            return normalize_record(dict(self.extra[key]))
+        raw = json.loads(self._mm[self._offs[i]:self._offs[i + 1]])
+        return normalize_record(dict(zip(self.fields, raw)))
+
+    def get(self, key: str):
+        if key in self.extra:
+            return self.record(-1, key)
+        i = self._find(key)
+        return self.record(i) if i >= 0 else None
+
+    def entries(self):
+        """(uid: str, номер записи) — без декодирования; у нечисловых uid номер -1."""
+        for i in range(self.n):
+            yield str(self._uids[i]), i
+        for key in list(self.extra):
+            yield key, -1
+
+
+def write_snapshot(path: str, items) -> int:
+    """
+    Записать снапшот из пар (uid: str, запись); числовые uid — по возрастанию.
+    Память — массивы uid и смещений (16 байт на пользователя).
+    """
+    uids, offs = array("q"), array("Q")
+    counts = dict.fromkeys(COUNTED, 0)
+    extra = {}
+    with open(path, "wb") as f:
+        f.write(SNAP_MAGIC)
+        pos, buf = len(SNAP_MAGIC), []
+        for key, rec in items:
+            for c in COUNTED:
+                if rec.get(c):
+                    counts[c] += 1
+            try:
+                uid = int(key)
+            except ValueError:
+                extra[key] = rec
+                continue
+            if uids and uid <= uids[-1]:
+                raise ValueError(f"snapshot: uid {uid} не по возрастанию")
+            line = json.dumps([rec.get(k, DEFAULT_RECORD[k]) for k in FIELDS],
+                              ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            uids.append(uid)
+            offs.append(pos)
+            pos += len(line)
+            buf.append(line)
+            if len(buf) >= 4096:
+                f.write(b"".join(buf))
+                buf.clear()
+        f.write(b"".join(buf))
+        offs.append(pos)
+        pad = -pos % 8
+        f.write(b"\0" * pad)
+        f.write(uids.tobytes())
+        f.write(offs.tobytes())
+        footer = json.dumps({"n": len(uids), "fields": FIELDS, "counts": counts, "extra": extra,
+                             "index": pos + pad}, ensure_ascii=False).encode("utf-8")
+        f.write(footer)
+        f.write(len(footer).to_bytes(8, "little"))
+        f.write(SNAP_MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(uids) + len(extra)
+
+
+def _merge(snap, overlay: dict):
+    """Снапшот + изменённые записи по возрастанию uid; при совпадении побеждает overlay."""
+    numeric, other = [], []
+    for key in overlay:
+        try:
+            numeric.append((int(key), key))
+        except ValueError:
+            other.append(key)
+    numeric.sort()
+    j = 0
+    if snap is not None:
+        for key, i in snap.entries():
+            if i < 0:
+                if key not in overlay:
+                    yield key, snap.record(i, key)
+                continue
+            uid = snap._uids[i]
+            while j < len(numeric) and numeric[j][0] < uid:
+                yield numeric[j][1], overlay[numeric[j][1]]
+                j += 1
+            if j < len(numeric) and numeric[j][0] == uid:
+                yield numeric[j][1], overlay[numeric[j][1]]
+                j += 1
+            else:
+                yield key, snap.record(i)
+    for _, key in numeric[j:]:
+        yield key, overlay[key]
+    for key in other:
+        yield key, overlay[key]
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class UserStore:
+    """
+    Интерфейс хранилища. uid — int или str, запись — dict с полями DEFAULT_RECORD.
+    """
+
+    on_change = None   # on_change(uid: str, fields) — после каждого update() в этом процессе
+
+    def get(self, uid, default=None):
+        raise NotImplementedError
+
+    def ensure(self, uid) -> dict:
+        """Вернуть запись, создав пустую, если её нет."""
+        raise NotImplementedError
+
+    def update(self, uid, **fields) -> dict:
+        """Записать поля (создав запись при необходимости), вернуть запись."""
+        raise NotImplementedError
+
+    def update_many(self, items) -> int:
+        """Пачка update(): пары (uid, {поле: значение}). Возвращает число записей."""
+        n = 0
+        for uid, fields in items:
+            self.update(uid, **fields)
+            n += 1
+        return n
+
+    def count(self, field: str = None) -> int:
+        """Всего записей или записей с истинным полем field."""
+        raise NotImplementedError
+
+    def counts(self) -> dict:
+        """{"total": …, <поле из COUNTED>: …}."""
+        return {"total": self.count(), **{f: self.count(f) for f in COUNTED}}
+
+    def iter_records(self):
+        """Потоково: пары (uid: str, запись)."""
+        raise NotImplementedError
+
+    def iter_uids(self, field: str = None, after: int = None):
+        """
+        uid (int) активных пользователей по возрастанию: с истинным field (если задан), больше after.
+        Здесь — через сортированный список всех подходящих uid (O(n) памяти);
+        JSON и Postgres отдают их потоком.
+        """
+        uids = sorted(int(uid) for uid, rec in self.iter_records()
+                      if rec.get("active", True) and (field is None or rec.get(field)))
+        return iter(uids[bisect_right(uids, after) if after is not None else 0:])
+
+    def find_by_phones(self, phones):
+        """Пары (uid: str, запись) пользователей с номером из phones."""
+        phones = set(phones)
+        for uid, rec in self.iter_records():
+            if rec.get("phone") in phones:
+                yield uid, rec
+
+    def close(self):
+        pass
+
+    def __getitem__(self, uid):
+        rec = self.get(uid)
+        if rec is None:
+            raise KeyError(uid)
+        return rec
+
+    def __contains__(self, uid):
+        return self.get(uid) is not None
+
+    def __len__(self):
+        return self.count()
+
+
+class JsonUserStore(UserStore):
+    """
+    Компактный снапшот (users.json.snap, через mmap) + журнал + изменённые
+    записи в памяти. Ключи — строковые uid, как и в users.json.
+
+    Записи, которые отдают get()/ensure(), менять напрямую нельзя —
+    только через update(), иначе изменение не попадёт на диск.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0,
+                 compact_interval: float = 300.0, compact_bytes: int = 4 * 1024 * 1024):
+        self.path = path
+        self.snap_path = path + ".snap"
+        self.journal_path = path + ".journal"
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self.compact_bytes = compact_bytes
+
+        self._snap = None                  # Snapshot или None
+        self._data: dict = {}              # прочитанные и изменённые записи поверх снапшота
+        self._added = 0                    # записей в _data, которых нет в снапшоте
+        self._counts = dict.fromkeys(COUNTED, 0)   # поле -> число записей с истинным полем
+        self._dirty: set = set()
+        self._lock = threading.Lock()      # данные и dirty-set
+        self._io_lock = threading.Lock()   # журнал и снапшот
+        self._journal = None
+        self._journal_size = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+        self._load()
+        self._thread = threading.Thread(target=self._writer_loop, name="users-writer", daemon=True)
+        self._thread.start()
+
+    # ─────────────── чтение ───────────────
+    def _get(self, key: str):
+        rec = self._data.get(key)
+        if rec is None and self._snap is not None:
+            rec = self._snap.get(key)
+            if rec is not None:
+                with self._lock:
+                    rec = self._data.setdefault(key, rec)
+        return rec
+
+    def get(self, uid, default=None):
+        rec = self._get(str(uid))
+        return rec if rec is not None else default
+
+    def __getitem__(self, uid):
+        rec = self._get(str(uid))
+        if rec is None:
+            raise KeyError(uid)
+        return rec
+
+    def __contains__(self, uid):
+        key = str(uid)
+        return key in self._data or (self._snap is not None and key in self._snap)
+
+    def __len__(self):
+        return self.count()
+
+    def count(self, field: str = None) -> int:
+        if field is None:
+            return (len(self._snap) if self._snap is not None else 0) + self._added
+        if field in self._counts:
+            return self._counts[field]
+        return sum(1 for _, v in self.iter_records() if v.get(field))
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {"total": self.count(), **self._counts}
+
+    def _count_delta(self, old, new: dict):
+        """Под self._lock: поправить счётчики на разницу между старой и новой версией записи."""
+        for f in COUNTED:
+            was = bool(old.get(f)) if old is not None else False
+            now = bool(new.get(f))
+            if was != now:
+                self._counts[f] += 1 if now else -1
+
+    def iter_records(self):
+        """Снапшот декодируется по ходу и в памяти не остаётся."""
+        snap, data = self._snap, self._data
+        if snap is not None:
+            for key, i in snap.entries():
+                rec = data.get(key)
+                yield key, rec if rec is not None else snap.record(i, key)
+        for key in list(data):
+            if snap is None or key not in snap:
+                rec = data.get(key)
+                if rec is not None:
+                    yield key, rec
+
+    def iter_uids(self, field: str = None, after: int = None):
+        """Потоком: снапшот уже по возрастанию uid, изменённые записи вливаются по ходу (_merge)."""
+        with self._lock:
+            snap, overlay = self._snap, dict(self._data)
+        for key, rec in _merge(snap, overlay):
+            try:
+                uid = int(key)
+            except ValueError:
+                continue
+            if after is not None and uid <= after:
+                continue
+            if rec is not None and rec.get("active", True) and (field is None or rec.get(field)):
+                yield uid
+
+    # ─────────────── запись ───────────────
+    def _load_locked(self, key: str):
+        """Под self._lock: запись из памяти или снапшота, (запись, она новая?)."""
+        rec = self._data.get(key)
+        if rec is None and self._snap is not None:
+            rec = self._snap.get(key)
+        if rec is None:
+            self._added += 1
+            return dict(DEFAULT_RECORD), True
+        return rec, False
+
+    @spanned("users.ensure")
+    def ensure(self, uid) -> dict:
+        key = str(uid)
+        rec = self._get(key)
+        if rec is not None:
+            return rec
+        with self._lock:
+            rec, new = self._load_locked(key)
+            self._data[key] = rec
+            if new:
+                self._count_delta(None, rec)
+                self._dirty.add(key)
+        return rec
+
+    @spanned("users.update")
+    def update(self, uid, **fields) -> dict:
+        key = str(uid)
+        with self._lock:
+            rec, new = self._load_locked(key)
+            old = None if new else {f: rec.get(f) for f in COUNTED}
+            self._data[key] = rec
+            rec.update(fields)
+            self._count_delta(old, rec)
+            self._dirty.add(key)
+        if self.on_change:
+            self.on_change(key, fields)
+        return rec
+
+    @spanned("users.update_many")
+    def update_many(self, items) -> int:
+        """Вся пачка — под одной блокировкой; on_change — после неё."""
+        done = []
+        with self._lock:
+            for uid, fields in items:
+                key = str(uid)
+                rec, new = self._load_locked(key)
+                old = None if new else {f: rec.get(f) for f in COUNTED}
+                self._data[key] = rec
+                rec.update(fields)
+                self._count_delta(old, rec)
+                self._dirty.add(key)
+                done.append((key, fields))
+        if self.on_change:
+            for key, fields in done:
+                self.on_change(key, fields)
+        return len(done)
+
+    # ─────────────── загрузка ───────────────
+    def _load(self):
+        if os.path.exists(self.snap_path):
+            # читается только футер; записи — при обращении
+            self._snap = Snapshot(self.snap_path)
+            self._counts.update(self._snap.counts)
+        elif os.path.exists(self.path):
+            # старый users.json: разбираем один раз, в снапшот он уйдёт
+            # первым же сворачиванием в фоне, сам файл больше не пишется
+            self._data, _ = read_legacy_file(self.path)
+            self._added = len(self._data)
+            for rec in self._data.values():
+                self._count_delta(None, rec)
+
+        replayed = 0
+        for key, rec in iter_journal(self.journal_path):
+            old, new = self._load_locked(key)
+            self._count_delta(None if new else old, rec)
+            self._data[key] = rec
+            replayed += 1
+        if replayed:
+            logging.info(f"users: replayed {replayed} journal entries")
+        try:
+            self._journal_size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+    # ─────────────── фоновая запись ───────────────
+    def _writer_loop(self):
+        last_compact = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                if self._snap is None and self._data:
+                    self.compact()
+                    logging.warning(f"users: {self.path} converted to {self.snap_path}")
+            except Exception as e:
+                logging.error(f"users snapshot error: {e}")
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self._journal_size and (
+                    self._journal_size >= self.compact_bytes
+                    or time.monotonic() - last_compact >= self.compact_interval
+                ):
+                    self.compact()
+                    last_compact = time.monotonic()
+            except Exception as e:
+                logging.error(f"users writer error: {e}")
+
+    def _flush_locked(self) -> int:
+        with self._lock:
+            if not self._dirty:
+                return 0
+            keys = list(self._dirty)
+            self._dirty.clear()
+            batch = [(k, dict(self._data[k])) for k in keys if k in self._data]
+        try:
+            chunk = "".join(
+                json.dumps({"u": k, "r": rec}, ensure_ascii=False) + "\n" for k, rec in batch
+            )
+            if self._journal is None:
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._journal.write(chunk)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except Exception:
+            with self._lock:
+                self._dirty.update(keys)
+            raise
+        self._journal_size += len(chunk.encode("utf-8"))
+        return len(batch)
+
+    def flush(self) -> int:
+        """Дописать накопленные изменения в журнал (один fsync на пачку)."""
+        with self._io_lock:
+            return self._flush_locked()
+
+    def compact(self):
+        """Свернуть журнал в новый снапшот: tmp-файл, fsync, атомарный os.replace."""
+        with self._io_lock:
+            self._flush_locked()
+            with self._lock:
+                snap = self._snap
+                overlay = {k: dict(v) for k, v in self._data.items()}
+            tmp = self.snap_path + ".tmp"
+            write_snapshot(tmp, _merge(snap, overlay))
+            os.replace(tmp, self.snap_path)
+            _fsync_dir(self.snap_path)
+            new = Snapshot(self.snap_path)
+
+            with self._lock:
+                self._snap = new
+                # не менявшиеся с записи снапшота записи есть в нём — из памяти отпускаем
+                for k in [k for k in self._data if k not in self._dirty]:
+                    del self._data[k]
+                self._added = sum(1 for k in self._data if k not in new)
+
+            # всё из журнала уже в снапшоте
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            open(self.journal_path, "w").close()
+            self._journal_size = 0
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        try:
+            self.flush()
+            if self._journal_size or (self._snap is None and self._data):
+                self.compact()
+        except Exception as e:
+            logging.error(f"users close error: {e}")
+
+
+class PostgresUserStore(UserStore):
+    """
+    Таблица bot_users. Соединения берутся из ThreadedConnectionPool,
+    запросы готовятся через PREPARE один раз на соединение, запись — upsert.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bot_users (
+            uid      BIGINT  PRIMARY KEY,
+            name     TEXT    NOT NULL DEFAULT '',
+            verified BOOLEAN NOT NULL DEFAULT FALSE,
+            phone    TEXT    NOT NULL DEFAULT '',
+            phone_ok BOOLEAN NOT NULL DEFAULT FALSE,
+            active   BOOLEAN NOT NULL DEFAULT TRUE
+        );
+        ALTER TABLE bot_users ADD COLUMN IF NOT EXISTS active BOOLEAN NOT NULL DEFAULT TRUE;
+        CREATE INDEX IF NOT EXISTS bot_users_phone ON bot_users (phone) WHERE phone <> '';
+    """
+    # счётчики для /stats: одна строка, которую ведёт триггер, — count(*) по таблице не нужен.
+    # CREATE TRIGGER блокирует запись в bot_users до конца транзакции, так что
+    # начальный подсчёт не разойдётся с триггером.
+    COUNTS_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bot_user_counts (
+            id       SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            total    BIGINT NOT NULL,
+            verified BIGINT NOT NULL,
+            phone_ok BIGINT NOT NULL,
+            active   BIGINT NOT NULL
+        );
+        CREATE OR REPLACE FUNCTION bot_user_counts_trg() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE bot_user_counts SET total = total + 1,
+                    verified = verified + NEW.verified::int, phone_ok = phone_ok + NEW.phone_ok::int,
+                    active = active + NEW.active::int;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE bot_user_counts SET total = total - 1,
+                    verified = verified - OLD.verified::int, phone_ok = phone_ok - OLD.phone_ok::int,
+                    active = active - OLD.active::int;
+            ELSIF (NEW.verified, NEW.phone_ok, NEW.active) IS DISTINCT FROM (OLD.verified, OLD.phone_ok, OLD.active) THEN
+                UPDATE bot_user_counts SET
+                    verified = verified + NEW.verified::int - OLD.verified::int,
+                    phone_ok = phone_ok + NEW.phone_ok::int - OLD.phone_ok::int,
+                    active = active + NEW.active::int - OLD.active::int;
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS bot_users_counts ON bot_users;
+        CREATE TRIGGER bot_users_counts AFTER INSERT OR UPDATE OR DELETE ON bot_users
+            FOR EACH ROW EXECUTE FUNCTION bot_user_counts_trg();
+        INSERT INTO bot_user_counts (id, total, verified, phone_ok, active)
+            SELECT 1, count(*), count(*) FILTER (WHERE verified), count(*) FILTER (WHERE phone_ok),
+                   count(*) FILTER (WHERE active) FROM bot_users
+            ON CONFLICT (id) DO NOTHING;
+    """
+    _COLS = ", ".join(FIELDS)
+
+    def __init__(self, dsn: str, minconn: int = 1, maxconn: int = 10):
+        import psycopg2
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self._errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+        self._pool = ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._prepared: dict = {}  # соединение -> имена подготовленных запросов
+        with self._cursor() as cur:
+            cur.execute(self.SCHEMA)
+            cur.execute(self.COUNTS_SCHEMA)
+
+    @contextmanager
+    def _cursor(self):
+        conn = self._pool.getconn()
+        broken = False
+        try:
+            with conn, conn.cursor() as cur:
+                yield cur
+        except self._errors:
+            broken = True
+            raise
+        finally:
+            if broken:
+                self._prepared.pop(conn, None)
+            self._pool.putconn(conn, close=broken)
+
+    def _execute(self, cur, name: str, sql: str, args: tuple):
+        names = self._prepared.setdefault(cur.connection, set())
+        if name not in names:
+            cur.execute(f"PREPARE {name} AS {sql}")
+            names.add(name)
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})", args)
+
+    def _row(self, row) -> dict:
+        return dict(zip(FIELDS, row)) if row else None
+
+    def get(self, uid, default=None):
+        with self._cursor() as cur:
+            self._execute(cur, "users_get",
+                          f"SELECT {self._COLS} FROM bot_users WHERE uid = $1", (int(uid),))
+            rec = self._row(cur.fetchone())
+        return rec if rec is not None else default
+
+    @spanned("users.ensure")
+    def ensure(self, uid) -> dict:
+        rec = self.get(uid)
+        if rec is not None:
+            return rec
+        with self._cursor() as cur:
+            # DO UPDATE, чтобы RETURNING вернул строку и при гонке двух вставок
+            self._execute(cur, "users_ensure",
+                          f"INSERT INTO bot_users (uid) VALUES ($1) "
+                          f"ON CONFLICT (uid) DO UPDATE SET uid = EXCLUDED.uid "
+                          f"RETURNING {self._COLS}", (int(uid),))
+            return self._row(cur.fetchone())
+
+    @spanned("users.update")
+    def update(self, uid, **fields) -> dict:
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"unknown user fields: {sorted(unknown)}")
+        if not fields:
+            return self.ensure(uid)
+        keys = sorted(fields)
+        cols = ", ".join(keys)
+        params = ", ".join(f"${i}" for i in range(2, len(keys) + 2))
+        sets = ", ".join(f"{k} = EXCLUDED.{k}" for k in keys)
+        with self._cursor() as cur:
+            self._execute(cur, "users_upd_" + "_".join(keys),
+                          f"INSERT INTO bot_users (uid, {cols}) VALUES ($1, {params}) "
+                          f"ON CONFLICT (uid) DO UPDATE SET {sets} "
+                          f"RETURNING {self._COLS}",
+                          (int(uid), *(fields[k] for k in keys)))
+            rec = self._row(cur.fetchone())
+        if self.on_change:
+            self.on_change(str(uid), fields)
+        return rec
+
+    @spanned("users.update_many")
+    def update_many(self, items) -> int:
+        """
+        Один upsert на пачку с одинаковым набором полей (execute_values),
+        вся пачка — одна транзакция.
+        """
+        from psycopg2.extras import execute_values
+
+        merged = {}    # один uid дважды в одном INSERT … ON CONFLICT нельзя
+        for uid, fields in items:
+            unknown = set(fields) - set(FIELDS)
+            if unknown:
+                raise ValueError(f"unknown user fields: {sorted(unknown)}")
+            merged.setdefault(str(uid), {}).update(fields)
+        groups = {}
+        for uid, fields in merged.items():
+            if fields:
+                groups.setdefault(tuple(sorted(fields)), []).append((uid, fields))
+        with self._cursor() as cur:
+            for keys, rows in groups.items():
+                sets = ", ".join(f"{k} = EXCLUDED.{k}" for k in keys)
+                execute_values(cur, f"INSERT INTO bot_users (uid, {', '.join(keys)}) VALUES %s "
+                                    f"ON CONFLICT (uid) DO UPDATE SET {sets}",
+                               [(int(uid), *(fields[k] for k in keys)) for uid, fields in rows],
+                               page_size=1000)
+        n = 0
+        for rows in groups.values():
+            for uid, fields in rows:
+                if self.on_change:
+                    self.on_change(uid, fields)
+                n += 1
+        return n
+
+    def counts(self) -> dict:
+        with self._cursor() as cur:
+            self._execute(cur, "users_counts", f"SELECT total, {', '.join(COUNTED)} FROM bot_user_counts", ())
+            row = cur.fetchone()
+        return dict(zip(("total",) + COUNTED, row or (0,) * (len(COUNTED) + 1)))
+
+    def count(self, field: str = None) -> int:
+        if field is not None and field not in FIELDS:
+            raise ValueError(f"unknown user field: {field}")
+        if field is None or field in COUNTED:
+            return self.counts()["total" if field is None else field]
+        # остальные поля — текстовые (name, phone): «истинное» — непустое, как в JsonUserStore
+        with self._cursor() as cur:
+            self._execute(cur, f"users_count_{field}",
+                          f"SELECT count(*) FROM bot_users WHERE {field} <> ''", ())
+            return cur.fetchone()[0]
+
+    def iter_records(self, batch: int = 2000):
+        """Страницами по uid (uid > последнего): короткая транзакция на страницу, соединение не держим."""
+        after = -2**63
+        while True:
+            with self._cursor() as cur:
+                self._execute(cur, "users_page",
+                              f"SELECT uid, {self._COLS} FROM bot_users WHERE uid > $1 ORDER BY uid LIMIT $2",
+                              (after, batch))
+                rows = cur.fetchall()
+            for row in rows:
+                yield str(row[0]), self._row(row[1:])
+            if len(rows) < batch:
+                return
+            after = rows[-1][0]
+
+    def iter_uids(self, field: str = None, after: int = None, batch: int = 5000):
+        if field is not None and field not in FIELDS:
+            raise ValueError(f"unknown user field: {field}")
+        cond = f" AND {field}" if field else ""
+        after = after if after is not None else -2**63
+        while True:
+            with self._cursor() as cur:
+                self._execute(cur, f"uids_page_{field or 'all'}",
+                              f"SELECT uid FROM bot_users WHERE active AND uid > $1{cond} ORDER BY uid LIMIT $2",
+                              (after, batch))
+                uids = [uid for (uid,) in cur.fetchall()]
+            yield from uids
+            if len(uids) < batch:
+                return
+            after = uids[-1]
+
+    def find_by_phones(self, phones, chunk: int = 10000):
+        phones = list(phones)
+        for i in range(0, len(phones), chunk):
+            with self._cursor() as cur:
+                self._execute(cur, "users_by_phone",
+                              f"SELECT uid, {self._COLS} FROM bot_users WHERE phone = ANY($1::text[])",
+                              (phones[i:i + chunk],))
+                rows = cur.fetchall()
+            for row in rows:
+                yield str(row[0]), self._row(row[1:])
+
+    def bulk_load(self, records, chunk: int = 50000) -> int:
+        """
+        Массовая загрузка пар (uid, запись) через COPY во временную таблицу
+        и один upsert в bot_users. Память — один чанк CSV.
+        """
+        n = 0
+        with self._cursor() as cur:
+            cur.execute("CREATE TEMP TABLE bot_users_import "
+                        "(LIKE bot_users INCLUDING DEFAULTS) ON COMMIT DROP")
+            buf = io.StringIO()
+            w = csv.writer(buf)
+
+            def _copy():
+                buf.seek(0)
+                cur.copy_expert(f"COPY bot_users_import (uid, {self._COLS}) "
+                                f"FROM STDIN WITH (FORMAT csv)", buf)
+                buf.seek(0)
+                buf.truncate()
+
+            for uid, rec in records:
+                rec = normalize_record(rec)
+                w.writerow([int(uid)] + [rec[k] for k in FIELDS])
+                n += 1
+                if n % chunk == 0:
+                    _copy()
+            if buf.tell():
+                _copy()
+            sets = ", ".join(f"{k} = EXCLUDED.{k}" for k in FIELDS)
+            cur.execute(f"INSERT INTO bot_users (uid, {self._COLS}) "
+                        f"SELECT uid, {self._COLS} FROM bot_users_import "
+                        f"ON CONFLICT (uid) DO UPDATE SET {sets}")
+        return n
+
+    def close(self):
+        self._pool.closeall()
+
+
+# ─────────────── миграция users.json -> Postgres ───────────────
+# python storage.py import-json [users.json]   (DSN берётся из DATABASE_URL)
+if __name__ == "__main__":
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(override=True)
+    except ImportError:
+        pass
+
+    if len(sys.argv) < 2 or sys.argv[1] != "import-json":
+        raise SystemExit("usage: python storage.py import-json [users.json]")
+    dsn = (os.getenv("DATABASE_URL") or "").strip()
+    if not dsn:
+        raise SystemExit("DATABASE_URL не задан")
+    src = sys.argv[2] if len(sys.argv) > 2 else "users.json"
+
+    data, _ = read_users_file(src)
+    store = PostgresUserStore(dsn)
+    t0 = time.monotonic()
+    n = store.bulk_load(data.items())
+    store.close()
+    print(f"Импортировано пользователей: {n} за {time.monotonic() - t0:.1f} c")
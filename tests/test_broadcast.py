@@ -0,0 +1,18 @@
+"""Broadcast: watermark по uid и работа при сбоях checkpoint/колбэков."""
+from broadcast import Broadcast, new_job
+
+
+def test_broadcast_survives_failing_checkpoint_and_progress(tmp_path):
+    sent = []
+
+    def progress(job, stats):
+        raise RuntimeError("admin chat is gone")
+
+    job = new_job("all", admin_chat=1)
+    b = Broadcast(job, send=lambda uid, job: sent.append(uid), iter_uids=lambda field, after: iter(range(1, 101)),
+                  on_progress=progress, path=str(tmp_path / "missing" / "broadcast.json"),
+                  threads=2, save_every=0, progress_every=0)
+    b.start().join(5)
+    assert not b.running
+    assert sorted(sent) == list(range(1, 101))
+    assert job["status"] == "done" and job["sent"] == 100 and job["after"] == 100
@@ -0,0 +1,27 @@
+"""Импорт whitelist из CSV (bulk.py): повторы между пачками, имена владельцев."""
+import io
+
+import bulk
+from bulk import import_phones, read_rows
+from phones import PhoneWhitelist
+from storage import JsonUserStore
+
+
+def test_import_appends_each_phone_once_and_sets_names(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, "IMPORT_CHUNK", 2)
+    wl_path = tmp_path / "phones.txt"
+    wl_path.write_text("+994500000001\n", encoding="utf-8")
+    whitelist = PhoneWhitelist(str(wl_path))
+    users = JsonUserStore(str(tmp_path / "users.json"), flush_interval=3600, compact_interval=3600)
+    users.update(7, phone="+994500000002", name="old")
+    users.update(8, phone="+994500000003")
+
+    csv_text = ("phone;name\n+994500000001;\n+994500000002;Anna\n"
+                "+994500000003;\n+994500000004;\nnot a phone;\n+994500000002;\n")
+    st = import_phones(read_rows(io.StringIO(csv_text)), users, whitelist)
+
+    lines = wl_path.read_text(encoding="utf-8").split()
+    assert sorted(lines) == ["+994500000001", "+994500000002,Anna", "+994500000003", "+994500000004"]
+    assert st["rows"] == 6 and st["bad"] == 1 and st["added"] == 3 and st["names"] == 1
+    assert users.get(7)["name"] == "Anna" and users.get(8)["name"] == ""
+    users.close()
@@ -0,0 +1,101 @@
+"""UpdateCheckpoint и ShardedExecutor."""
+import json
+import threading
+
+from dispatch import ShardedExecutor, UpdateCheckpoint
+
+
+def upd(update_id: int) -> dict:
+    return {"update_id": update_id, "message": {"text": str(update_id)}}
+
+
+def test_offset_acknowledges_taken_updates(tmp_path):
+    cp = UpdateCheckpoint(str(tmp_path / "offset"))
+    assert cp.offset() is None
+    for i in (10, 11, 12):
+        assert cp.take(i, upd(i))
+    # медленный 10 не держит приём: Telegram подтверждаем всё взятое
+    assert cp.offset() == 13
+    assert not cp.take(11, upd(11))
+    assert cp.stats()["duplicates"] == 1
+
+
+def test_done_watermark_waits_for_oldest(tmp_path):
+    cp = UpdateCheckpoint(str(tmp_path / "offset"))
+    for i in (10, 11, 12):
+        cp.take(i, upd(i))
+    cp.finish(11)
+    cp.finish(12)
+    assert cp.done == 9
+    cp.finish(10)
+    assert cp.done == 12
+    cp.finish(999)          # чужой update_id (вебхук) — игнорируется
+    assert cp.done == 12
+
+
+def test_finish_ignores_ids_never_taken(tmp_path):
+    cp = UpdateCheckpoint(str(tmp_path / "offset"))
+    cp.take(10, upd(10))
+    cp.take(12, upd(12))
+    cp.finish(11)           # вебхук во время переключения — id из середины
+    cp.finish(11)
+    assert cp._finished == set() and cp.done == 9
+    cp.finish(12)
+    cp.finish(10)
+    assert cp.done == 12 and cp.stats()["inflight"] == 0
+
+
+def test_restart_replays_unfinished(tmp_path):
+    path = str(tmp_path / "offset")
+    cp = UpdateCheckpoint(path)
+    for i in range(1, 6):
+        cp.take(i, upd(i))
+    for i in (2, 4, 5):
+        cp.finish(i)
+    cp.close()
+    saved = json.load(open(path))
+    assert saved["done"] == 0 and saved["taken"] == 5
+
+    cp = UpdateCheckpoint(path)
+    assert cp.offset() == 6
+    assert not cp.take(3)                       # Telegram прислал повторно — уже взят
+    assert [u["update_id"] for u in cp.replay()] == [1, 3]
+    assert cp.replay() == []
+    cp.finish(1)
+    cp.finish(3)
+    assert cp.done == 5
+    cp.close()
+
+    cp = UpdateCheckpoint(path)
+    assert cp.replay() == [] and cp.offset() == 6
+
+
+def test_legacy_integer_checkpoint(tmp_path):
+    path = tmp_path / "offset"
+    path.write_text("41")
+    cp = UpdateCheckpoint(str(path))
+    assert cp.offset() == 42 and cp.replay() == []
+    assert not cp.take(41)
+    assert cp.take(42)
+
+
+def test_executor_starts_on_first_submit():
+    seen = []
+    done = threading.Event()
+    ex = ShardedExecutor(lambda item: (seen.append(item), done.set()), workers=2)
+    assert ex.submit("x")
+    assert done.wait(2)
+    assert seen == ["x"] and ex.stats()["workers"] == 2
+    ex.start()              # повторный start() новых воркеров не заводит
+    assert len(ex._threads) == 2
+    ex.shutdown(timeout=2)
+
+
+def test_executor_keeps_order_per_key():
+    seen = []
+    ex = ShardedExecutor(seen.append, key=lambda item: item[0], workers=4).start()
+    for i in range(100):
+        ex.submit(("a", i), wait=True)
+    ex.join()
+    assert [i for k, i in seen if k == "a"] == list(range(100))
+    ex.shutdown(timeout=2)
@@ -0,0 +1,68 @@
+"""OTP: выдача, лимиты, попытки — в памяти и в Postgres (если задан DATABASE_URL)."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from otp import MSG_BLOCKED, MSG_NOT_ISSUED, MemoryOtpStore, PostgresOtpStore
+
+LIMITS = dict(ttl=60, length=6, attempts=3, user_max=2, user_window=600, global_rate=100, global_burst=100)
+DATABASE_URL = os.getenv("DATABASE_URL")
+PG_UID = 9_000_000_101
+
+
+@pytest.fixture(params=["memory", "postgres"])
+def store(request):
+    if request.param == "memory":
+        yield MemoryOtpStore(**LIMITS)
+        return
+    if not DATABASE_URL:
+        pytest.skip("DATABASE_URL не задан")
+    from storage import PostgresUserStore
+    db = PostgresUserStore(DATABASE_URL)
+    s = PostgresOtpStore(db, **LIMITS)
+    with db._cursor() as cur:
+        cur.execute("DELETE FROM bot_otp WHERE uid = %s", (PG_UID,))
+    yield s
+    with db._cursor() as cur:
+        cur.execute("DELETE FROM bot_otp WHERE uid = %s", (PG_UID,))
+    db.close()
+
+
+def test_issue_and_verify(store):
+    assert store.check(PG_UID, "000000") == (False, MSG_NOT_ISSUED)
+    code, wait = store.issue(PG_UID)
+    assert wait == 0 and len(code) == 6 and code.isdigit()
+    assert store.check(PG_UID, code) == (True, "")
+    assert store.check(PG_UID, code) == (False, MSG_NOT_ISSUED)
+
+
+def test_wrong_codes_block(store):
+    code, _ = store.issue(PG_UID)
+    wrong = "x" * 6
+    ok, msg = store.check(PG_UID, wrong)
+    assert not ok and msg.endswith("2")
+    store.check(PG_UID, wrong)
+    assert store.check(PG_UID, wrong) == (False, MSG_BLOCKED)
+    assert store.check(PG_UID, code) == (False, MSG_NOT_ISSUED)
+
+
+def test_user_limit(store):
+    assert store.issue(PG_UID)[0]
+    assert store.issue(PG_UID)[0]
+    code, wait = store.issue(PG_UID)
+    assert code is None and 0 < wait <= LIMITS["user_window"] + 1
+
+
+def test_concurrent_first_issues_respect_limit(store):
+    with ThreadPoolExecutor(8) as pool:
+        codes = [code for code, _ in pool.map(lambda _: store.issue(PG_UID), range(8))]
+    assert sum(1 for c in codes if c) == LIMITS["user_max"]
+
+
+def test_concurrent_wrong_attempts_are_counted(store):
+    store.issue(PG_UID)
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(lambda _: store.check(PG_UID, "x" * 6), range(6)))
+    assert sum(1 for _, msg in results if msg == MSG_BLOCKED) == 1
+    assert sum(1 for _, msg in results if msg == MSG_NOT_ISSUED) == 3
@@ -0,0 +1,70 @@
+"""Router: команды, content_type, шаги диалога, callback по точным данным и префиксу."""
+import time
+
+import pytest
+from telebot import types
+
+from router import Router
+
+USER = {"id": 42, "is_bot": False, "first_name": "u"}
+
+
+def message(**extra):
+    msg = {"message_id": 1, "date": int(time.time()), "chat": {"id": 42, "type": "private"}, "from": USER}
+    return types.Update.de_json({"update_id": 1, "message": dict(msg, **extra)})
+
+
+def callback(data: str):
+    return types.Update.de_json({"update_id": 2, "callback_query": {
+        "id": "1", "from": USER, "chat_instance": "1", "data": data}})
+
+
+@pytest.fixture
+def router():
+    state = {}
+    r = Router(state_of=state.get)
+    r.state_table = state
+    r.command("start")(lambda m: "start")
+    r.command("menu")(lambda m: "menu")
+    r.content("contact")(lambda m: "contact")
+    r.state("search")(lambda m: "search")
+    r.callback(prefix="lang")(lambda c: "lang")
+    r.callback("back")(lambda c: "back")
+    r.default_message(lambda m: "other")
+    r.default_callback(lambda c: "default_cb")
+    return r
+
+
+def test_commands_and_content(router):
+    assert router.dispatch(message(text="/start")) == "start"
+    assert router.dispatch(message(text="/menu@my_bot extra")) == "menu"
+    assert router.dispatch(message(contact={"phone_number": "+1", "first_name": "u"})) == "contact"
+    assert router.dispatch(message(text="/unknown")) == "other"
+
+
+def test_state_only_for_plain_text(router):
+    assert router.dispatch(message(text="sticks")) == "other"
+    router.state_table[42] = "search"
+    assert router.dispatch(message(text="sticks")) == "search"
+    assert router.dispatch(message(text="/start")) == "start"
+
+
+def test_callbacks(router):
+    assert router.dispatch(callback("back")) == "back"
+    assert router.dispatch(callback("lang_ru")) == "lang"
+    assert router.dispatch(callback("video_1")) == "default_cb"
+
+
+def test_duplicate_route_rejected(router):
+    with pytest.raises(ValueError):
+        router.command("start")(lambda m: None)
+
+
+def test_include_fills_only_missing_routes(router):
+    own = Router()
+    own.command("start")(lambda m: "own start")
+    own.include(router, lambda handler: lambda arg: "wrapped " + handler(arg))
+    assert own.dispatch(message(text="/start")) == "own start"
+    assert own.dispatch(message(text="/menu")) == "wrapped menu"
+    assert own.dispatch(callback("lang_ru")) == "wrapped lang"
+    assert own.dispatch(message(text="hi")) == "wrapped other"
@@ -0,0 +1,41 @@
+"""SearchIndex: свёртка написаний, точные, префиксные и нечёткие совпадения."""
+from search import SearchIndex, fold, tokenize
+
+KEYWORDS = {
+    "sticks": ["sticks", "палки"],
+    "wheel": ["wheel", "колесо"],
+    "jump_rope": ["jump rope", "скакалка"],
+    "rope_climb": ["rope climb"],
+}
+TITLES = {"ru": {"sticks": "Стики", "wheel": "Ролик для пресса"}, "en": {"wheel": "Ab wheel"}}
+
+
+def test_fold_brings_spellings_together():
+    assert fold("sticks") == fold("stiks")
+    assert tokenize("Стики") == tokenize("stiki")
+    assert fold("Şəki") == fold("sheki")
+    assert tokenize("a, bb ccc!") == ["bb", "kkk"]
+
+
+def test_exact_and_transliterated():
+    idx = SearchIndex(KEYWORDS, TITLES)
+    assert len(idx) == 4
+    assert idx.search("sticks")[0] == "sticks"
+    assert idx.search("стики")[0] == "sticks"
+    assert idx.search("колесо") == ["wheel"]
+    assert idx.search("пресс")[0] == "wheel"      # префикс заголовка
+
+
+def test_typos():
+    idx = SearchIndex(KEYWORDS, TITLES)
+    assert idx.search("skakalak")[0] == "jump_rope"
+    assert idx.search("wheeel") == ["wheel"]
+    assert idx.search("zzzz") == []
+    assert idx.search("") == [] and idx.search("!") == []
+
+
+def test_phrase_ranks_above_single_word():
+    idx = SearchIndex(KEYWORDS, TITLES)
+    assert idx.search("rope climb")[0] == "rope_climb"
+    assert idx.search("jump rope")[0] == "jump_rope"
+    assert set(idx.search("rope")) == {"jump_rope", "rope_climb"}
@@ -0,0 +1,73 @@
+"""ConversationStore поверх SQLite: LRU, запись сразу в базу, update без потерь при гонке."""
+import threading
+import time
+
+from state import ConversationStore, SqliteStateBackend
+
+
+def test_persisted_and_reloaded(tmp_path):
+    path = str(tmp_path / "state.db")
+    cs = ConversationStore(SqliteStateBackend(path), hot_size=2)
+    cs.set(1, lang="az", state="main", name="Anna")
+    cs.update(1, state="search")
+    for uid in (2, 3, 4):
+        cs.set(uid, lang="ru")          # 1 вытеснен из LRU
+    assert cs.get(1) == {"lang": "az", "state": "search", "name": "Anna"}
+    assert cs.state(5) is None and cs.lang(5) == "ru"
+    cs.close()
+
+    cs = ConversationStore(SqliteStateBackend(path))
+    assert cs.state(1) == "search"
+    cs.close()
+
+
+def test_concurrent_updates_keep_both_fields(tmp_path):
+    cs = ConversationStore(SqliteStateBackend(str(tmp_path / "state.db")))
+    cs.set(1, lang="ru")
+
+    def write(field):
+        for i in range(200):
+            cs.update(1, **{field: f"{field}{i}"})
+
+    threads = [threading.Thread(target=write, args=(f,)) for f in ("state", "name")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cs.invalidate(1)
+    assert cs.get(1) == {"lang": "ru", "state": "state199", "name": "name199"}
+    cs.close()
+
+
+def test_stale_load_does_not_overwrite_write(tmp_path):
+    backend = SqliteStateBackend(str(tmp_path / "state.db"))
+    cs = ConversationStore(backend)
+    cs.set(1, state="main")
+    cs.invalidate(1)
+    load = backend.load
+
+    def slow_load(uid):
+        row = load(uid)                 # прочитали старую запись…
+        cs.set(uid, state="search")     # …а тем временем её переписали
+        return row
+
+    backend.load = slow_load
+    cs.state(1)
+    backend.load = load
+    assert cs.state(1) == "search"
+    cs.close()
+
+
+def test_other_process_write_resets_lru(tmp_path):
+    path = str(tmp_path / "state.db")
+    a = ConversationStore(SqliteStateBackend(path, poll=0.05))
+    b = ConversationStore(SqliteStateBackend(path, poll=0.05))
+    a.set(1, state="main")
+    assert b.state(1) == "main"
+    a.set(1, state="search")
+    deadline = time.monotonic() + 2
+    while b.state(1) != "search" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert b.state(1) == "search" and b.stats()["resets"] >= 1
+    a.close()
+    b.close()
@@ -0,0 +1,156 @@
+"""Хранилища пользователей (storage.py); тесты Postgres — только с DATABASE_URL."""
+import json
+import os
+
+import pytest
+
+from storage import JsonUserStore, PostgresUserStore, iter_journal
+
+
+def open_store(path, **kw):
+    # фоновый писатель не нужен: flush/compact зовём сами
+    kw.setdefault("flush_interval", 3600)
+    kw.setdefault("compact_interval", 3600)
+    return JsonUserStore(str(path), **kw)
+
+
+def test_round_trip_through_journal(tmp_path):
+    path = tmp_path / "users.json"
+    s = open_store(path)
+    s.update(1, name="Anna", phone="+994501111111", phone_ok=True)
+    s.update(2, name="Bob")
+    s.ensure(3)
+    assert s.flush() == 3
+    assert [k for k, _ in iter_journal(str(path) + ".journal")] != []
+    s._stop.set()          # без close(): как после падения — снапшота нет, есть журнал
+
+    s = open_store(path)
+    assert s.get(1)["name"] == "Anna" and s.get(1)["phone_ok"] is True
+    assert s.get("2")["name"] == "Bob"
+    assert 3 in s and 4 not in s
+    assert s.get(4, {}) == {}
+    assert len(s) == 3
+    s.close()
+
+
+def test_compact_moves_journal_into_snapshot(tmp_path):
+    path = tmp_path / "users.json"
+    s = open_store(path)
+    for uid in range(1, 101):
+        s.update(uid, name=f"u{uid}", verified=uid % 2 == 0)
+    s.compact()
+    assert os.path.exists(str(path) + ".snap")
+    assert os.path.getsize(str(path) + ".journal") == 0
+    s.update(5, name="changed")
+    s.close()
+
+    s = open_store(path)
+    assert len(s) == 100
+    assert s.get(5)["name"] == "changed"
+    assert s.get(100)["name"] == "u100"
+    assert sorted(int(k) for k, _ in s.iter_records()) == list(range(1, 101))
+    s.close()
+
+
+def test_legacy_users_json_is_migrated(tmp_path):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({"7": "Old Name", "8": {"name": "N", "verified": True}}), encoding="utf-8")
+    s = open_store(path)
+    assert s.get(7)["name"] == "Old Name" and s.get(7)["active"] is True
+    assert s.count("verified") == 1
+    s.close()
+    assert os.path.exists(str(path) + ".snap")
+
+    s = open_store(path)
+    assert s.get(8)["verified"] is True
+    s.close()
+
+
+def test_counts_follow_updates(tmp_path):
+    s = open_store(tmp_path / "users.json")
+    s.update(1, verified=True, phone_ok=True)
+    s.update(2, phone_ok=True)
+    s.update(3, active=False)
+    assert s.counts() == {"total": 3, "verified": 1, "phone_ok": 2, "active": 2}
+    s.update(1, verified=False)
+    s.update(3, active=True)
+    assert s.counts() == {"total": 3, "verified": 0, "phone_ok": 2, "active": 3}
+    s.compact()
+    s.close()
+
+    s = open_store(tmp_path / "users.json")
+    assert s.counts() == {"total": 3, "verified": 0, "phone_ok": 2, "active": 3}
+    assert list(s.iter_uids("phone_ok")) == [1, 2]
+    assert list(s.iter_uids(after=1)) == [2, 3]
+    s.close()
+
+
+def test_update_many_and_find_by_phones(tmp_path):
+    s = open_store(tmp_path / "users.json")
+    changes = []
+    s.on_change = lambda uid, fields: changes.append((uid, fields))
+    assert s.update_many([(1, {"phone": "+1"}), (2, {"phone": "+2"}), (3, {"phone": "+3"})]) == 3
+    assert sorted(uid for uid, _ in s.find_by_phones(["+1", "+3", "+9"])) == ["1", "3"]
+    assert changes[0] == ("1", {"phone": "+1"})
+    s.update_many([(uid, {"phone_ok": True}) for uid in ("1", "3")])
+    assert s.count("phone_ok") == 2
+    s.close()
+
+
+def test_iter_uids_streams_in_uid_order(tmp_path):
+    s = open_store(tmp_path / "users.json")
+    for uid in (100, 9, 10):
+        s.update(uid, phone_ok=True)
+    s.compact()
+    s.update(50, phone_ok=True)             # только в памяти, между записями снапшота
+    s.update(10, active=False)              # в снапшоте активен — побеждает изменение
+    s.update(5, name="no phone")
+    assert list(s.iter_uids()) == [5, 9, 50, 100]
+    assert list(s.iter_uids("phone_ok", after=9)) == [50, 100]
+    s.close()
+
+
+# ─────────────── Postgres ───────────────
+# Нужна одноразовая база: DATABASE_URL=postgresql://localhost/bot_test pytest tests
+DATABASE_URL = os.getenv("DATABASE_URL")
+needs_pg = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL не задан")
+PG_UIDS = range(9_000_000_001, 9_000_000_006)
+
+
+@pytest.fixture
+def pg():
+    store = PostgresUserStore(DATABASE_URL)
+    with store._cursor() as cur:
+        cur.execute("DELETE FROM bot_users WHERE uid = ANY(%s)", (list(PG_UIDS),))
+    yield store
+    with store._cursor() as cur:
+        cur.execute("DELETE FROM bot_users WHERE uid = ANY(%s)", (list(PG_UIDS),))
+    store.close()
+
+
+@needs_pg
+def test_postgres_update_and_counts(pg):
+    a, b = PG_UIDS[0], PG_UIDS[1]
+    before = pg.counts()
+    pg.ensure(a)
+    rec = pg.update(a, name="Anna", phone="+994500000001", phone_ok=True)
+    assert rec["name"] == "Anna" and rec["phone_ok"] is True
+    assert pg.get(a)["phone"] == "+994500000001"
+    assert pg.update_many([(b, {"verified": True}), (a, {"verified": True})]) == 2
+    after = pg.counts()
+    assert after["total"] == before["total"] + 2
+    assert after["verified"] == before["verified"] + 2
+    assert after["phone_ok"] == before["phone_ok"] + 1
+    assert [uid for uid, _ in pg.find_by_phones(["+994500000001"])] == [str(a)]
+    assert pg.count("phone") >= 1 and pg.count("name") >= 1
+
+
+@needs_pg
+def test_postgres_bulk_load(pg):
+    rows = [(uid, {"name": f"u{uid}"}) for uid in PG_UIDS[2:]]
+    assert pg.bulk_load(rows) == 3
+    assert pg.get(PG_UIDS[4])["name"] == f"u{PG_UIDS[4]}"
+    assert pg.get(PG_UIDS[4])["active"] is True
+    after = PG_UIDS[2] - 1
+    assert [u for u in pg.iter_uids(after=after, batch=2) if u in PG_UIDS] == list(PG_UIDS[2:])
+    assert [int(k) for k, _ in pg.iter_records(batch=2) if int(k) in PG_UIDS] == list(PG_UIDS[2:])
@@ -0,0 +1,267 @@
+"""
+Трассировка апдейтов, профилирование медленных и логи без блокировки хендлеров.
+
+Trace — один апдейт: update_id, пользователь, хендлер и спаны (вызовы
+Bot API, записи в хранилища, проверка доступа) — начало от старта апдейта
+и длительность. Текущий trace лежит в contextvars, поэтому span() из любого
+места (в том числе из обёртки HTTP-запросов) сам находит свой апдейт —
+и в потоках воркеров, и в задачах asyncio.
+
+Спаны и стеки trace меняются из нескольких потоков (воркер, пул
+asyncio.to_thread, профилировщик) — под trace.lock; to_dict и span_list
+читают копию под ней же. Хранилища отмечают свои записи декоратором
+spanned() прямо в классах.
+
+Апдейт дольше бюджета (slow_ms) пишется в лог «trace» одной JSON-строкой
+и попадает в кольцевой буфер recent (/slow). Профилировщик — фоновый поток:
+раз в interval он просматривает апдейты в работе и у тех, что идут дольше
+profile_after_ms, снимает стек их потока (sys._current_frames). Пока
+медленных нет, он только заглядывает в dict. profile_all() — по команде
+админа: стеки всех апдейтов в работе за заданное время одной сводкой.
+Стеки снимаются только с потоков воркеров: в asyncio-режиме все апдейты
+делят один поток, и стек нельзя приписать конкретному апдейту.
+
+setup_logging / queued_file_log — логи через QueueHandler: вызывающий
+поток только кладёт запись в очередь, в файл пишет поток QueueListener.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+
+STACK_DEPTH = 40     # кадров от вершины стека
+PROFILE_TOP = 10     # стеков в записи trace и в сводке profile_all
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def queued_file_log(logger: logging.Logger, filename: str, fmt: str, level=logging.INFO):
+    """
+    Записи logger -> filename; хендлер только кладёт запись в очередь, пишет поток QueueListener.
+    Возвращает stop(): дописать очередь и дальше (завершение процесса) писать в файл напрямую.
+    """
+    q = queue.SimpleQueue()
+    handler = logging.FileHandler(filename)
+    handler.setFormatter(logging.Formatter(fmt))
+    queued = logging.handlers.QueueHandler(q)
+    logger.setLevel(level)
+    logger.addHandler(queued)
+    listener = logging.handlers.QueueListener(q, handler, respect_handler_level=True)
+    listener.start()
+
+    def stop():
+        listener.stop()
+        logger.removeHandler(queued)
+        logger.addHandler(handler)
+    return stop
+
+
+def setup_logging(filename: str, level=logging.ERROR):
+    """Как logging.basicConfig(filename=...), но запись в файл — не в потоке хендлера; возвращает stop()."""
+    return queued_file_log(logging.getLogger(), filename, logging.BASIC_FORMAT, level)
+
+
+class Trace:
+    __slots__ = ("update_id", "uid", "kind", "handler", "thread", "sample", "t0", "ms", "spans", "stacks", "lock")
+
+    def __init__(self, update_id, uid=None, kind=None, sample: bool = True):
+        self.update_id = update_id
+        self.uid = uid
+        self.kind = kind
+        self.handler = None
+        self.thread = threading.get_ident()
+        self.sample = sample
+        self.t0 = time.perf_counter()
+        self.ms = None
+        self.spans = []          # (имя, начало с, длительность с, атрибуты)
+        self.stacks = None       # Counter свёрнутых стеков, если профилировали
+        self.lock = threading.Lock()
+
+    def span_list(self) -> list:
+        with self.lock:
+            return list(self.spans)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            spans = list(self.spans)
+            profile = dict(self.stacks.most_common(PROFILE_TOP)) if self.stacks else None
+        d = {"update": self.update_id, "uid": self.uid, "kind": self.kind, "handler": self.handler,
+             "ms": round(self.ms, 1), "at": int(time.time()),
+             "spans": [[name, round(start * 1000, 1), round(dur * 1000, 1)] + ([attrs] if attrs else [])
+                       for name, start, dur, attrs in spans]}
+        if profile:
+            d["profile"] = profile
+        return d
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Спан в текущем trace; вне апдейта — ничего не делает."""
+    tr = _current.get()
+    if tr is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with tr.lock:
+            tr.spans.append((name, t - tr.t0, end - t, attrs or None))
+
+
+def traced(name: str, fn):
+    """fn, каждый вызов которого — спан name."""
+    @wraps(fn)
+    def call(*args, **kwargs):
+        with span(name):
+            return fn(*args, **kwargs)
+    return call
+
+
+def spanned(name: str):
+    """Декоратор traced(): @spanned("users.update") над методом хранилища."""
+    return lambda fn: traced(name, fn)
+
+
+def fold_stack(frame) -> str:
+    """Стек в свёрнутом виде (flamegraph): «файл:функция;…» от корня к вершине."""
+    names = []
+    while frame is not None and len(names) < STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Tracer:
+    def __init__(self, slow_ms: float = 1000, profile_after_ms: float = None, interval: float = 0.01,
+                 keep: int = 50, log_file: str = None):
+        """
+        slow_ms          — бюджет апдейта: дольше — в лог и в recent;
+        profile_after_ms — с какого времени апдейта снимать стеки (по умолчанию половина бюджета,
+                           0 — не профилировать);
+        interval         — период профилировщика;
+        log_file         — JSON-строки медленных апдейтов (лог «trace»).
+        """
+        self.slow_ms = slow_ms
+        self.profile_after = (slow_ms / 2 if profile_after_ms is None else profile_after_ms) / 1000
+        self.interval = interval
+        self.recent = deque(maxlen=keep)
+        self.log = logging.getLogger("trace")
+        self._stop_log = None
+        if log_file:
+            self.log.propagate = False
+            self._stop_log = queued_file_log(self.log, log_file, "%(message)s")
+        self.counters = {"traces": 0, "slow": 0, "samples": 0}
+
+        self._lock = threading.Lock()
+        self._active: dict = {}          # id(trace) -> trace
+        self._window = None              # сводка profile_all
+        self._window_until = 0.0
+        self._window_done = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    # ─────────────── апдейты ───────────────
+    @contextmanager
+    def trace(self, update_id, uid=None, kind=None, sample: bool = True):
+        tr = Trace(update_id, uid, kind, sample)
+        token = _current.set(tr)
+        with self._lock:
+            self._active[id(tr)] = tr
+        try:
+            yield tr
+        finally:
+            _current.reset(token)
+            with self._lock:
+                self._active.pop(id(tr), None)
+            tr.ms = (time.perf_counter() - tr.t0) * 1000
+            slow = tr.ms >= self.slow_ms
+            with self._lock:
+                self.counters["traces"] += 1
+                if slow:
+                    self.counters["slow"] += 1
+            if slow:
+                self.recent.append(tr)
+                try:
+                    self.log.warning(json.dumps(tr.to_dict(), ensure_ascii=False, default=str))
+                except Exception as e:
+                    logging.error(f"trace log error: {e}")
+
+    # ─────────────── профилировщик ───────────────
+    def profile_all(self, seconds: float, done):
+        """Снимать стеки всех апдейтов в работе seconds секунд; done(сводка) — из потока профилировщика."""
+        with self._lock:
+            if self._window_done is not None:
+                return False
+            self._window = Counter()
+            self._window_until = time.perf_counter() + seconds
+            self._window_done = done
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                logging.error(f"profiler error: {e}")
+
+    def _sample(self):
+        now = time.perf_counter()
+        with self._lock:
+            window = self._window if now < self._window_until else None
+            finished = self._window_done if window is None and self._window_done is not None else None
+            if finished is not None:
+                summary, self._window, self._window_done = self._window, None, None
+            after = self.profile_after if self.profile_after > 0 else float("inf")
+            targets = [tr for tr in self._active.values()
+                       if tr.sample and (window is not None or now - tr.t0 >= after)]
+        if finished is not None:
+            finished(summary.most_common(PROFILE_TOP))
+        if not targets:
+            return
+        frames = sys._current_frames()
+        samples = 0
+        for tr in targets:
+            frame = frames.get(tr.thread)
+            if frame is None:
+                continue
+            stack = fold_stack(frame)
+            with tr.lock:
+                if tr.stacks is None:
+                    tr.stacks = Counter()
+                tr.stacks[stack] += 1
+            if window is not None:           # сводку меняет и забирает только этот поток
+                window[stack] += 1
+            samples += 1
+        with self._lock:
+            self.counters["samples"] += samples
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "active": len(self._active), "slow_ms": self.slow_ms,
+                    "profiling": self._window_done is not None}
+
+    def close(self):
+        self._stop.set()
+        if self._stop_log is not None:
+            self._stop_log()